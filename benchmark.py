@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Crawl throughput benchmark against a local mock novel site.
+
+Starts an HTTP server that serves synthetic books in the HTML shapes of the sites in
+biquge_epub_creator.SITE_CONFIGS (bqg5, 69shuba, dxmwx and ixdzs8, including the
+ixdzs8 POST JSON chapter list), points the crawler at it through an HTTP proxy
+setting and times each pipeline stage: chapter list, fetch, parse, clean and EPUB
+write (once per compression profile, with the resulting file size). It also measures the
+memory held by each book's chapter list as Chapter records against plain dicts. Results are appended as JSON lines tagged with the git commit so runs can be
+compared across commits.
+
+    python benchmark.py --chapters 200 --latency 20 --error-rate 0.01 --compare
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+
+import biquge_epub_creator as creator
+
+# --- Configuration ---
+DEFAULT_CHAPTERS = 100
+DEFAULT_CHAPTER_CHARS = 3000 # Approximate characters of text per chapter
+DEFAULT_LATENCY_MS = 0
+DEFAULT_ERROR_RATE = 0.0
+DEFAULT_RESULTS_FILE = "benchmark_results.jsonl"
+MOCK_BOOK_ID = 4242
+CHAPTER_ID_OFFSET = 50000 # Sites use chapter IDs unrelated to the chapter number
+FILLER_TEXT = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光"
+
+# Book URL the crawler is pointed at for each site, and the encoding the real site serves
+MOCK_SITES = {
+    "bqg5.com": {"book_url": "http://www.bqg5.com/0_{book_id}/", "encoding": "gbk", "renderer": "render_bqg5"},
+    "69shuba.com": {"book_url": "http://www.69shuba.com/book/{book_id}/", "encoding": "gbk", "renderer": "render_69shuba"},
+    "dxmwx.org": {"book_url": "http://www.dxmwx.org/book/{book_id}.html", "encoding": "utf-8", "renderer": "render_dxmwx"},
+    "ixdzs8.com": {"book_url": "http://ixdzs8.com/read/{book_id}/", "encoding": "utf-8", "renderer": "render_ixdzs8"},
+}
+
+# --- Synthetic Content ---
+
+def chapter_title(number):
+    return f"第{number}章 试炼之{FILLER_TEXT[number % len(FILLER_TEXT)]}"
+
+def chapter_paragraphs(number, chapter_chars):
+    """Deterministic filler paragraphs for a chapter, so every run serves identical bytes."""
+    rng = random.Random(number)
+    paragraphs = []
+    remaining = chapter_chars
+    while remaining > 0:
+        length = min(remaining, rng.randint(40, 160))
+        paragraphs.append(''.join(rng.choice(FILLER_TEXT) for _ in range(length)) + "。")
+        remaining -= length
+    return paragraphs
+
+def book_meta(site, book_id):
+    return f'''<meta property="og:title" content="模拟书{book_id}"/>
+<meta property="og:novel:book_name" content="模拟书{book_id}"/>
+<meta property="og:novel:author" content="模拟作者"/>
+<meta property="og:novel:status" content="连载中"/>
+<meta property="og:description" content="这是用于{site}基准测试的模拟小说。"/>'''
+
+class MockNovelSite:
+    """Renders the pages of every mock site. Hosts are told apart by the request's host name."""
+
+    def __init__(self, chapters, chapter_chars):
+        self.chapters = chapters
+        self.chapter_chars = chapter_chars
+
+    def render(self, host, path, method, form):
+        """Returns (status, content_type, body_text, encoding) for a request."""
+        for site, mock in MOCK_SITES.items():
+            if site in host:
+                return getattr(self, mock['renderer'])(path, method, form, mock['encoding'])
+        return 404, "text/plain", "unknown host", "utf-8"
+
+    def _page(self, encoding, head, body):
+        return 200, f"text/html; charset={encoding}", f'''<!DOCTYPE html>
+<html><head><meta charset="{encoding}"/>{head}
+<link rel="stylesheet" href="/static/site.css"/><script src="/static/ads.js"></script></head>
+<body><div class="header"><img src="/static/logo.png"/></div>{body}<div class="footer">Copyright</div></body></html>''', encoding
+
+    def render_bqg5(self, path, method, form, encoding):
+        # bqg5.com: index page /0_<id>/ holds metadata and the <dl> chapter list; chapters /0_<id>/<cid>.html
+        match = re.match(r'^/0_(\d+)/(?:(\d+)\.html)?$', path)
+        if not match:
+            return 404, "text/plain", "not found", "utf-8"
+        book_id, chapter_id = match.groups()
+        if chapter_id is None:
+            links = ''.join(f'<dd><a href="/0_{book_id}/{CHAPTER_ID_OFFSET + n}.html">{chapter_title(n)}</a></dd>' for n in range(1, self.chapters + 1))
+            body = f'''<div id="info"><h1>模拟书{book_id}</h1><p>作&nbsp;&nbsp;&nbsp;&nbsp;者：模拟作者</p></div>
+<div id="fmimg"><img src="/cover.jpg"/></div>
+<div id="list"><dl><dt>《模拟书{book_id}》正文</dt>{links}</dl></div>'''
+            return self._page(encoding, book_meta("bqg5", book_id), body)
+        number = int(chapter_id) - CHAPTER_ID_OFFSET
+        text = '<br /><br />'.join('&nbsp;&nbsp;&nbsp;&nbsp;' + p for p in chapter_paragraphs(number, self.chapter_chars))
+        body = f'''<div class="bookname"><h1>{chapter_title(number)}</h1></div>
+<div id="content">{text}<br /><br />天才一秒记住本站地址：www.bqg5.com 手机版阅读网址：m.bqg5.com</div>'''
+        return self._page(encoding, "", body)
+
+    def render_69shuba(self, path, method, form, encoding):
+        # 69shuba.com: metadata /book/<id>.htm, newest-first list /book/<id>/, chapters /txt/<id>/<cid>
+        if re.match(r'^/book/(\d+)\.htm$', path):
+            book_id = re.match(r'^/book/(\d+)\.htm$', path).group(1)
+            body = f'''<div class="booknav2"><h1><a href="/book/{book_id}/">模拟书{book_id}</a></h1><p>作者：<a href="#">模拟作者</a></p></div>
+<div class="bookimg2"><img src="/cover.jpg"/></div>'''
+            return self._page(encoding, book_meta("69shuba", book_id), body)
+        if re.match(r'^/book/(\d+)/$', path):
+            book_id = re.match(r'^/book/(\d+)/$', path).group(1)
+            links = ''.join(f'<li data-num="{n}"><a href="/txt/{book_id}/{CHAPTER_ID_OFFSET + n}">{chapter_title(n)}</a></li>'
+                            for n in range(self.chapters, 0, -1))
+            return self._page(encoding, "", f'<div class="catalog" id="catalog"><ul>{links}</ul></div>')
+        match = re.match(r'^/txt/(\d+)/(\d+)$', path)
+        if not match:
+            return 404, "text/plain", "not found", "utf-8"
+        number = int(match.group(2)) - CHAPTER_ID_OFFSET
+        text = '<br />'.join('&emsp;&emsp;' + p for p in chapter_paragraphs(number, self.chapter_chars))
+        body = f'''<div class="mybox"><div class="txtnav"><h1 class="hide720">{chapter_title(number)}</h1>
+<div class="txtinfo hide720"><span>作者：模拟作者</span></div>{text}<br />小提示：按回车[Enter]键返回书目</div></div>'''
+        return self._page(encoding, "", body)
+
+    def render_dxmwx(self, path, method, form, encoding):
+        # dxmwx.org: metadata /book/<id>.html, list /chapter/<id>.html, chapters /read/<id>_<cid>.html
+        match = re.match(r'^/book/(\d+)\.html$', path)
+        if match:
+            book_id = match.group(1)
+            body = f'''<div style="float: left; width: 60%;"><div style="font-size: 24px;"><span>模拟书{book_id}</span></div>
+<div><a href="/list/1.html">模拟作者</a> 著</div></div><div class="imgwidth"><img src="/cover.jpg"/></div>'''
+            return self._page(encoding, book_meta("dxmwx", book_id), body)
+        match = re.match(r'^/chapter/(\d+)\.html$', path)
+        if match:
+            book_id = match.group(1)
+            latest = f'<span>最新章节：<a href="/read/{book_id}_{CHAPTER_ID_OFFSET + self.chapters}.html">{chapter_title(self.chapters)}</a></span>'
+            links = ''.join(f'<span><a href="/read/{book_id}_{CHAPTER_ID_OFFSET + n}.html">{chapter_title(n)}</a></span>' for n in range(1, self.chapters + 1))
+            return self._page(encoding, "", f'<div>{latest}</div><div style="height: 40px;">{links}</div>')
+        match = re.match(r'^/read/(\d+)_(\d+)\.html$', path)
+        if not match:
+            return 404, "text/plain", "not found", "utf-8"
+        number = int(match.group(2)) - CHAPTER_ID_OFFSET
+        text = ''.join(f'<p>{p}</p>' for p in chapter_paragraphs(number, self.chapter_chars))
+        body = f'<h1>{chapter_title(number)}</h1><div id="Lab_Contents">{text}<p>大熊猫文学 www.dxmwx.org</p></div>'
+        return self._page(encoding, "", body)
+
+    def render_ixdzs8(self, path, method, form, encoding):
+        # ixdzs8.com: metadata /read/<id>/, chapter list via POST /novel/clist/ (bid=<id>), chapters /read/<id>/p<n>.html
+        if path == '/novel/clist/' and method == 'POST':
+            data = [{"ctype": "1", "title": "正文卷", "ordernum": None}]
+            data += [{"ctype": "0", "title": chapter_title(n), "ordernum": str(n)} for n in range(1, self.chapters + 1)]
+            return 200, "application/json", json.dumps({"rs": 200, "data": data}, ensure_ascii=False), "utf-8"
+        match = re.match(r'^/read/(\d+)/?$', path)
+        if match:
+            book_id = match.group(1)
+            body = f'<div class="n-img"><img src="/cover.jpg"/></div><div class="n-text"><h1>模拟书{book_id}</h1><p>作者:<a href="#">模拟作者</a></p></div>'
+            return self._page(encoding, book_meta("ixdzs8", book_id), body)
+        match = re.match(r'^/read/(\d+)/p(\d+)\.html$', path)
+        if not match:
+            return 404, "text/plain", "not found", "utf-8"
+        number = int(match.group(2))
+        text = ''.join(f'<p>{p}</p>' for p in chapter_paragraphs(number, self.chapter_chars))
+        body = f'''<article class="page-content"><h3>{chapter_title(number)}</h3><section>{text}
+<ins class="eas6a97888e2"></ins><p>爱下电子书 ixdzs8.com</p></section></article>'''
+        return self._page(encoding, "", body)
+
+class MockNovelSiteHandler(BaseHTTPRequestHandler):
+    """Proxy-style handler: requests arrive with absolute URLs, as a forward proxy would see them."""
+
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real sites
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+    def _respond(self, method):
+        server = self.server
+        parsed = urllib.parse.urlparse(self.path)
+        host = parsed.netloc or self.headers.get('Host', '')
+        form = {}
+        if method == 'POST':
+            form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.rng_random() < server.error_rate:
+            status, content_type, text, encoding = 503, "text/plain", "Service Temporarily Unavailable", "utf-8"
+        else:
+            status, content_type, text, encoding = server.mock_site.render(host, parsed.path, method, form)
+        body = text.encode(encoding, errors='ignore')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # The benchmark measures the crawler, not request logging
+
+def start_mock_site(chapters, chapter_chars, latency_ms=0, error_rate=0.0, seed=0):
+    """Starts the mock site on a free local port in a daemon thread. Returns the server."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockNovelSiteHandler)
+    server.daemon_threads = True
+    server.mock_site = MockNovelSite(chapters, chapter_chars)
+    server.latency = latency_ms / 1000.0
+    server.error_rate = error_rate
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    def rng_random():
+        with rng_lock:
+            return rng.random()
+    server.rng_random = rng_random
+    threading.Thread(target=server.serve_forever, name="mock-novel-site", daemon=True).start()
+    return server
+
+def route_crawler_to_mock_site(server):
+    """Sends all crawler HTTP traffic through the mock site and switches the site configs to plain HTTP."""
+    proxy_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ['http_proxy'] = os.environ['HTTP_PROXY'] = proxy_url
+    os.environ.pop('no_proxy', None)
+    os.environ.pop('NO_PROXY', None)
+    for site_config in creator.SITE_CONFIGS.values():
+        site_config['base_url'] = site_config['base_url'].replace('https://', 'http://')
+
+# --- Benchmark Stages ---
+
+def stage_result(seconds, items, payload_bytes=0):
+    return {
+        'seconds': round(seconds, 4),
+        'items': items,
+        'items_per_second': round(items / seconds, 2) if seconds else None,
+        'mb_per_second': round(payload_bytes / seconds / 1e6, 3) if seconds and payload_bytes else None,
+    }
+
+def retained_size(objects):
+    """
+    Bytes held by a list of chapter dicts or Chapter records: each object plus the strings
+    it references, counting strings shared between chapters (dict keys, the interned URL
+    prefix) once. sys.getsizeof includes the GC header, so this is what the objects cost
+    whatever allocator free lists happen to hold.
+    """
+    seen = set()
+    total = sys.getsizeof(objects)
+    for chapter in objects:
+        if isinstance(chapter, dict):
+            referenced = [item for pair in chapter.items() for item in pair]
+        else:
+            referenced = [getattr(chapter, slot) for slot in creator.Chapter.__slots__]
+        for value in [chapter] + referenced:
+            if value is not None and id(value) not in seen:
+                seen.add(id(value))
+                total += sys.getsizeof(value)
+    return total
+
+def measure_chapter_memory(chapter_links):
+    """
+    Compares the memory held by a chapter list as creator.Chapter records and as the
+    {'title', 'url'} dicts the pipeline used before. Both are rebuilt from a JSON copy so
+    neither shares strings with the crawler's list. Returns bytes per chapter for each.
+    (tracemalloc deltas are not used: small dicts come from CPython's dict free list
+    untraced, which made short books look cheaper as dicts.)
+    """
+    serialized = json.dumps([{'title': chapter['title'], 'url': chapter['url']} for chapter in chapter_links], ensure_ascii=False)
+    dict_bytes = retained_size(json.loads(serialized))
+    record_bytes = retained_size([creator.Chapter(chapter['title'], chapter['url']) for chapter in json.loads(serialized)])
+    count = max(1, len(chapter_links))
+    return {'chapters': len(chapter_links), 'dict_bytes_per_chapter': round(dict_bytes / count, 1),
+            'record_bytes_per_chapter': round(record_bytes / count, 1)}
+
+def benchmark_site(site, output_dir):
+    """Runs every pipeline stage for the mock book of one site. Returns a dict of stage results."""
+    logger = logging.getLogger()
+    book_url = MOCK_SITES[site]['book_url'].format(book_id=MOCK_BOOK_ID)
+    site_config = creator.get_site_config(book_url, logger=logger)
+    book_url = creator.normalize_book_url(book_url, site_config)
+    results = {}
+
+    started = time.perf_counter()
+    index_html, metadata_html, metadata_url, chapter_list_fetch_url = creator.fetch_initial_pages(book_url, site_config, logger=logger)
+    title, author, description, cover_url = creator.get_book_details(metadata_html, metadata_url, site_config, logger=logger)
+    chapter_links = creator.get_chapter_links(index_html, chapter_list_fetch_url or book_url, site_config, logger=logger)
+    results['chapter_list'] = stage_result(time.perf_counter() - started, len(chapter_links))
+    results['chapter_memory'] = measure_chapter_memory(chapter_links)
+
+    started = time.perf_counter()
+    pages = [creator.fetch_url(chapter['url'], logger=logger) for chapter in chapter_links]
+    fetched = [(chapter, page) for chapter, page in zip(chapter_links, pages) if page]
+    results['fetch'] = stage_result(time.perf_counter() - started, len(fetched), sum(len(page.encode('utf-8')) for _, page in fetched))
+    results['fetch']['failed'] = len(chapter_links) - len(fetched)
+
+    started = time.perf_counter()
+    containers = [(chapter, creator.find_content_container(BeautifulSoup(page, 'html.parser'), site_config, logger=logger)) for chapter, page in fetched]
+    results['parse'] = stage_result(time.perf_counter() - started, len(containers), sum(len(page.encode('utf-8')) for _, page in fetched))
+
+    started = time.perf_counter()
+    chapters_content_data = [{'title': chapter['title'], 'content_html': creator.clean_html_content(container, site_config, logger=logger)}
+                             for chapter, container in containers if container]
+    content_bytes = sum(len(chapter['content_html'].encode('utf-8')) for chapter in chapters_content_data)
+    results['clean'] = stage_result(time.perf_counter() - started, len(chapters_content_data), content_bytes)
+
+    # One EPUB write per compression profile; the default profile keeps the 'epub_write' stage name
+    for compression in creator.COMPRESSION_PROFILES:
+        stage = 'epub_write' if compression == creator.DEFAULT_COMPRESSION_PROFILE else f'epub_{compression}'
+        started = time.perf_counter()
+        epub_path = creator.create_epub(title, author, description, chapters_content_data, metadata_url, None, output_dir,
+                                        logger=logger, output_filename=f"{site}.{compression}.epub", compression=compression)
+        results[stage] = stage_result(time.perf_counter() - started, len(chapters_content_data), content_bytes)
+        results[stage]['epub_bytes'] = os.path.getsize(epub_path)
+    return results
+
+# --- Result Storage and Comparison ---
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def load_previous_run(results_file, params):
+    """Returns the most recent stored run with the same parameters, or None."""
+    previous = None
+    try:
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                run = json.loads(line)
+                if run.get('params') == params:
+                    previous = run
+    except FileNotFoundError:
+        pass
+    return previous
+
+def print_report(run, previous=None):
+    print(f"\nBenchmark @ {run['commit'] or 'unknown commit'}  params: {json.dumps(run['params'], ensure_ascii=False)}")
+    if previous:
+        print(f"Compared with {previous['commit'] or 'unknown commit'} ({previous['timestamp']}); change in items/s in brackets.")
+    print(f"{'site':<12} {'stage':<13} {'seconds':>9} {'items/s':>10} {'MB/s':>8} {'EPUB MB':>8}")
+    for site, stages in run['results'].items():
+        for stage, result in stages.items():
+            if 'seconds' not in result:
+                continue # Not a timed stage (chapter_memory)
+            change = ''
+            old = (previous or {}).get('results', {}).get(site, {}).get(stage)
+            if old and old.get('items_per_second') and result.get('items_per_second'):
+                change = f" ({(result['items_per_second'] / old['items_per_second'] - 1) * 100:+.1f}%)"
+            epub_mb = f"{result['epub_bytes'] / 1e6:>8.2f}" if result.get('epub_bytes') else f"{'':>8}"
+            print(f"{site:<12} {stage:<13} {result['seconds']:>9.3f} {result['items_per_second'] or 0:>10.1f} {result['mb_per_second'] or 0:>8.2f} {epub_mb}{change}")
+    print(f"\n{'site':<12} {'chapters':>9} {'dict B/ch':>10} {'record B/ch':>12} {'saved':>7}")
+    for site, stages in run['results'].items():
+        memory = stages.get('chapter_memory')
+        if memory and memory['dict_bytes_per_chapter']:
+            saved = 1 - memory['record_bytes_per_chapter'] / memory['dict_bytes_per_chapter']
+            print(f"{site:<12} {memory['chapters']:>9} {memory['dict_bytes_per_chapter']:>10.1f} {memory['record_bytes_per_chapter']:>12.1f} {saved:>7.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the crawl pipeline against a local mock novel site.')
+    parser.add_argument('--sites', nargs='+', default=list(MOCK_SITES), choices=list(MOCK_SITES), help='Sites to benchmark (default: all)')
+    parser.add_argument('--chapters', type=int, default=DEFAULT_CHAPTERS, help=f'Chapters per mock book (default: {DEFAULT_CHAPTERS})')
+    parser.add_argument('--chapter-chars', type=int, default=DEFAULT_CHAPTER_CHARS, help=f'Approximate characters per chapter (default: {DEFAULT_CHAPTER_CHARS})')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY_MS, help='Added server latency per request in ms (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE, help='Fraction of requests answered with 503 (default: 0)')
+    parser.add_argument('--request-delay', type=float, default=0.0, help='Crawler REQUEST_DELAY during the run (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for injected errors (default: 0)')
+    parser.add_argument('--results', default=DEFAULT_RESULTS_FILE, help=f'JSON lines file results are appended to (default: {DEFAULT_RESULTS_FILE})')
+    parser.add_argument('--compare', action='store_true', help='Compare with the last stored run that used the same parameters')
+    parser.add_argument('--debug', action='store_true', help='Show crawler logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING, format='%(asctime)s - Bench - %(levelname)s - %(message)s', force=True)
+    logging.getLogger().setLevel(logging.INFO if args.debug else logging.WARNING)
+    creator.REQUEST_DELAY = args.request_delay
+    creator.RETRY_PASS_DELAY = args.request_delay
+
+    server = start_mock_site(args.chapters, args.chapter_chars, args.latency, args.error_rate, args.seed)
+    route_crawler_to_mock_site(server)
+
+    params = {'sites': args.sites, 'chapters': args.chapters, 'chapter_chars': args.chapter_chars, 'latency_ms': args.latency,
+              'error_rate': args.error_rate, 'request_delay': args.request_delay}
+    run = {'commit': current_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+           'params': params, 'results': {}}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for site in args.sites:
+            run['results'][site] = benchmark_site(site, output_dir)
+    server.shutdown()
+
+    previous = load_previous_run(args.results, params) if args.compare else None
+    print_report(run, previous)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run, ensure_ascii=False) + '\n')
+
+if __name__ == "__main__":
+    main()
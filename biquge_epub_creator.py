@@ -12,8 +12,33 @@ import json # Added for handling JSON chapter lists
 # import cgi # For FCGI handling (REPLACED with os/urllib.parse)
 import io # For in-memory file handling
 import tempfile # For temporary file creation
-from http.server import SimpleHTTPRequestHandler, HTTPServer # For dev server
+from http.server import SimpleHTTPRequestHandler, BaseHTTPRequestHandler, ThreadingHTTPServer # For dev server and broker endpoint
 import urllib.parse # For parsing URL in dev server
+import threading # For shared per-host throttling and batch workers
+import queue # For the watch mode build queue
+import hashlib # For chapter list page fingerprints in watch mode
+import sqlite3 # Shard queue for distributed crawling
+import socket # Worker IDs for distributed crawling
+import secrets # Tokens for the distributed broker endpoint
+import hmac # Constant-time broker token check
+import contextlib # Timing spans
+import functools # Timing decorator
+import urllib3 # Connection classes instrumented for DNS/connect timing
+import collections # Stack counts for the sampling profiler
+import cProfile # --profile cprofile
+import tracemalloc # --trace-memory
+import concurrent.futures # Volumes written concurrently
+import copy # Zip entry headers for EPUB append
+import zipfile # Raw member copies for EPUB append and the parallel EPUB writer
+import zlib # Parallel deflate of EPUB members
+import posixpath # Member paths inside EPUB archives
+import struct # Local file headers for EPUB append
+from lxml import etree # OPF/NCX/nav patching for EPUB append
+import html # Escaping chapter text and titles
+try:
+    from PIL import Image # Optional: cover normalization (pip install Pillow)
+except ImportError:
+    Image = None
 # --- Configuration ---
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,6 +56,74 @@ HEADERS = {
     'Referer': BASE_URL, # Add Referer header
 }
 MAX_RETRIES = 3
+# Settings for the end-of-run retry pass over chapters that failed the first time.
+# The pass uses a slower backoff and a fresh, non-keep-alive transport so that a
+# throttled or half-broken connection from the main pass is not reused.
+RETRY_PASS_MAX_RETRIES = 4
+RETRY_PASS_BACKOFF_BASE = 5 # Seconds; backoff is RETRY_PASS_BACKOFF_BASE * attempt
+RETRY_PASS_DELAY = 2.0 # Delay between chapters during the retry pass
+BUILD_MANIFEST_SUFFIX = ".build.json" # Sidecar written next to each EPUB built on disk
+HTTP_POOL_SIZE = 16 # Max pooled keep-alive connections per host in the shared session
+BATCH_WORKERS = 4 # Books built concurrently in --batch mode
+BATCH_MAX_BOOKS_PER_HOST = 2 # Books from the same site that may be in flight at once in --batch mode
+# Watch mode polling intervals (seconds). Each book's interval adapts to its observed update cadence.
+WATCH_DEFAULT_INTERVAL = 3600
+WATCH_MIN_INTERVAL = 600
+WATCH_MAX_INTERVAL = 7 * 24 * 3600
+WATCH_BACKOFF_FACTOR = 1.5 # Interval growth after each poll that found nothing new
+WATCH_CADENCE_SAMPLES = 8 # Recent gaps between updates remembered per book
+# Distributed crawling (--coordinator / --worker)
+DISTRIBUTED_SHARD_SIZE = 50 # Chapters per shard handed to a worker
+DISTRIBUTED_LEASE_TIMEOUT = 900 # Seconds before a shard leased by a silent worker is handed out again
+DISTRIBUTED_POLL_INTERVAL = 2.0 # Seconds between queue checks by idle workers and the waiting coordinator
+DISTRIBUTED_MAX_ATTEMPTS = 3 # Leases of one shard before its chapters are given up as failed (e.g. it crashes every worker)
+DISTRIBUTED_STALL_TIMEOUTS = 2 # The coordinator stops waiting after this many lease timeouts without a shard being leased or finished
+DISTRIBUTED_BROKER_HOST = '127.0.0.1' # Interface of the HTTP broker endpoint (--broker-host 0.0.0.0 for workers on other machines)
+DISTRIBUTED_TOKEN_HEADER = 'X-Broker-Token' # Shared secret workers send with every HTTP broker call
+DISTRIBUTED_TOKEN_ENV = 'BIQUGE_BROKER_TOKEN' # Environment variable read when --broker-token is not given
+# Upper bounds (seconds) of the histogram buckets used for every timing span; the last bucket is unbounded
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_SIZE_BUCKETS = (100e3, 250e3, 500e3, 1e6, 2e6, 5e6, 10e6, 20e6, 50e6, 100e6) # EPUB size histogram (bytes)
+METRICS_FILENAME = "metrics.json" # Written to the output directory at the end of a CLI run
+# Profiling (--profile / --trace-memory)
+PROFILE_MODES = {'cprofile': '.prof', 'sample': '.folded'} # Mode -> extension of the file written next to the EPUB
+PROFILE_SAMPLE_INTERVAL = 0.005 # Seconds between stack samples in 'sample' mode
+MEMORY_TRACE_FRAMES = 10 # Frames kept per allocation by tracemalloc
+MEMORY_TRACE_TOP = 10 # Allocation sites reported after each pipeline stage
+# Volume splitting (--volumes)
+VOLUME_MODES = ('chapters', 'size', 'headings')
+VOLUME_DEFAULT_CHAPTERS = 500 # Chapters per volume for 'chapters' without a limit
+VOLUME_DEFAULT_MB = 20 # Uncompressed chapter text (MB) per volume for 'size' without a limit
+VOLUME_WORKERS = 4 # Volumes written concurrently
+VOLUME_FILENAME_TEMPLATE = "{title}_{volume:02d}.epub"
+# Cleaned chapters of a job are held in memory up to this many bytes of text, then spooled to a scratch file
+CHAPTER_SPOOL_MEMORY_THRESHOLD = 16 * 1024 * 1024
+CHAPTER_SPOOL_DIR = None # Directory for spool files (None: the system temp directory)
+# EPUB writer: members are deflated in parallel, then written in order
+EPUB_COMPRESS_WORKERS = min(8, os.cpu_count() or 1)
+EPUB_COMPRESS_WINDOW = EPUB_COMPRESS_WORKERS * 4 # Members rendered ahead of the one being written
+RAW_ZIP_PYTHON_VERSIONS = ((3, 8), (3, 14)) # CPython range whose zipfile internals raw member copies rely on (see raw_zip_members_supported)
+COMPRESSION_PROFILES = {'fast': 1, 'balanced': 6, 'max': 9} # Profile -> zlib level of the EPUB members ('balanced' is ZipFile's default)
+DEFAULT_COMPRESSION_PROFILE = 'balanced' # CLI, batch and watch builds
+SERVER_COMPRESSION_PROFILE = 'fast' # Dev server and FCGI, where the reader is waiting for the download
+# Cover images: cached by URL and, if Pillow is installed, downscaled and recompressed as JPEG
+COVER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'biquge_epub_creator', 'covers') # None disables the cache
+COVER_CACHE_FRESH_SECONDS = 24 * 3600 # Cached covers younger than this are used without revalidating them
+COVER_MAX_SIZE = (800, 1200) # Covers are downscaled to fit (width, height); None keeps the source image
+COVER_JPEG_QUALITY = 85
+COVER_RECOMPRESS_BYTES = 300 * 1024 # Covers that already fit COVER_MAX_SIZE are only recompressed above this size
+# Output formats (--format): the EPUB, the whole book as one UTF-8 text file, or one text file per chapter
+OUTPUT_FORMATS = ('epub', 'txt', 'txt-chapters')
+OUTPUT_CONTENT_TYPES = {'epub': 'application/epub+zip', 'txt': 'text/plain; charset=utf-8', 'txt-chapters': 'application/zip'} # Server/FCGI downloads
+TXT_FILENAME_TEMPLATE = "{title}.txt"
+TXT_CHAPTERS_DIR_TEMPLATE = "{title}_chapters" # Directory (or zip, from the server) of the per-chapter files
+TXT_CHAPTER_FILENAME_TEMPLATE = "{number:04d}_{title}.txt"
+# Full-text search: builds add each cleaned chapter to a SQLite FTS5 index (trigram tokenizer, so CJK text matches substrings)
+SEARCH_INDEX_PATH = None # Index file updated by builds (--index); None skips indexing
+SEARCH_INDEX_DEFAULT_PATH = 'search_index.sqlite3' # Used by --index without a path, --search and the server's /search
+SEARCH_INDEX_BATCH = 20 # Chapters per index transaction while a book is crawled
+SEARCH_RESULT_LIMIT = 20 # Default number of hits returned by --search and /search
+SEARCH_SNIPPET_CHARS = 40 # Context around a hit in search results
 
 # --- Site Configuration ---
 SITE_CONFIGS = {
@@ -54,6 +147,8 @@ SITE_CONFIGS = {
             "link_selector": 'a', # General fallback selector
             "skip_dt_count": 2, # Skip links before the second <dt> (the one titled "《...》免费章节")
             "link_area_selector": 'dd a', # Links are within <a> tags inside <dd> siblings following the target <dt>
+            # Optional: elements holding volume headings, in document order with the links (used by --volumes headings)
+            # "volume_heading_selector": 'dt',
         },
         "chapter_content_selectors": {
             "container": [('div', {'id': 'content'}), ('div', {'class_': 'content'}), ('div', {'id': 'booktxt'})], # List of selectors to try
@@ -67,6 +162,8 @@ SITE_CONFIGS = {
             r'\(.*?\)', # Maybe too broad? Keep for now.
         ],
         "needs_metadata_fetch": False, # Metadata and chapters on same page
+        # Optional alternate hosts tried (in order) by the retry pass for chapters that failed, e.g. ["https://m.bqg5.com"]
+        "mirror_base_urls": [],
     },
     "69shuba.com": {
         "base_url": "https://www.69shuba.com",
@@ -212,25 +309,471 @@ def get_site_config(url, logger=None):
 # --- Helper Functions ---
 # --- Helper Functions ---
 
-def fetch_url(url, method='GET', data=None, logger=None):
-    """Fetches content from a URL with retries and delay, supporting GET and POST."""
+def get_url_host(url):
+    """Returns the host (netloc) of a URL; used as the per-site key for throttling and metrics."""
+    return urllib.parse.urlparse(url).netloc
+
+class HostThrottle:
+    """
+    Spaces out requests to the same host across all threads.
+
+    Each caller reserves the next free slot for its host under a lock and then sleeps
+    until that slot, so concurrent books sharing a site are served in arrival order
+    and the site never sees more than one request per interval from this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url, interval):
+        host = get_url_host(url)
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class PipelineMetrics:
+    """
+    Thread-safe histograms, counters and gauges, optionally labelled (e.g. site="www.bqg5.com").
+
+    Histograms are keyed by stage name (e.g. 'fetch_url', 'fetch.dns', 'parse') and hold
+    fixed buckets plus running count/sum/min/max, so the totals stay small no matter how
+    many chapters a process builds. snapshot() gives the JSON view, render_prometheus()
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._gauges = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    @staticmethod
+    def _format_key(key):
+        name, labels = key
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+    def observe(self, stage, value, buckets=None, unit='seconds', **labels):
+        """Records one observation. buckets and unit are fixed by the first observation of a stage."""
+        with self._lock:
+            key = self._key(stage, labels)
+            entry = self._stages.get(key)
+            if entry is None:
+                bounds = tuple(buckets) if buckets is not None else self.buckets
+                entry = self._stages[key] = {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'unit': unit,
+                                             'bounds': bounds, 'buckets': [0] * (len(bounds) + 1)}
+            entry['count'] += 1
+            entry['sum'] += value
+            entry['min'] = value if entry['min'] is None else min(entry['min'], value)
+            entry['max'] = value if entry['max'] is None else max(entry['max'], value)
+            index = len(entry['bounds'])
+            for i, bound in enumerate(entry['bounds']):
+                if value <= bound:
+                    index = i
+                    break
+            entry['buckets'][index] += 1
+
+    def increment(self, name, value=1, **labels):
+        """Adds value to a monotonically increasing counter."""
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, name, delta, **labels):
+        """Moves a gauge (e.g. jobs in flight) up or down by delta."""
+        with self._lock:
+            key = self._key(name, labels)
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        """Context manager timing its body into the histogram for stage (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+
+    def timed(self, stage, labels=None):
+        """
+        Decorator timing every call of the wrapped function into the histogram for stage.
+        labels, if given, is called with the function's arguments and returns the labels dict.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage, **(labels(*args, **kwargs) if labels else {})):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Returns a JSON-serialisable copy of all metrics. Histogram bucket counts are per bucket, not cumulative."""
+        with self._lock:
+            stages = {}
+            for key, entry in sorted(self._stages.items()):
+                bounds = [str(bound) for bound in entry['bounds']] + ['+Inf']
+                suffix = '_seconds' if entry['unit'] == 'seconds' else '_' + entry['unit']
+                stages[self._format_key(key)] = {
+                    'count': entry['count'],
+                    'sum' + suffix: round(entry['sum'], 6),
+                    'mean' + suffix: round(entry['sum'] / entry['count'], 6),
+                    'min' + suffix: round(entry['min'], 6),
+                    'max' + suffix: round(entry['max'], 6),
+                    'buckets': dict(zip(bounds, entry['buckets'])),
+                }
+            counters = {self._format_key(key): value for key, value in sorted(self._counters.items())}
+            gauges = {self._format_key(key): value for key, value in sorted(self._gauges.items())}
+        return {'started_at': self.started_at, 'uptime_seconds': round(time.time() - self.started_at, 3),
+                'stages': stages, 'counters': counters, 'gauges': gauges}
+
+    def render_prometheus(self, prefix='biquge_'):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        def metric_name(name, suffix=''):
+            return prefix + re.sub(r'[^a-zA-Z0-9_]', '_', name) + suffix
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            declared = set()
+            for (stage, labels), entry in sorted(self._stages.items()):
+                name = metric_name(stage, '_' + entry['unit'])
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f'# TYPE {name} histogram')
+                cumulative = 0
+                for bound, count in zip(list(entry['bounds']) + ['+Inf'], entry['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{label_text(labels)} {entry["sum"]}')
+                lines.append(f'{name}_count{label_text(labels)} {entry["count"]}')
+            for (counter, labels), value in sorted(self._counters.items()):
+                name = metric_name(counter, '_total')
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{label_text(labels)} {value}')
+            for (gauge, labels), value in sorted(self._gauges.items()):
+                name = metric_name(gauge)
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name}{label_text(labels)} {value}')
+        name = metric_name('uptime_seconds')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {time.time() - self.started_at:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self._gauges = {}
+            self.started_at = time.time()
+
+METRICS = PipelineMetrics()
+# Connection setup time spent by the request currently running on this thread; fetch_url subtracts it from TTFB
+_REQUEST_TIMING = threading.local()
+
+class TimedConnectionMixin:
+    """Times DNS resolution and connection setup (TCP, plus TLS for HTTPS) of each new pooled connection."""
+
+    def _new_conn(self):
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            # Resolve here so DNS gets its own span; SNI and certificate checks still use self.host
+            address = socket.getaddrinfo(host, self.port, urllib3.util.connection.allowed_gai_family(), socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror:
+            address = None # Let urllib3 raise its usual NameResolutionError
+        METRICS.observe('fetch.dns', time.perf_counter() - started, site=self.host)
+        if address is None:
+            return super()._new_conn()
+        self._dns_host = address
+        try:
+            return super()._new_conn()
+        except urllib3.exceptions.NewConnectionError:
+            # First address unreachable: let urllib3 resolve again and try every address itself
+            self._dns_host = host
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            seconds = time.perf_counter() - started
+            METRICS.observe('fetch.connect', seconds, site=self.host)
+            _REQUEST_TIMING.connect_seconds = getattr(_REQUEST_TIMING, 'connect_seconds', 0.0) + seconds
+
+class TimedHTTPConnection(TimedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(TimedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter whose pools (direct and via proxy) use the timed connection classes."""
+
+    POOL_CLASSES = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.POOL_CLASSES)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = dict(self.POOL_CLASSES)
+        return manager
+
+def dump_metrics(output_directory=None, path=None, logger=None):
+    """Writes the METRICS snapshot as JSON (default: <output_directory>/metrics.json). Returns the path."""
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if path is None:
+        path = os.path.join(output_directory or OUTPUT_DIR, METRICS_FILENAME)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(METRICS.snapshot(), f, ensure_ascii=False, indent=2)
+        logger.info(f"Timing metrics written to {path}")
+        return path
+    except OSError as e:
+        logger.warning(f"Could not write timing metrics to {path}: {e}")
+        return None
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack at a fixed interval from a background thread.
+
+    Much lower overhead than cProfile on long network-bound builds. Stacks are written in
+    the folded format ("outer;inner count" per line) read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class BuildProfiler:
+    """Profiles the calling thread with cProfile ('cprofile', pstats file) or SamplingProfiler ('sample', folded stacks)."""
+
+    def __init__(self, mode):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}'. Choose from: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self._profiler = cProfile.Profile() if mode == 'cprofile' else SamplingProfiler()
+
+    def start(self):
+        self._profiler.enable()
+
+    def stop(self):
+        self._profiler.disable()
+
+    def save(self, path_base, logger=None):
+        """Writes the profile to path_base plus the mode's extension. Returns the path, or None on error."""
+        if logger is None: logger = logging.getLogger() # Use default logger if none provided
+        path = path_base + PROFILE_MODES[self.mode]
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._profiler.dump_stats(path)
+            logger.info(f"Profile ({self.mode}) written to {path}")
+            return path
+        except OSError as e:
+            logger.warning(f"Could not write profile to {path}: {e}")
+            return None
+
+def get_profile_path_base(epub_path, book_url, output_directory=None):
+    """Profiles are named after the book: next to its EPUB, or after its URL if the build produced none."""
+    if epub_path:
+        return os.path.splitext(epub_path)[0]
+    parsed = urllib.parse.urlparse(book_url)
+    name = re.sub(r'[^\w.-]+', '_', parsed.netloc + parsed.path).strip('_') or 'book'
+    return os.path.join(output_directory or OUTPUT_DIR, name)
+
+# Last tracemalloc snapshot taken on this thread, so each stage reports what it allocated
+_MEMORY_TRACE = threading.local()
+
+def start_memory_trace():
+    """Starts tracemalloc for --trace-memory; memory_checkpoint reports are no-ops without it."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+
+def memory_checkpoint(stage, logger=None, report=True):
+    """
+    If tracemalloc is running, logs the top allocation sites since the previous checkpoint
+    on this thread. report=False only records the baseline (e.g. at the start of a build).
+    """
+    if not tracemalloc.is_tracing():
+        return
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    previous = getattr(_MEMORY_TRACE, 'snapshot', None)
+    _MEMORY_TRACE.snapshot = snapshot
+    if not report:
+        return
+    stats = snapshot.compare_to(previous, 'lineno') if previous is not None else snapshot.statistics('lineno')
+    current, peak = tracemalloc.get_traced_memory()
+    logger.info(f"Memory after {stage}: {current / 1e6:.1f} MB traced, peak {peak / 1e6:.1f} MB. Top allocation sites:")
+    for stat in stats[:MEMORY_TRACE_TOP]:
+        logger.info(f"  {stat}")
+
+# Shared connection pool and rate limiter used by every fetch in this process
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', TimedHTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+HTTP_SESSION.mount('http://', TimedHTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+HOST_THROTTLE = HostThrottle()
+
+def decode_html_response(response, url, logger=None):
+    """Sets response.encoding from detection, falling back to the site's encoding hint if the text looks garbled."""
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    # Try to detect encoding, fallback to site config hint or utf-8
+    site_config = get_site_config(url, logger=logger) # Get config again for encoding hint, pass logger
+    fallback_encoding = site_config.get('encoding', 'utf-8') if site_config else 'utf-8'
+    detected_encoding = response.apparent_encoding if response.apparent_encoding else fallback_encoding
+    response.encoding = detected_encoding
+    # Force gb18030 if common Chinese characters are garbled with apparent_encoding
+    # Check a larger portion of text for potential garbled characters
+    response.encoding = detected_encoding
+    # Force fallback encoding if common Chinese characters are garbled
+    # Check a larger portion of text for potential garbled characters
+    # Use a more general check for garbled text
+    try:
+        text_preview = response.text[:2000]
+        if '�' in text_preview:
+            logger.warning(f"Garbled characters detected with encoding {detected_encoding} for {url}. Forcing {fallback_encoding}.")
+            response.encoding = fallback_encoding
+    except Exception as e:
+        logger.warning(f"Could not check for garbled characters: {e}")
+
+def send_timed_request(transport, method, url, **kwargs):
+    """
+    Sends a request and records its time-to-first-byte and download spans, status and body
+    size per site (connection setup is recorded by the adapter).
+    """
+    site = get_url_host(url)
+    _REQUEST_TIMING.connect_seconds = 0.0
+    started = time.perf_counter()
+    response = transport.request(method, url, **kwargs)
+    total = time.perf_counter() - started
+    headers_received = response.elapsed.total_seconds() # Send until the response headers were parsed
+    METRICS.observe('fetch.ttfb', max(headers_received - _REQUEST_TIMING.connect_seconds, 0.0), site=site)
+    METRICS.observe('fetch.download', max(total - headers_received, 0.0), site=site)
+    METRICS.increment('fetch_responses', site=site, status=response.status_code)
+    METRICS.increment('fetch_bytes', len(response.content), site=site)
+    return response
+
+@METRICS.timed('fetch_url_conditional', labels=lambda url, *args, **kwargs: {'site': get_url_host(url)})
+def fetch_url_conditional(url, etag=None, last_modified=None, logger=None):
+    """
+    GETs a URL with If-None-Match / If-Modified-Since validators.
+
+    Returns (text, validators). text is None if the server answered 304 Not Modified.
+    validators is a dict with 'etag' and 'last_modified' to send on the next request.
+    Raises requests.exceptions.RequestException on failure.
+    """
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    headers = dict(HEADERS)
+    if etag: headers['If-None-Match'] = etag
+    if last_modified: headers['If-Modified-Since'] = last_modified
+    HOST_THROTTLE.wait(url, REQUEST_DELAY)
+    response = send_timed_request(HTTP_SESSION, 'GET', url, headers=headers, timeout=30)
+    if response.status_code == 304:
+        logger.info(f"Not modified: {url}")
+        METRICS.increment('http_cache_requests', site=get_url_host(url), result='hit')
+        return None, {'etag': etag, 'last_modified': last_modified}
+    METRICS.increment('http_cache_requests', site=get_url_host(url), result='miss')
+    response.raise_for_status()
+    decode_html_response(response, url, logger=logger)
+    logger.info(f"Fetched HTML: {url} (Status: {response.status_code}, Encoding: {response.encoding})")
+    return response.text, {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+
+@METRICS.timed('fetch_url', labels=lambda url, *args, **kwargs: {'site': get_url_host(url)})
+def fetch_url(url, method='GET', data=None, logger=None, max_retries=None, backoff_base=None, session=None, delay=None):
+    """Fetches content from a URL with retries and delay, supporting GET and POST.
+
+    max_retries, backoff_base (linear backoff in seconds instead of exponential),
+    session (transport to use instead of the shared HTTP_SESSION) and delay (minimum
+    interval between requests to the same host) default to the normal crawl
+    settings; the chapter retry pass overrides them.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if max_retries is None: max_retries = MAX_RETRIES
+    if delay is None: delay = REQUEST_DELAY
+    transport = session if session is not None else HTTP_SESSION
     retries = 0
-    while retries < MAX_RETRIES:
+    while retries < max_retries:
+        HOST_THROTTLE.wait(url, delay) # Shared per-host rate limit (replaces the fixed sleep after each request)
         try:
             if method.upper() == 'POST':
                 logger.debug(f"Making POST request to {url} with data: {data}")
-                response = requests.post(url, headers=HEADERS, data=data, timeout=30)
+                response = send_timed_request(transport, 'POST', url, headers=HEADERS, data=data, timeout=30)
             else: # Default to GET
                 logger.debug(f"Making GET request to {url}")
-                response = requests.get(url, headers=HEADERS, timeout=30)
+                response = send_timed_request(transport, 'GET', url, headers=HEADERS, timeout=30)
 
             response.raise_for_status() # Raise an exception for bad status codes
 
             # Handle JSON response directly for POST requests expecting JSON
             if method.upper() == 'POST' and 'application/json' in response.headers.get('Content-Type', ''):
                 logger.info(f"Fetched JSON: {url} (Status: {response.status_code})")
-                time.sleep(REQUEST_DELAY)
                 try:
                     return response.json() # Return parsed JSON object
                 except requests.exceptions.JSONDecodeError as e: # Use requests' exception
@@ -238,40 +781,25 @@ def fetch_url(url, method='GET', data=None, logger=None):
                     return None # Indicate JSON decode failure
 
             # --- HTML Response Handling ---
-            # Try to detect encoding, fallback to site config hint or utf-8
-            site_config = get_site_config(url, logger=logger) # Get config again for encoding hint, pass logger
-            fallback_encoding = site_config.get('encoding', 'utf-8') if site_config else 'utf-8'
-            detected_encoding = response.apparent_encoding if response.apparent_encoding else fallback_encoding
-            response.encoding = detected_encoding
-            # Force gb18030 if common Chinese characters are garbled with apparent_encoding
-            # Check a larger portion of text for potential garbled characters
-            response.encoding = detected_encoding
-            # Force fallback encoding if common Chinese characters are garbled
-            # Check a larger portion of text for potential garbled characters
-            # Use a more general check for garbled text
-            try:
-                text_preview = response.text[:2000]
-                if '�' in text_preview:
-                    logger.warning(f"Garbled characters detected with encoding {detected_encoding} for {url}. Forcing {fallback_encoding}.")
-                    response.encoding = fallback_encoding
-            except Exception as e:
-                logger.warning(f"Could not check for garbled characters: {e}")
-
+            decode_html_response(response, url, logger=logger)
             logger.info(f"Fetched HTML: {url} (Status: {response.status_code}, Encoding: {response.encoding})")
-            time.sleep(REQUEST_DELAY)
             return response.text # Return HTML text
         except requests.exceptions.Timeout:
             retries += 1
-            logger.warning(f"Timeout fetching {url}. Retrying ({retries}/{MAX_RETRIES})...")
-            time.sleep(2 ** retries) # Exponential backoff
+            METRICS.increment('fetch_retries', site=get_url_host(url), error='timeout')
+            logger.warning(f"Timeout fetching {url}. Retrying ({retries}/{max_retries})...")
+            time.sleep(backoff_base * retries if backoff_base is not None else 2 ** retries) # Linear (retry pass) or exponential backoff
         except requests.exceptions.RequestException as e:
             retries += 1
-            logger.warning(f"Error fetching {url}: {e}. Retrying ({retries}/{MAX_RETRIES})...")
-            time.sleep(2 ** retries) # Exponential backoff
+            METRICS.increment('fetch_retries', site=get_url_host(url), error='request')
+            logger.warning(f"Error fetching {url}: {e}. Retrying ({retries}/{max_retries})...")
+            time.sleep(backoff_base * retries if backoff_base is not None else 2 ** retries) # Linear (retry pass) or exponential backoff
 
-    logger.error(f"Failed to fetch {url} after {MAX_RETRIES} retries.")
+    logger.error(f"Failed to fetch {url} after {max_retries} retries.")
+    METRICS.increment('fetch_failures', site=get_url_host(url))
     return None
 
+@METRICS.timed('clean_html_content')
 def clean_html_content(content_container_tag, site_config, logger=None): # Changed parameter, added site_config
     """Removes unwanted tags and cleans up chapter text for EPUB HTML."""
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
@@ -335,15 +863,73 @@ def clean_html_content(content_container_tag, site_config, logger=None): # Chang
 
     # Format as simple HTML paragraphs
     # Add indentation using CSS class later if desired
-    content_html = '\n'.join(f'<p>{line}</p>' for line in cleaned_lines)
+    content_html = '\n'.join(f'<p>{html.escape(line, quote=False)}</p>' for line in cleaned_lines)
     return content_html.strip()
 
+# --- Chapter records ---
+class Chapter:
+    """
+    One chapter as it moves through the pipeline: its link ('title', 'url', optional
+    'volume'), its cleaned 'content_html' once fetched and, when loaded from a build
+    manifest, its 'status' and failure 'reason'.
+
+    Uses __slots__ instead of a per-chapter dict, and stores the URL as a path plus an
+    interned prefix, so the chapters of one book share a single copy of the book's URL
+    prefix. Supports the dict-style access the pipeline uses (chapter['title'],
+    chapter.get('volume'), dict(chapter)); fields that are None are treated as absent.
+    """
+
+    __slots__ = ('title', '_url_prefix', '_url_path', 'volume', 'content_html', 'status', 'reason')
+    FIELDS = ('title', 'url', 'volume', 'content_html', 'status', 'reason')
+
+    def __init__(self, title, url=None, volume=None, content_html=None, status=None, reason=None):
+        self.title = title
+        self.url = url
+        self.volume = volume
+        self.content_html = content_html
+        self.status = status
+        self.reason = reason
+
+    @property
+    def url(self):
+        return None if self._url_path is None else self._url_prefix + self._url_path
+
+    @url.setter
+    def url(self, url):
+        if url is None:
+            self._url_prefix, self._url_path = '', None
+        else:
+            prefix, _, path = url.rpartition('/')
+            self._url_prefix, self._url_path = sys.intern(prefix + _), path
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return [key for key in self.FIELDS if getattr(self, key) is not None]
+
+    def __repr__(self):
+        return f"Chapter({', '.join(f'{key}={getattr(self, key)!r}' for key in self.keys() if key != 'content_html')})"
+
 # --- Main Logic ---
 
 def get_book_details(html_content, book_url, site_config, logger=None): # Added site_config, changed html source name
     """Extracts book title, author, description, and cover image URL from the relevant page."""
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
-    soup = BeautifulSoup(html_content, 'html.parser')
+    with METRICS.span('parse'):
+        soup = BeautifulSoup(html_content, 'html.parser')
     selectors = site_config['metadata_selectors']
 
     # Helper to find element using config
@@ -465,7 +1051,13 @@ def get_book_details(html_content, book_url, site_config, logger=None): # Added
     return title, author, description, cover_image_url
 
 def get_chapter_links(index_html, book_url, site_config, logger=None):
-    """Extracts chapter links and titles. Handles HTML parsing or POST JSON fetching."""
+    """
+    Extracts chapter links and titles. Handles HTML parsing or POST JSON fetching.
+
+    If the site lists volume headings (non-chapter entries of a JSON list, or elements
+    matching the optional 'volume_heading_selector' of chapter_list_selectors), each
+    chapter after a heading also gets a 'volume' key with the heading text.
+    """
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
     chapters = []
     base_site_url = site_config.get("base_url", book_url)
@@ -500,15 +1092,18 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
                      return []
 
                 seen_urls = set()
+                current_volume = None
                 for item in chapter_list_data:
-                    if isinstance(item, dict) and item.get("ctype") == "0": # Check if it's a chapter link
+                    if isinstance(item, dict) and item.get("ctype") != "0" and item.get("title"): # Volume heading
+                        current_volume = item["title"].strip()
+                    elif isinstance(item, dict) and item.get("ctype") == "0": # Check if it's a chapter link
                         title = item.get("title", "").strip()
                         ordernum = item.get("ordernum")
                         if title and ordernum:
                             # Construct chapter URL (e.g., https://ixdzs8.com/read/571203/p35.html)
                             chapter_url = f"{base_site_url}/read/{book_id}/p{ordernum}.html"
                             if chapter_url not in seen_urls:
-                                chapters.append({'title': title, 'url': chapter_url})
+                                chapters.append(Chapter(title, chapter_url, volume=current_volume))
                                 seen_urls.add(chapter_url)
                             else:
                                 logger.debug(f"Skipping duplicate chapter URL from JSON: {chapter_url}")
@@ -529,11 +1124,12 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
     logger.info("Fetching chapter list via HTML parsing method.")
     # Explicitly use encoding hint from site_config for parsing, if available
     site_encoding = site_config.get('encoding')
-    if site_encoding:
-        logger.debug(f"Using encoding hint for BeautifulSoup in get_chapter_links: {site_encoding}")
-        soup = BeautifulSoup(index_html, 'html.parser', from_encoding=site_encoding)
-    else:
-        soup = BeautifulSoup(index_html, 'html.parser') # Default parser if no hint
+    with METRICS.span('parse'):
+        if site_encoding:
+            logger.debug(f"Using encoding hint for BeautifulSoup in get_chapter_links: {site_encoding}")
+            soup = BeautifulSoup(index_html, 'html.parser', from_encoding=site_encoding)
+        else:
+            soup = BeautifulSoup(index_html, 'html.parser') # Default parser if no hint
     chapters = []
     selectors = site_config['chapter_list_selectors']
 
@@ -585,12 +1181,24 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
         logger.error("Failed to find any chapter links after all selection attempts.")
         return []
 
+    # Map each link to the volume heading preceding it in document order
+    link_volumes = {}
+    volume_heading_selector = selectors.get('volume_heading_selector')
+    if volume_heading_selector:
+        heading_ids = {id(heading) for heading in search_area.select(volume_heading_selector)}
+        link_ids = {id(link) for link in links_elements}
+        current_volume = None
+        for element in search_area.find_all(True):
+            if id(element) in heading_ids:
+                current_volume = element.get_text().strip() or None
+            elif id(element) in link_ids and current_volume:
+                link_volumes[id(element)] = current_volume
+
     # --- Process Selected Links ---
     chapters = []
-    seen_urls = set() # Avoid duplicate chapters
     # --- Process Selected Links (HTML Parsing specific part) ---
     # This part remains largely the same as before, processing the links_elements found via HTML selectors
-    seen_urls = set() # Avoid duplicate chapters
+    seen_urls = set() # Avoid duplicate chapters (only lives while the page is parsed)
 
     for link in links_elements:
         href = link.get('href')
@@ -610,7 +1218,8 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
                 if re.search(r'/\d+/\d+(?:\.html)?$', path) or \
                    re.search(r'/txt/\d+/\d+', path) or \
                    re.search(r'/read/\d+/\d+', path) or \
-                   re.search(r'/\d+_\d+/\d+\.html$', path): # Added this pattern
+                   re.search(r'/\d+_\d+/\d+\.html$', path) or \
+                   re.search(r'/read/\d+_\d+\.html$', path): # dxmwx.org chapters, e.g. /read/57132_50211576.html
                     is_likely_chapter = True
             except Exception:
                 pass # Ignore URL parsing errors for filtering
@@ -639,7 +1248,7 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
                 # Remove common prefixes/suffixes if needed
                 # title = title.replace('最新章节 ', '')
 
-                chapters.append({'title': title, 'url': full_url})
+                chapters.append(Chapter(title, full_url, volume=link_volumes.get(id(link))))
                 seen_urls.add(full_url)
             else: # DEBUG: Log why a link was skipped
                 logger.debug(f"Skipping link: Title='{title}', Href='{href}', LikelyChapter={is_likely_chapter}, Seen={full_url in seen_urls}")
@@ -652,7 +1261,394 @@ def get_chapter_links(index_html, book_url, site_config, logger=None):
          chapters.reverse()
     return chapters
 
-def create_epub(title, author, description, chapters_data, book_url, cover_image_url, output_directory, return_bytes=False, logger=None):
+# Basic styling for readability, shared by every EPUB (and every volume of a split book)
+EPUB_STYLESHEET = '''
+@namespace epub "http://www.idpf.org/2007/ops";
+body {
+    font-family: sans-serif;
+    line-height: 1.6;
+    margin: 1em;
+}
+h1 {
+    text-align: center;
+    margin-top: 2em;
+    margin-bottom: 1em;
+    font-size: 1.5em;
+    font-weight: bold;
+    page-break-before: always; /* Start each chapter h1 on a new page */
+}
+p {
+    margin-top: 0;
+    margin-bottom: 1em;
+    text-indent: 2em; /* Indent paragraphs */
+    text-align: justify; /* Justify text */
+}
+/* Styles for Title Page */
+.titlepage {
+    text-align: center;
+    margin-top: 20%;
+}
+.titlepage h1 {
+    font-size: 2em;
+    page-break-before: auto; /* Don't force page break before title */
+}
+.titlepage h2 {
+    font-size: 1.5em;
+    font-style: italic;
+    margin-top: 0.5em;
+}
+.titlepage hr {
+    width: 50%;
+    margin-top: 1em;
+    margin-bottom: 1em;
+}
+.titlepage p {
+    text-indent: 0; /* No indent for description/source */
+    text-align: center;
+    font-size: 0.9em;
+    color: #555;
+}
+.description {
+    margin-top: 2em;
+    font-style: italic;
+}
+.source {
+    margin-top: 1em;
+    font-size: 0.8em;
+}
+'''
+
+# Chapter documents are filled in by plain concatenation instead of being parsed and
+# re-serialized by ebooklib. The parts produce the same XHTML as ebooklib's EpubHtml.
+CHAPTER_XHTML_PARTS = (
+    """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" epub:prefix="z3998: http://www.daisy.org/z3998/2012/vocab/structure/#" lang="zh" xml:lang="zh">
+  <head>
+    <title>""", # title
+    """</title>
+    <link href="style/style.css" rel="stylesheet" type="text/css"/>
+  </head>
+  <body><h1>""", # title
+    """</h1>
+  """, # content_html
+    """
+</body>
+</html>
+""",
+)
+
+def render_chapter_xhtml(chapter_title, content_html):
+    """Returns the XHTML document of a chapter. content_html must be well-formed (as from clean_html_content)."""
+    escaped_title = html.escape(chapter_title, quote=False)
+    head, title_end, heading_end, tail = CHAPTER_XHTML_PARTS
+    return ''.join((head, escaped_title, title_end, escaped_title, heading_end, content_html, tail))
+
+class ChapterHtml(epub.EpubHtml):
+    """
+    EpubHtml for one chapter, rendered with render_chapter_xhtml when it is written.
+    content_html may be a loader (see ChapterSpool.lazy_chapters), which is then only
+    called at that point, so the chapter text is not held by the book.
+    """
+
+    def __init__(self, content_html, **kwargs):
+        super().__init__(**kwargs)
+        self.content_html = content_html
+
+    def get_content(self, default=None):
+        content_html = self.content_html() if callable(self.content_html) else self.content_html
+        return render_chapter_xhtml(self.title, content_html).encode('utf-8')
+
+def make_epub_chapter(number, chapter_title, chapter_content_html):
+    """
+    Builds the EpubHtml document for chapter number (1-based), as used by create_epub and
+    append_chapters_to_epub. The stylesheet link is part of the chapter template, so the
+    chapter needs no style item of its own.
+    """
+    return ChapterHtml(chapter_content_html, title=chapter_title, file_name=f'chap_{number:04d}.xhtml', lang='zh')
+
+def get_cover_cache_paths(cover_image_url):
+    """Returns the (image, metadata) paths of a cover in COVER_CACHE_DIR."""
+    key = hashlib.sha1(cover_image_url.encode('utf-8')).hexdigest()
+    return os.path.join(COVER_CACHE_DIR, key + '.img'), os.path.join(COVER_CACHE_DIR, key + '.json')
+
+def load_cached_cover(cover_image_url):
+    """Returns (content, metadata) of a cached cover, or None if it is not cached."""
+    if not COVER_CACHE_DIR:
+        return None
+    image_path, metadata_path = get_cover_cache_paths(cover_image_url)
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        with open(image_path, 'rb') as f:
+            return f.read(), metadata
+    except (OSError, ValueError):
+        return None
+
+def store_cached_cover(cover_image_url, content, metadata, logger=None):
+    """Writes a cover and its metadata to COVER_CACHE_DIR (atomically, so concurrent builds can share it)."""
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if not COVER_CACHE_DIR:
+        return
+    image_path, metadata_path = get_cover_cache_paths(cover_image_url)
+    try:
+        os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+        for path, data in ((image_path, content), (metadata_path, json.dumps(metadata).encode('utf-8'))):
+            with tempfile.NamedTemporaryFile(dir=COVER_CACHE_DIR, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+    except OSError as e:
+        logger.warning(f"Could not cache cover image: {e}")
+
+def normalize_cover_image(content, mimetype, logger=None):
+    """
+    Downscales a cover to fit COVER_MAX_SIZE and recompresses it as JPEG, so EPUBs don't
+    carry multi-MB source images. Returns (content, mimetype). The cover is returned
+    unchanged if Pillow is not installed, COVER_MAX_SIZE is None, the image can't be
+    decoded, or it already fits and is at most COVER_RECOMPRESS_BYTES.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if Image is None or not COVER_MAX_SIZE:
+        return content, mimetype
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            fits = image.width <= COVER_MAX_SIZE[0] and image.height <= COVER_MAX_SIZE[1]
+            if fits and len(content) <= COVER_RECOMPRESS_BYTES:
+                return content, mimetype
+            source_size = image.size
+            image.thumbnail(COVER_MAX_SIZE) # Keeps the aspect ratio
+            rgba = image.convert('RGBA')
+            flattened = Image.new('RGB', rgba.size, 'white') # JPEG has no alpha channel
+            flattened.paste(rgba, mask=rgba.getchannel('A'))
+            buffer = io.BytesIO()
+            flattened.save(buffer, 'JPEG', quality=COVER_JPEG_QUALITY, optimize=True)
+    except Exception as e: # Pillow raises a range of errors for broken or unsupported images
+        logger.warning(f"Could not normalize cover image, using it as is: {e}")
+        return content, mimetype
+    if fits and buffer.tell() >= len(content):
+        return content, mimetype
+    logger.info(f"Cover normalized: {source_size[0]}x{source_size[1]} {len(content)} bytes -> "
+                f"{flattened.width}x{flattened.height} {buffer.tell()} bytes JPEG.")
+    return buffer.getvalue(), 'image/jpeg'
+
+def download_cover_image(cover_image_url, logger=None):
+    """
+    Returns a book's cover as (content, mimetype), or None if it could not be downloaded.
+
+    Covers are cached in COVER_CACHE_DIR by URL. A cached cover younger than
+    COVER_CACHE_FRESH_SECONDS is used without a request; an older one is revalidated
+    with its ETag / Last-Modified, and still used if the site can't be reached. The
+    cover is normalized with normalize_cover_image.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    cached = load_cached_cover(cover_image_url)
+    if cached and time.time() - cached[1].get('fetched', 0) < COVER_CACHE_FRESH_SECONDS:
+        logger.info(f"Using cached cover image: {cover_image_url}")
+        METRICS.increment('cover_cache_requests', result='fresh')
+        return normalize_cover_image(cached[0], cached[1]['mimetype'], logger=logger)
+
+    logger.info(f"Attempting to download cover image: {cover_image_url}")
+    headers = dict(HEADERS)
+    if cached and cached[1].get('etag'): headers['If-None-Match'] = cached[1]['etag']
+    if cached and cached[1].get('last_modified'): headers['If-Modified-Since'] = cached[1]['last_modified']
+    try:
+        HOST_THROTTLE.wait(cover_image_url, REQUEST_DELAY)
+        img_response = send_timed_request(HTTP_SESSION, 'GET', cover_image_url, headers=headers, timeout=30)
+        if img_response.status_code == 304 and cached:
+            logger.info(f"Cover image not modified: {cover_image_url}")
+            METRICS.increment('cover_cache_requests', result='revalidated')
+            content, metadata = cached[0], dict(cached[1], fetched=time.time())
+        else:
+            img_response.raise_for_status()
+            METRICS.increment('cover_cache_requests', result='miss')
+            # Use the served image type, else guess it from the URL, else fall back to JPEG
+            img_mimetype = img_response.headers.get('Content-Type', '').split(';')[0].strip()
+            if not img_mimetype.startswith('image/'):
+                img_mimetype = mimetypes.guess_type(cover_image_url)[0] or 'image/jpeg'
+            content = img_response.content
+            metadata = {'url': cover_image_url, 'mimetype': img_mimetype, 'fetched': time.time(),
+                        'etag': img_response.headers.get('ETag'), 'last_modified': img_response.headers.get('Last-Modified')}
+            logger.info(f"Cover image downloaded ({img_mimetype}, {len(content)} bytes).")
+        store_cached_cover(cover_image_url, content, metadata, logger=logger)
+    except requests.exceptions.RequestException as e:
+        if not cached:
+            logger.warning(f"Could not download cover image: {e}")
+            return None
+        logger.warning(f"Could not revalidate cover image, using the cached copy: {e}")
+        METRICS.increment('cover_cache_requests', result='stale')
+        content, metadata = cached
+    return normalize_cover_image(content, metadata['mimetype'], logger=logger)
+
+COVER_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='cover') # Covers fetched while chapters are crawled
+
+def start_cover_download(cover_image_url, logger=None):
+    """
+    Starts download_cover_image in the background. Returns a Future of its result (None
+    if there is no cover URL), to be passed on as create_epub's cover_image.
+    """
+    if not cover_image_url:
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+    return COVER_EXECUTOR.submit(download_cover_image, cover_image_url, logger)
+
+# --- Raw ZIP member reads and writes ---
+# zipfile has no public API for copying compressed bytes, so these helpers use its private
+# state (_lock, fp, start_dir, _didModify and the local header layout). They are only used
+# when raw_zip_members_supported() confirmed that state works as expected; otherwise members
+# go through the public ZipFile.read/writestr, which decompresses and recompresses them.
+def _read_raw_zip_member(source, info):
+    with source._lock:
+        source.fp.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))
+        source.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+        return source.fp.read(info.compress_size)
+
+def _write_raw_zip_member(target, info, data):
+    with target._lock:
+        target.fp.seek(target.start_dir)
+        info.header_offset = target.fp.tell()
+        target.fp.write(info.FileHeader())
+        target.fp.write(data)
+        target.start_dir = target.fp.tell()
+        target.filelist.append(info)
+        target.NameToInfo[info.filename] = info
+        target._didModify = True
+
+def raw_zip_members_supported():
+    """
+    Returns True if this Python's zipfile internals are the ones the raw member helpers
+    were written against: a CPython version in RAW_ZIP_PYTHON_VERSIONS whose zipfile
+    passes a round trip of a raw write and a raw read in memory.
+    """
+    oldest, newest = RAW_ZIP_PYTHON_VERSIONS
+    if not oldest <= sys.version_info[:2] <= newest:
+        return False
+    try:
+        data = b'raw member probe'
+        info = zipfile.ZipInfo('probe.txt')
+        info.compress_type = zipfile.ZIP_STORED
+        info.CRC, info.file_size, info.compress_size = zlib.crc32(data), len(data), len(data)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            _write_raw_zip_member(archive, info, data)
+        with zipfile.ZipFile(buffer) as archive:
+            probe_info = archive.getinfo('probe.txt')
+            return archive.testzip() is None and archive.read(probe_info) == data and _read_raw_zip_member(archive, probe_info) == data
+    except Exception:
+        return False
+
+RAW_ZIP_MEMBERS = raw_zip_members_supported() # Checked once at import
+
+def write_raw_zip_member(target, info, data):
+    """
+    Writes an already compressed member to the ZipFile target (opened for writing). info
+    must carry the final CRC, compress_type and sizes; data is written verbatim. Without
+    RAW_ZIP_MEMBERS the member is decompressed and written with ZipFile.writestr instead.
+    """
+    if RAW_ZIP_MEMBERS:
+        _write_raw_zip_member(target, info, data)
+        return
+    content = zlib.decompress(data, -zlib.MAX_WBITS) if info.compress_type == zipfile.ZIP_DEFLATED else data
+    target.writestr(info, content, compress_type=info.compress_type)
+
+# --- EPUB writer with parallel compression ---
+
+def deflate_member(data, level=COMPRESSION_PROFILES[DEFAULT_COMPRESSION_PROFILE]):
+    """Returns (crc32, raw deflate stream) of data, as stored in a ZIP_DEFLATED member. Releases the GIL."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+class ParallelEpubWriter(epub.EpubWriter):
+    """
+    ebooklib EpubWriter that deflates the members on EPUB_COMPRESS_WORKERS threads while the
+    base writer renders the next ones, and writes the precompressed members into the archive
+    in order, 'mimetype' first and stored as the EPUB spec requires. At most
+    EPUB_COMPRESS_WINDOW members are held at once, so lazily loaded chapters (see
+    ChapterSpool) are never all in memory. The zlib level is taken from the 'compresslevel'
+    option. Without RAW_ZIP_MEMBERS the members are compressed serially by ZipFile.writestr.
+    """
+
+    class _DeflateSink:
+        """Stands in for the ZipFile the base writer writes to."""
+
+        def __init__(self, archive, executor, level):
+            self.archive = archive
+            self.executor = executor
+            self.level = level
+            self.pending = collections.deque() # (name, uncompressed size, future) in archive order
+            self.date_time = time.localtime(time.time())[:6]
+
+        def writestr(self, name, data, compress_type=None):
+            data = data.encode('utf-8') if isinstance(data, str) else data
+            self.pending.append((name, len(data), self.executor.submit(deflate_member, data, self.level)))
+            while len(self.pending) > EPUB_COMPRESS_WINDOW:
+                self._write_next()
+
+        def _write_next(self):
+            name, size, future = self.pending.popleft()
+            crc, compressed = future.result()
+            info = zipfile.ZipInfo(name, date_time=self.date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o600 << 16 # Same permissions ZipFile.writestr gives members
+            info.CRC, info.file_size, info.compress_size = crc, size, len(compressed)
+            write_raw_zip_member(self.archive, info, compressed)
+
+        def flush(self):
+            while self.pending:
+                self._write_next()
+
+    def write(self):
+        if not RAW_ZIP_MEMBERS:
+            # Precompressed members can't be written verbatim: let ZipFile deflate each one
+            with zipfile.ZipFile(self.file_name, 'w', zipfile.ZIP_DEFLATED, compresslevel=self.options['compresslevel']) as archive:
+                archive.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+                self.out = archive
+                self._write_container()
+                self._write_opf()
+                self._write_items()
+            return
+        with zipfile.ZipFile(self.file_name, 'w') as archive, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=EPUB_COMPRESS_WORKERS, thread_name_prefix='epub-deflate') as executor:
+            archive.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            self.out = self._DeflateSink(archive, executor, self.options['compresslevel'])
+            self._write_container()
+            self._write_opf()
+            self._write_items()
+            self.out.flush()
+
+def get_compression_level(compression):
+    """Returns the zlib level of a COMPRESSION_PROFILES name (None means the default). Raises ValueError."""
+    compression = compression or DEFAULT_COMPRESSION_PROFILE
+    if compression not in COMPRESSION_PROFILES:
+        raise ValueError(f"Unknown compression profile '{compression}' (expected one of: {', '.join(COMPRESSION_PROFILES)})")
+    return COMPRESSION_PROFILES[compression]
+
+def write_epub(output_path, book, compression=None, logger=None):
+    """
+    Writes an EpubBook to output_path with ParallelEpubWriter using a COMPRESSION_PROFILES
+    profile, and logs and records how long that took. Raises on failure.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    compression = compression or DEFAULT_COMPRESSION_PROFILE
+    started = time.time()
+    # Chapters carry no epub:type page markers, so skip the page list (it parses every chapter again)
+    writer = ParallelEpubWriter(output_path, book, {'compresslevel': get_compression_level(compression), 'epub3_pages': False})
+    writer.process()
+    writer.write()
+    elapsed = time.time() - started
+    METRICS.observe('epub_write', elapsed, compression=compression)
+    logger.info(f"EPUB archive written in {elapsed:.2f}s with '{compression}' compression ({os.path.getsize(output_path)} bytes).")
+
+def sanitize_filename(name, fallback="Untitled_Book"):
+    """Turns a book or chapter title into a file name: invalid characters removed, whitespace runs replaced by '_'."""
+    sanitized = re.sub(r'[\\/*?:"<>|]',"", name) # Remove invalid characters
+    sanitized = re.sub(r'\s+', '_', sanitized).strip('_') # Replace spaces and strip leading/trailing underscores
+    return sanitized or fallback # Handle empty titles after sanitization
+
+@METRICS.timed('create_epub')
+def create_epub(title, author, description, chapters_data, book_url, cover_image_url, output_directory, return_bytes=False, logger=None, output_filename=None,
+                cover_image=None, volume=None, compression=None):
     """
     Creates an EPUB file from the chapter data.
 
@@ -660,17 +1656,25 @@ def create_epub(title, author, description, chapters_data, book_url, cover_image
         title (str): Book title.
         author (str): Book author.
         description (str): Book description.
-        chapters_data (list): List of dicts, each with 'title' and 'content_html'.
+        chapters_data (list or ChapterSpool): List of dicts, each with 'title' and 'content_html'.
+                                              A ChapterSpool is read back one chapter at a time while writing.
         book_url (str): Original URL of the book index/metadata page.
         cover_image_url (str): URL of the cover image, or None.
         output_directory (str or None): Directory to save the EPUB. If None and return_bytes is False, uses OUTPUT_DIR.
                                         If None and return_bytes is True, EPUB is not saved to disk.
         return_bytes (bool): If True, returns the EPUB content as bytes and the filename.
-                             If False, saves the EPUB to disk and returns None.
+                             If False, saves the EPUB to disk and returns its path.
+        output_filename (str or None): File name to use instead of one derived from the title.
+        cover_image (tuple or None): (content, mimetype) of an already downloaded cover, used
+                                     instead of downloading cover_image_url.
+        volume (dict or None): For one volume of a split book, 'number' (1-based), 'count' and
+                               optional 'title'. The volume gets its own identifier, title and
+                               file name, and series metadata tying the volumes together.
+        compression (str or None): COMPRESSION_PROFILES profile (default: DEFAULT_COMPRESSION_PROFILE).
 
     Returns:
-        tuple (bytes, str) or None: If return_bytes is True, returns (epub_content, epub_filename).
-                                    Otherwise, returns None.
+        tuple (bytes, str) or str: If return_bytes is True, returns (epub_content, epub_filename).
+                                   Otherwise, returns the path of the written EPUB.
     """
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
     book = epub.EpubBook()
@@ -678,32 +1682,35 @@ def create_epub(title, author, description, chapters_data, book_url, cover_image
     # Set metadata
     # Generate a unique ID based on the book URL
     unique_id = re.sub(r'[^\w\-]+', '-', book_url)
+    book_title = title
+    if volume:
+        unique_id += f"-vol{volume['number']:02d}"
+        volume_title = volume.get('title') or f"第{volume['number']}卷"
+        title = f"{book_title} {volume_title}"
     book.set_identifier(f'urn:uuid:{unique_id}')
     book.set_title(title)
     book.set_language('zh') # Assuming Chinese content
     book.add_author(author)
     book.add_metadata('DC', 'description', description)
     book.add_metadata('DC', 'source', book_url)
+    if volume:
+        # EPUB 3 collection plus the calibre series tags most readers understand
+        book.add_metadata(None, 'meta', book_title, {'property': 'belongs-to-collection', 'id': 'series'})
+        book.add_metadata(None, 'meta', 'series', {'refines': '#series', 'property': 'collection-type'})
+        book.add_metadata(None, 'meta', str(volume['number']), {'refines': '#series', 'property': 'group-position'})
+        book.add_metadata(None, 'meta', '', {'name': 'calibre:series', 'content': book_title})
+        book.add_metadata(None, 'meta', '', {'name': 'calibre:series_index', 'content': str(volume['number'])})
 
     # --- Add Cover Image ---
-    cover_image_content = None
     cover_item = None
-    if cover_image_url:
-        logger.info(f"Attempting to download cover image: {cover_image_url}")
-        try:
-            img_response = requests.get(cover_image_url, headers=HEADERS, timeout=30, stream=True)
-            img_response.raise_for_status()
-            cover_image_content = img_response.content
-            # Guess image type from URL or fallback
-            img_mimetype, _ = mimetypes.guess_type(cover_image_url)
-            if not img_mimetype:
-                img_mimetype = 'image/jpeg' # Default fallback
-            cover_item = epub.EpubItem(uid='cover_image', file_name=f'cover.{mimetypes.guess_extension(img_mimetype) or ".jpg"}', media_type=img_mimetype, content=cover_image_content)
-            book.add_item(cover_item)
-            book.set_cover(cover_item.file_name, cover_image_content) # Use set_cover for better compatibility
-            logger.info(f"Cover image downloaded and added ({img_mimetype}).")
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Could not download or add cover image: {e}")
+    if cover_image is None and cover_image_url:
+        cover_image = download_cover_image(cover_image_url, logger=logger)
+    if cover_image:
+        cover_image_content, img_mimetype = cover_image
+        cover_item = epub.EpubItem(uid='cover_image', file_name=f'cover.{mimetypes.guess_extension(img_mimetype) or ".jpg"}', media_type=img_mimetype, content=cover_image_content)
+        book.add_item(cover_item)
+        book.set_cover(cover_item.file_name, cover_image_content) # Use set_cover for better compatibility
+        logger.info(f"Cover image added ({img_mimetype}).")
 
     # Create chapters and add to book
     epub_chapters = []
@@ -715,15 +1722,15 @@ def create_epub(title, author, description, chapters_data, book_url, cover_image
 <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
 <html xmlns="http://www.w3.org/1999/xhtml">
 <head>
-  <title>{title}</title>
+  <title>{html.escape(title, quote=False)}</title>
   <link rel="stylesheet" type="text/css" href="style/style.css" />
 </head>
 <body class="titlepage">
-  <h1>{title}</h1>
-  <h2>{author}</h2>
+  <h1>{html.escape(title, quote=False)}</h1>
+  <h2>{html.escape(author, quote=False)}</h2>
   <hr/>
-  <p class="description">{description}</p>
-  <p class="source">Source: {book_url}</p>
+  <p class="description">{html.escape(description, quote=False)}</p>
+  <p class="source">Source: {html.escape(book_url, quote=False)}</p>
 </body>
 </html>
 '''
@@ -731,35 +1738,13 @@ def create_epub(title, author, description, chapters_data, book_url, cover_image
     title_page.content = title_page_content
     book.add_item(title_page)
 
+    if isinstance(chapters_data, ChapterSpool):
+        chapters_data = chapters_data.lazy_chapters() # Each chapter is read back from the spool as it is written
 
     for i, chapter_info in enumerate(chapters_data):
         chapter_title = chapter_info['title']
-        chapter_content_html = chapter_info['content_html']
         file_name = f'chap_{i+1:04d}.xhtml'
-
-        # Create EpubHtml object for the chapter
-        epub_chapter = epub.EpubHtml(title=chapter_title,
-                                     file_name=file_name,
-                                     lang='zh')
-        # Basic HTML structure for the chapter content
-        # Ensure content is wrapped in body and includes CSS link
-        epub_chapter.content = f'''
-<?xml version='1.0' encoding='utf-8'?>
-<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
-<html xmlns="http://www.w3.org/1999/xhtml">
-<head>
-  <title>{chapter_title}</title>
-  <link rel="stylesheet" type="text/css" href="style/style.css" />
-</head>
-<body>
-  <h1>{chapter_title}</h1>
-  {chapter_content_html}
-</body>
-</html>
-'''
-        # Add CSS link
-        epub_chapter.add_item(epub.EpubItem(uid="style", file_name="style/style.css", media_type="text/css", content='')) # Placeholder, will add content later
-
+        epub_chapter = make_epub_chapter(i + 1, chapter_title, chapter_info['content_html'])
         book.add_item(epub_chapter)
         epub_chapters.append(epub_chapter)
         # Add chapter to TOC
@@ -775,70 +1760,9 @@ def create_epub(title, author, description, chapters_data, book_url, cover_image
     book.add_item(epub.EpubNcx())
     book.add_item(epub.EpubNav())
 
-    # Define CSS style
-    # Basic styling for readability
-    style = '''
-@namespace epub "http://www.idpf.org/2007/ops";
-body {
-    font-family: sans-serif;
-    line-height: 1.6;
-    margin: 1em;
-}
-h1 {
-    text-align: center;
-    margin-top: 2em;
-    margin-bottom: 1em;
-    font-size: 1.5em;
-    font-weight: bold;
-    page-break-before: always; /* Start each chapter h1 on a new page */
-}
-p {
-    margin-top: 0;
-    margin-bottom: 1em;
-    text-indent: 2em; /* Indent paragraphs */
-    text-align: justify; /* Justify text */
-}
-/* Styles for Title Page */
-.titlepage {
-    text-align: center;
-    margin-top: 20%;
-}
-.titlepage h1 {
-    font-size: 2em;
-    page-break-before: auto; /* Don't force page break before title */
-}
-.titlepage h2 {
-    font-size: 1.5em;
-    font-style: italic;
-    margin-top: 0.5em;
-}
-.titlepage hr {
-    width: 50%;
-    margin-top: 1em;
-    margin-bottom: 1em;
-}
-.titlepage p {
-    text-indent: 0; /* No indent for description/source */
-    text-align: center;
-    font-size: 0.9em;
-    color: #555;
-}
-.description {
-    margin-top: 2em;
-    font-style: italic;
-}
-.source {
-    margin-top: 1em;
-    font-size: 0.8em;
-}
-'''
-    # Create CSS file item
-    style_item = epub.EpubItem(uid="style_css", file_name="style/style.css", media_type="text/css", content=style)
+    # Create CSS file item (chapters link it from their template)
+    style_item = epub.EpubItem(uid="style_css", file_name="style/style.css", media_type="text/css", content=EPUB_STYLESHEET)
     book.add_item(style_item)
-
-    # Update chapters to link the actual CSS file
-    for chapter in epub_chapters:
-        chapter.add_item(style_item)
     title_page.add_item(style_item)
 
 
@@ -851,19 +1775,22 @@ p {
     book.spine = ['cover'] + spine_items if cover_item else spine_items
 
     # Sanitize filename
-    sanitized_title = re.sub(r'[\\/*?:"<>|]',"", title) # Remove invalid characters
-    sanitized_title = re.sub(r'\s+', '_', sanitized_title).strip('_') # Replace spaces and strip leading/trailing underscores
-    if not sanitized_title: sanitized_title = "Untitled_Book" # Handle empty titles after sanitization
-    output_filename = OUTPUT_FILENAME_TEMPLATE.format(title=sanitized_title)
+    sanitized_title = sanitize_filename(book_title)
+    if not output_filename:
+        if volume:
+            output_filename = VOLUME_FILENAME_TEMPLATE.format(title=sanitized_title, volume=volume['number'])
+        else:
+            output_filename = OUTPUT_FILENAME_TEMPLATE.format(title=sanitized_title)
 
     if return_bytes:
         # Write EPUB to an in-memory buffer
         try:
             with tempfile.NamedTemporaryFile(delete=False, suffix=".epub") as temp_epub:
-                epub.write_epub(temp_epub.name, book, {})
+                write_epub(temp_epub.name, book, compression=compression, logger=logger)
                 temp_epub.seek(0)
                 epub_content = temp_epub.read()
             os.unlink(temp_epub.name) # Clean up the temporary file
+            METRICS.observe('epub_size', len(epub_content), buckets=METRICS_SIZE_BUCKETS, unit='bytes', compression=compression or DEFAULT_COMPRESSION_PROFILE)
             logger.info(f"EPUB '{output_filename}' created in memory ({len(epub_content)} bytes).")
             return epub_content, output_filename
         except Exception as e:
@@ -881,24 +1808,292 @@ p {
         os.makedirs(target_output_dir, exist_ok=True)
         output_path = os.path.join(target_output_dir, output_filename)
         try:
-            epub.write_epub(output_path, book, {})
+            write_epub(output_path, book, compression=compression, logger=logger)
+            METRICS.observe('epub_size', os.path.getsize(output_path), buckets=METRICS_SIZE_BUCKETS, unit='bytes', compression=compression or DEFAULT_COMPRESSION_PROFILE)
             logger.info(f"\nEPUB created successfully: {output_path}")
-            return None # Indicate success, no bytes returned
+            return output_path
         except Exception as e:
             logger.error(f"Error writing EPUB file to disk: {e}")
             raise # Re-raise the exception
 
-import os
-import urllib.parse
-
-def handle_fcgi_request():
-    """Handles incoming FCGI requests (parsing QUERY_STRING)."""
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - FCGI - %(levelname)s - %(message)s')
-    logging.info("FCGI request received.")
+# --- Plain-text export ---
+TXT_PARAGRAPH_PATTERN = re.compile(r'<p\b[^>]*>(.*?)</p>', re.S)
+TAG_PATTERN = re.compile(r'<[^>]+>')
 
-    # Parse QUERY_STRING environment variable instead of using cgi.FieldStorage
-    query_string = os.environ.get('QUERY_STRING', '')
-    params = urllib.parse.parse_qs(query_string)
+def parse_output_formats(spec):
+    """
+    Parses a --format value: one of OUTPUT_FORMATS or a comma-separated list of them
+    (a list is accepted as is). Returns the formats in OUTPUT_FORMATS order. Raises ValueError.
+    """
+    names = spec.split(',') if isinstance(spec, str) else list(spec)
+    formats = {name.strip() for name in names if name.strip()}
+    unknown = formats - set(OUTPUT_FORMATS)
+    if unknown or not formats:
+        raise ValueError(f"Unknown output format {', '.join(sorted(unknown)) or repr(spec)} (expected one of: {', '.join(OUTPUT_FORMATS)})")
+    return [name for name in OUTPUT_FORMATS if name in formats]
+
+def chapter_html_to_text(content_html):
+    """Converts cleaned chapter HTML (<p> paragraphs, see clean_html_content) to plain text, one paragraph per line."""
+    paragraphs = TXT_PARAGRAPH_PATTERN.findall(content_html) or content_html.splitlines()
+    lines = (html.unescape(TAG_PATTERN.sub('', paragraph)).strip() for paragraph in paragraphs)
+    return '\n'.join(line for line in lines if line)
+
+def get_txt_filename(output_filename, split_chapters, volume=None):
+    """
+    Name of the text export (file, or directory with split_chapters) written next to the
+    EPUB output_filename, or None to name it after the book title. For a volume of a split
+    book ('_NN' suffix) it is the export of the whole book.
+    """
+    if not output_filename:
+        return None
+    if volume:
+        output_filename = get_volume_book_filename(output_filename) # book_03.epub belongs to book.txt
+    return os.path.splitext(output_filename)[0] + ('_chapters' if split_chapters else '.txt')
+
+@METRICS.timed('create_txt')
+def create_txt(title, author, description, chapters_data, book_url, output_directory, split_chapters=False, return_bytes=False,
+               logger=None, output_filename=None, append=False):
+    """
+    Writes the cleaned chapters as UTF-8 plain text, skipping EPUB packaging.
+
+    By default the whole book goes to one file: a header (title, author, description and
+    source URL), then each chapter's title followed by its paragraphs, one per line.
+    With split_chapters each chapter is written to its own file (TXT_CHAPTER_FILENAME_TEMPLATE)
+    in a TXT_CHAPTERS_DIR_TEMPLATE directory. Chapters are converted and written one at a
+    time, so a ChapterSpool is never loaded as a whole.
+
+    With append the chapters are added to an existing export instead: after the last
+    chapter of the file (no second header), or numbered on from the files already in the
+    directory. Returns the path of the file (or directory) written below output_directory
+    (default: OUTPUT_DIR), or with return_bytes (content, filename); split chapters are
+    then returned as a zip of the chapter files.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    sanitized_title = sanitize_filename(title)
+    if not output_filename:
+        output_filename = (TXT_CHAPTERS_DIR_TEMPLATE if split_chapters else TXT_FILENAME_TEMPLATE).format(title=sanitized_title)
+        if split_chapters and return_bytes:
+            output_filename += '.zip'
+
+    first_number = 1
+    if append and split_chapters:
+        # Continue the numbering of the chapter files written by the earlier export(s)
+        existing_files = os.listdir(os.path.join(output_directory or OUTPUT_DIR, output_filename))
+        first_number += sum(1 for name in existing_files if name.endswith('.txt'))
+
+    def chapter_documents():
+        # (file name, text) of each chapter, read one at a time
+        for number, chapter_info in enumerate(chapters_data, start=first_number):
+            chapter_filename = TXT_CHAPTER_FILENAME_TEMPLATE.format(number=number, title=sanitize_filename(chapter_info['title'], fallback='chapter'))
+            yield chapter_filename, f"{chapter_info['title']}\n\n{chapter_html_to_text(chapter_info['content_html'])}\n"
+
+    if split_chapters:
+        if return_bytes:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for chapter_filename, text in chapter_documents():
+                    archive.writestr(chapter_filename, text.encode('utf-8'))
+            logger.info(f"TXT chapters '{output_filename}' created in memory ({buffer.tell()} bytes).")
+            return buffer.getvalue(), output_filename
+        output_path = os.path.join(output_directory or OUTPUT_DIR, output_filename)
+        os.makedirs(output_path, exist_ok=True)
+        count = 0
+        for chapter_filename, text in chapter_documents():
+            with open(os.path.join(output_path, chapter_filename), 'w', encoding='utf-8', newline='\n') as f:
+                f.write(text)
+            count += 1
+        logger.info(f"TXT chapters written: {output_path} ({count} files)")
+        return output_path
+
+    def write_book(f):
+        if not append:
+            f.write(f"{title}\n{author}\n\n{description}\n\nSource: {book_url}\n") # Same fields as the EPUB title page
+        for _, text in chapter_documents():
+            f.write(f"\n\n{text}")
+
+    if return_bytes:
+        buffer = io.BytesIO()
+        with io.TextIOWrapper(buffer, encoding='utf-8', newline='\n', write_through=True) as f:
+            write_book(f)
+            content = buffer.getvalue()
+        logger.info(f"TXT '{output_filename}' created in memory ({len(content)} bytes).")
+        return content, output_filename
+    os.makedirs(output_directory or OUTPUT_DIR, exist_ok=True)
+    output_path = os.path.join(output_directory or OUTPUT_DIR, output_filename)
+    with open(output_path, 'a' if append else 'w', encoding='utf-8', newline='\n') as f:
+        write_book(f)
+    logger.info(f"TXT {'updated' if append else 'created'} successfully: {output_path} ({os.path.getsize(output_path)} bytes)")
+    return output_path
+
+# --- Full-text search index ---
+class SearchIndex:
+    """
+    Full-text index of chapter text in a SQLite file, keyed by book URL and chapter URL.
+
+    Chapter text goes into an FTS5 table with the trigram tokenizer, which matches any
+    substring of three or more characters and so works for Chinese text without a word
+    segmenter. Shorter search terms (two-character names are common) fall back to a LIKE
+    scan of the indexed text. Re-indexing a chapter replaces its text.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Searches can run while a build is adding chapters
+            conn.execute("""CREATE TABLE IF NOT EXISTS books (
+                book_url TEXT PRIMARY KEY,
+                title TEXT,
+                author TEXT,
+                indexed_at REAL)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS chapters (
+                id INTEGER PRIMARY KEY,
+                book_url TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                title TEXT,
+                url TEXT NOT NULL,
+                UNIQUE (book_url, url))""")
+            # Raises sqlite3.OperationalError on SQLite builds without FTS5 or the trigram tokenizer (3.34+)
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chapter_text USING fts5(title, text, tokenize='trigram')")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call keeps the index usable from the HTTP server's threads;
+        # the block runs as one transaction and the connection is closed after it
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def add_chapters(self, book_url, book_title, book_author, chapters):
+        """Indexes (position, title, url, text) chapters of a book in one transaction, replacing earlier text of the same chapters."""
+        with self._connect() as conn:
+            conn.execute("INSERT INTO books (book_url, title, author, indexed_at) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT (book_url) DO UPDATE SET title = excluded.title, author = excluded.author, indexed_at = excluded.indexed_at",
+                         (book_url, book_title, book_author, time.time()))
+            for position, title, url, text in chapters:
+                row = conn.execute("SELECT id FROM chapters WHERE book_url = ? AND url = ?", (book_url, url)).fetchone()
+                if row:
+                    chapter_id = row[0]
+                    conn.execute("UPDATE chapters SET position = ?, title = ? WHERE id = ?", (position, title, chapter_id))
+                    conn.execute("DELETE FROM chapter_text WHERE rowid = ?", (chapter_id,))
+                else:
+                    chapter_id = conn.execute("INSERT INTO chapters (book_url, position, title, url) VALUES (?, ?, ?, ?)",
+                                              (book_url, position, title, url)).lastrowid
+                conn.execute("INSERT INTO chapter_text (rowid, title, text) VALUES (?, ?, ?)", (chapter_id, title, text))
+
+    def search(self, query, book_url=None, limit=SEARCH_RESULT_LIMIT):
+        """
+        Finds chapters containing every whitespace-separated term of query, optionally in
+        one book. Returns a list of dicts with 'book_url', 'book_title', 'position',
+        'chapter_title', 'chapter_url' and 'snippet' (the hit in context, in [brackets]),
+        best matches first. Raises ValueError for an empty query.
+        """
+        terms = query.split()
+        if not terms:
+            raise ValueError("Empty search query")
+        long_terms = [term for term in terms if len(term) >= 3] # Trigram index lookups
+        short_terms = [term for term in terms if len(term) < 3] # LIKE scan
+        conditions, params = [], []
+        if long_terms:
+            conditions.append("chapter_text MATCH ?")
+            params.append(' '.join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        for term in short_terms:
+            conditions.append("chapter_text.text LIKE ? ESCAPE '\\'")
+            params.append('%' + re.sub(r'([%_\\])', r'\\\1', term) + '%')
+        if book_url:
+            conditions.append("chapters.book_url = ?")
+            params.append(book_url)
+        snippet = f"snippet(chapter_text, 1, '[', ']', '…', {SEARCH_SNIPPET_CHARS})" if long_terms else "chapter_text.text"
+        order = "bm25(chapter_text)" if long_terms else "chapters.book_url, chapters.position"
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT chapters.book_url, books.title, chapters.position, chapters.title, chapters.url, {snippet} "
+                                f"FROM chapter_text JOIN chapters ON chapters.id = chapter_text.rowid JOIN books ON books.book_url = chapters.book_url "
+                                f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?", params + [limit]).fetchall()
+        return [{'book_url': row[0], 'book_title': row[1], 'position': row[2], 'chapter_title': row[3], 'chapter_url': row[4],
+                 'snippet': row[5].replace('\n', ' ') if long_terms else make_search_snippet(row[5], short_terms[0])} for row in rows]
+
+def make_search_snippet(text, term):
+    """Returns the text around the first occurrence of term, with the term in [brackets] (as FTS5's snippet() does)."""
+    start = text.lower().find(term.lower())
+    if start < 0:
+        return text[:SEARCH_SNIPPET_CHARS]
+    end = start + len(term)
+    before = max(0, start - SEARCH_SNIPPET_CHARS // 2)
+    after = min(len(text), end + SEARCH_SNIPPET_CHARS // 2)
+    return (('…' if before else '') + text[before:start] + '[' + text[start:end] + ']' + text[end:after] + ('…' if after < len(text) else '')).replace('\n', ' ')
+
+class SearchIndexer:
+    """
+    Adds a book's chapters to a SearchIndex as they are fetched.
+
+    Pass add as the on_chapter callback of fetch_chapters_content; chapters are written
+    SEARCH_INDEX_BATCH at a time, so a long crawl is searchable while it runs and a failed
+    build keeps what it had indexed. Call close() at the end to write the last batch.
+    positions maps an index in chapter_links to the chapter's position in the book
+    (appends and repairs fetch only part of it).
+    """
+
+    def __init__(self, search_index, book_url, book_title, book_author, chapter_links, positions=None, logger=None):
+        if logger is None: logger = logging.getLogger() # Use default logger if none provided
+        self.search_index = search_index
+        self.book_url = book_url
+        self.book_title = book_title
+        self.book_author = book_author
+        self.chapter_links = chapter_links
+        self.positions = positions
+        self.logger = logger
+        self.indexed = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, index, chapter):
+        """Queues the fetched chapter at chapter_links[index] for indexing."""
+        position = self.positions[index] if self.positions is not None else index
+        with self._lock:
+            self._pending.append((position, chapter['title'], self.chapter_links[index]['url'], chapter_html_to_text(chapter['content_html'])))
+            if len(self._pending) >= SEARCH_INDEX_BATCH:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        try:
+            with METRICS.span('search_index'):
+                self.search_index.add_chapters(self.book_url, self.book_title, self.book_author, self._pending)
+            self.indexed += len(self._pending)
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not update search index {self.search_index.path}: {e}") # Indexing never fails a build
+        self._pending = []
+
+    def close(self):
+        """Writes the chapters still queued."""
+        with self._lock:
+            self._flush()
+        if self.indexed:
+            self.logger.info(f"Search index: {self.indexed} chapter(s) of '{self.book_title}' indexed in {self.search_index.path}")
+
+def start_search_indexing(book_url, book_title, book_author, chapter_links, positions=None, logger=None):
+    """Returns a SearchIndexer for the book if SEARCH_INDEX_PATH is set (and the index can be opened), else None."""
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if not SEARCH_INDEX_PATH:
+        return None
+    try:
+        search_index = SearchIndex(SEARCH_INDEX_PATH)
+    except sqlite3.Error as e:
+        logger.warning(f"Search index {SEARCH_INDEX_PATH} unavailable, not indexing this book: {e}")
+        return None
+    return SearchIndexer(search_index, book_url, book_title, book_author, chapter_links, positions=positions, logger=logger)
+
+import os
+import urllib.parse
+
+def handle_fcgi_request():
+    """Handles incoming FCGI requests (parsing QUERY_STRING)."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - FCGI - %(levelname)s - %(message)s')
+    logging.info("FCGI request received.")
+
+    # Parse QUERY_STRING environment variable instead of using cgi.FieldStorage
+    query_string = os.environ.get('QUERY_STRING', '')
+    params = urllib.parse.parse_qs(query_string)
     logging.debug(f"FCGI Query Params: {params}")
 
     # Get values from parsed parameters (note: parse_qs returns lists)
@@ -945,7 +2140,25 @@ def handle_fcgi_request():
             logging.error(f"FCGI Error: Invalid 'end' parameter: {end_chapter}")
             return
 
-    logging.info(f"FCGI Params: url='{url}', start={start_chapter_num}, end={end_chapter_num}")
+    compression = params.get('compression', [SERVER_COMPRESSION_PROFILE])[0] or SERVER_COMPRESSION_PROFILE
+    if compression not in COMPRESSION_PROFILES:
+        print("Status: 400 Bad Request")
+        print("Content-Type: text/plain")
+        print()
+        print(f"Error: 'compression' must be one of: {', '.join(COMPRESSION_PROFILES)}.")
+        logging.error(f"FCGI Error: Invalid 'compression' parameter: {compression}")
+        return
+
+    output_format = params.get('format', ['epub'])[0] or 'epub' # One download, so one format
+    if output_format not in OUTPUT_FORMATS:
+        print("Status: 400 Bad Request")
+        print("Content-Type: text/plain")
+        print()
+        print(f"Error: 'format' must be one of: {', '.join(OUTPUT_FORMATS)}.")
+        logging.error(f"FCGI Error: Invalid 'format' parameter: {output_format}")
+        return
+
+    logging.info(f"FCGI Params: url='{url}', start={start_chapter_num}, end={end_chapter_num}, compression={compression}, format={output_format}")
 
     # --- Call Core Logic ---
     try:
@@ -970,20 +2183,35 @@ def handle_fcgi_request():
         if not chapter_links:
             raise ValueError("No chapters found for the specified range.")
 
-        # Fetch chapter content
-        chapters_content_data = fetch_chapters_content(chapter_links, site_config, logger=logger)
-        if not chapters_content_data:
-             raise ValueError("Failed to fetch content for any chapters.")
+        # Fetch chapter content (the spool file is removed once the book is built), and the cover meanwhile
+        cover_future = start_cover_download(cover_url, logger=logger) if output_format == 'epub' else None
+        search_indexer = start_search_indexing(normalize_book_url(url, site_config), book_title, book_author, chapter_links, logger=logger)
+        try:
+            chapters_content_data = fetch_chapters_content(chapter_links, site_config, logger=logger,
+                                                           on_chapter=search_indexer.add if search_indexer else None)
+        finally:
+            if search_indexer: search_indexer.close() # Indexes the last batch, also if fetching failed
+        with chapters_content_data:
+            if not chapters_content_data:
+                 raise ValueError("Failed to fetch content for any chapters.")
 
-        # Create EPUB in memory
-        epub_content, epub_filename = create_epub(
-            book_title, book_author, book_description, chapters_content_data,
-            metadata_url, cover_url, output_directory=None, return_bytes=True, logger=logger # Request bytes
-        )
+            if output_format == 'epub':
+                # Create EPUB in memory
+                cover_image = cover_future.result()
+                epub_content, epub_filename = create_epub(
+                    book_title, book_author, book_description, chapters_content_data,
+                    metadata_url, cover_url if cover_image else None, output_directory=None, return_bytes=True, logger=logger, # Request bytes
+                    cover_image=cover_image, compression=compression
+                )
+            else:
+                epub_content, epub_filename = create_txt(
+                    book_title, book_author, book_description, chapters_content_data, metadata_url, output_directory=None,
+                    split_chapters=(output_format == 'txt-chapters'), return_bytes=True, logger=logger
+                )
 
         # --- Send Response ---
         print(f"Content-Disposition: attachment; filename=\"{epub_filename}\"")
-        print("Content-Type: application/epub+zip")
+        print(f"Content-Type: {OUTPUT_CONTENT_TYPES[output_format]}")
         print(f"Content-Length: {len(epub_content)}")
         print("Status: 200 OK") # Optional, but good practice
         print() # End of headers
@@ -992,7 +2220,7 @@ def handle_fcgi_request():
         # Need to flush stdout and potentially write in binary mode
         sys.stdout.buffer.write(epub_content)
         sys.stdout.buffer.flush()
-        logging.info(f"Successfully sent EPUB: {epub_filename}")
+        logging.info(f"Successfully sent {output_format}: {epub_filename}")
 
     except Exception as e:
         logging.exception("FCGI Error during EPUB generation:") # Log traceback
@@ -1001,8 +2229,37 @@ def handle_fcgi_request():
         print()
         print(f"Error generating EPUB: {e}")
 
+def get_book_page_urls(book_url, site_config):
+    """
+    Returns (metadata_url, chapter_list_url) for a book.
+
+    For sites with needs_metadata_fetch the URLs are built from the book ID in book_url
+    and the site's URL templates; otherwise both are the book URL itself. Raises
+    ValueError if the book ID or templates are missing.
+    """
+    if not site_config.get('needs_metadata_fetch', False):
+        return book_url, book_url
+    book_id_match = re.search(r'/(?:book|txt|info|read|chapter)/(\d+)', book_url)
+    if not book_id_match:
+        path_part = urllib.parse.urlparse(book_url).path # Use urllib.parse consistently
+        book_id_match = re.search(r'/(\d+)/?$', path_part)
+        if not book_id_match:
+            book_id_match = re.search(r'_(\d+)', book_url)
+    if not book_id_match:
+        raise ValueError("Could not extract book ID from URL for metadata lookup")
+
+    book_id = book_id_match.group(1)
+    metadata_url_template = site_config.get('metadata_url_template')
+    chapter_list_url_template = site_config.get('chapter_list_url_template')
+    if not metadata_url_template or not chapter_list_url_template:
+         raise ValueError("Missing 'metadata_url_template' or 'chapter_list_url_template' in site config")
+    metadata_url = metadata_url_template.format(base_url=site_config['base_url'], book_id=book_id)
+    chapter_list_url = chapter_list_url_template.format(base_url=site_config['base_url'], book_id=book_id)
+    return metadata_url, chapter_list_url
+
 # --- Helper function to consolidate initial page fetching ---
 # Renamed from fetch_initial_pages_fcgi
+@METRICS.timed('fetch_initial_pages')
 def fetch_initial_pages(book_url, site_config, logger=None):
     """Fetches initial index/metadata pages based on site config. Returns tuple."""
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
@@ -1013,28 +2270,13 @@ def fetch_initial_pages(book_url, site_config, logger=None):
 
     if site_config.get('needs_metadata_fetch', False):
         try:
-            book_id_match = re.search(r'/(?:book|txt|info|read|chapter)/(\d+)', book_url)
-            if not book_id_match:
-                path_part = urllib.parse.urlparse(book_url).path # Use urllib.parse consistently
-                book_id_match = re.search(r'/(\d+)/?$', path_part)
-                if not book_id_match:
-                    book_id_match = re.search(r'_(\d+)', book_url)
-            if not book_id_match:
-                raise ValueError("Could not extract book ID from URL for metadata lookup")
-
-            book_id = book_id_match.group(1)
-            metadata_url_template = site_config.get('metadata_url_template')
-            chapter_list_url_template = site_config.get('chapter_list_url_template')
-            if not metadata_url_template or not chapter_list_url_template:
-                 raise ValueError("Missing 'metadata_url_template' or 'chapter_list_url_template' in site config")
-
-            metadata_url = metadata_url_template.format(base_url=site_config['base_url'], book_id=book_id)
+            metadata_url, chapter_list_url = get_book_page_urls(book_url, site_config)
             logger.info(f"Fetching metadata page: {metadata_url}")
             metadata_html = fetch_url(metadata_url, logger=logger)
             if not metadata_html:
                  raise ConnectionError(f"Failed to fetch metadata page: {metadata_url}")
 
-            chapter_list_fetch_url = chapter_list_url_template.format(base_url=site_config['base_url'], book_id=book_id)
+            chapter_list_fetch_url = chapter_list_url
             logger.info(f"Fetching chapter list page: {chapter_list_fetch_url}")
             index_html = fetch_url(chapter_list_fetch_url, logger=logger)
             if not index_html:
@@ -1084,47 +2326,1432 @@ def filter_chapters_by_range(chapter_links, start_chapter_num, end_chapter_num,
          return chapter_links
 
 # --- Helper function to consolidate chapter content fetching ---
-def fetch_chapters_content(chapter_links, site_config, logger=None):
-    """Fetches and cleans content for a list of chapter links."""
+def find_content_container(soup, site_config, logger=None):
+    """Returns the first chapter content container found with the site's content selectors, or None."""
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    content_selectors = site_config.get('chapter_content_selectors', {}).get('container', [])
+    for selector_info in content_selectors:
+         try:
+             content_div = None
+             if isinstance(selector_info, tuple) and len(selector_info) == 2:
+                  content_div = soup.find(selector_info[0], selector_info[1])
+             elif isinstance(selector_info, str):
+                  content_div = soup.select_one(selector_info)
+             if content_div:
+                 logger.debug(f"Found content container using: {selector_info}")
+                 return content_div
+         except Exception as e:
+             logger.warning(f"Error applying content selector {selector_info}: {e}")
+             continue
+    return None
+
+def fetch_chapter(chapter_info, site_config, logger=None, **fetch_kwargs):
+    """Fetches and cleans a single chapter.
+
+    Returns a tuple (content_html, failure_reason). content_html is None on failure and
+    failure_reason is one of 'fetch_error', 'content_not_found' or 'empty_content'.
+    Extra keyword arguments are passed through to fetch_url.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    chapter_html_page = fetch_url(chapter_info['url'], logger=logger, **fetch_kwargs)
+    if not chapter_html_page:
+        return None, 'fetch_error'
+
+    with METRICS.span('parse'):
+        soup = BeautifulSoup(chapter_html_page, 'html.parser')
+    content_div = find_content_container(soup, site_config, logger=logger)
+    if not content_div:
+        content_selectors = site_config.get('chapter_content_selectors', {}).get('container', [])
+        logger.warning(f"Could not find content div for chapter: {chapter_info['title']} at {chapter_info['url']} using selectors {content_selectors}")
+        return None, 'content_not_found'
+
+    cleaned_content_html = clean_html_content(content_div, site_config, logger=logger)
+    if not cleaned_content_html:
+        logger.warning(f"Content div found but no text extracted for chapter: {chapter_info['title']}")
+        return None, 'empty_content'
+    return cleaned_content_html, None
+
+def get_mirror_urls(url, site_config):
+    """Returns the chapter URL rewritten onto each of the site's configured mirror hosts."""
+    parsed_url = urllib.parse.urlparse(url)
+    mirror_urls = []
+    for mirror_base_url in site_config.get('mirror_base_urls', []):
+        parsed_mirror = urllib.parse.urlparse(mirror_base_url)
+        mirror_urls.append(urllib.parse.urlunparse(parsed_url._replace(scheme=parsed_mirror.scheme, netloc=parsed_mirror.netloc)))
+    return mirror_urls
+
+class ChapterSpool:
+    """
+    The cleaned chapters of one job, in chapter order.
+
+    Chapters are kept in memory until their text passes memory_threshold bytes. After that
+    each new chapter is appended to a scratch file (removed on close) and only its title,
+    offset and length are kept, so a job's memory stops growing with the size of the book.
+    Chapters can be put in any order (the retry pass fills gaps at the end) and are read
+    back in position order. Reads as a sequence of Chapters with 'title' and 'content_html';
+    lazy_chapters() returns Chapters whose 'content_html' is a loader instead, so the EPUB
+    writer reads each chapter only when it writes it. on_put(position, chapter), if given,
+    is called after each put (see SearchIndexer).
+    """
+
+    def __init__(self, memory_threshold=None, directory=None, on_put=None):
+        self.memory_threshold = CHAPTER_SPOOL_MEMORY_THRESHOLD if memory_threshold is None else memory_threshold
+        self.directory = directory or CHAPTER_SPOOL_DIR
+        self.on_put = on_put
+        self.memory_bytes = 0
+        self.spooled_bytes = 0
+        self._entries = {} # position -> (title, content_html or None if spooled, offset, length)
+        self._positions = None # Sorted positions, rebuilt after a put
+        self._file = None
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def put(self, position, chapter):
+        """Stores a chapter ('title' and 'content_html') at its position in the chapter list."""
+        data = chapter['content_html'].encode('utf-8')
+        with self._lock:
+            if self.closed:
+                raise ValueError("spool closed")
+            if self.memory_bytes + len(data) <= self.memory_threshold:
+                self._entries[position] = (chapter['title'], chapter['content_html'], None, len(data))
+                self.memory_bytes += len(data)
+            else:
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile(prefix='chapters-', suffix='.spool', dir=self.directory)
+                self._file.seek(0, os.SEEK_END)
+                self._entries[position] = (chapter['title'], None, self._file.tell(), len(data))
+                self._file.write(data)
+                self.spooled_bytes += len(data)
+            self._positions = None
+        if self.on_put:
+            self.on_put(position, chapter)
+
+    def _ordered(self):
+        with self._lock:
+            if self._positions is None:
+                self._positions = sorted(self._entries)
+            return [self._entries[position] for position in self._positions]
+
+    def _load(self, entry):
+        title, content_html, offset, length = entry
+        with self._lock:
+            if self.closed: # Also for lazy_chapters() loaders that outlive the spool
+                raise ValueError("spool closed")
+            if content_html is not None:
+                return content_html
+            self._file.seek(offset)
+            return self._file.read(length).decode('utf-8')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        entry = self._ordered()[index]
+        return Chapter(entry[0], content_html=self._load(entry))
+
+    def __iter__(self):
+        for entry in self._ordered():
+            yield Chapter(entry[0], content_html=self._load(entry))
+
+    def content_sizes(self):
+        """Returns the UTF-8 size of each chapter's content, in order, without reading it back."""
+        return [entry[3] for entry in self._ordered()]
+
+    def lazy_chapters(self, start=0, stop=None):
+        """Returns chapters start..stop (in order) as Chapters whose 'content_html' is a zero-argument loader."""
+        return [Chapter(entry[0], content_html=functools.partial(self._load, entry)) for entry in self._ordered()[start:stop]]
+
+    def close(self):
+        """Removes the scratch file. The spool can't be read afterwards (reads raise ValueError)."""
+        with self._lock:
+            self.closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._entries = {}
+            self._positions = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def retry_failed_chapters(failed_chapters, results, site_config, logger=None):
+    """
+    Retries chapters that failed during the main crawl.
+
+    Uses a fresh non-keep-alive session, a slower linear backoff and, if the site config
+    lists any, mirror hosts. Successful chapters are put into the results ChapterSpool at
+    their original index. Returns the list of chapters that are still missing.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    logger.info(f"Retry pass: re-fetching {len(failed_chapters)} failed chapter(s)...")
+    still_failed = []
+    with requests.Session() as session:
+        session.headers['Connection'] = 'close' # Don't reuse connections from the throttled main pass
+        session.mount('https://', TimedHTTPAdapter())
+        session.mount('http://', TimedHTTPAdapter())
+        for failure in failed_chapters:
+            reason = failure['reason']
+            for attempt_url in [failure['url']] + get_mirror_urls(failure['url'], site_config):
+                logger.info(f"Retrying chapter {failure['index']+1}: {failure['title']} ({attempt_url}), previous failure: {reason}")
+                content_html, reason = fetch_chapter(Chapter(failure['title'], attempt_url), site_config, logger=logger,
+                                                     max_retries=RETRY_PASS_MAX_RETRIES, backoff_base=RETRY_PASS_BACKOFF_BASE,
+                                                     session=session, delay=RETRY_PASS_DELAY)
+                if content_html:
+                    results.put(failure['index'], Chapter(failure['title'], content_html=content_html))
+                    METRICS.increment('chapter_retry_pass', site=get_url_host(failure['url']), result='recovered')
+                    break
+            else:
+                still_failed.append(dict(failure, reason=reason))
+                METRICS.increment('chapter_retry_pass', site=get_url_host(failure['url']), result='missing')
+
+    logger.info(f"Retry pass recovered {len(failed_chapters) - len(still_failed)} of {len(failed_chapters)} chapter(s).")
+    return still_failed
+
+def fetch_chapters_content(chapter_links, site_config, logger=None, retry_failed=True, failed_chapters=None, on_chapter=None):
+    """
+    Fetches and cleans content for a list of chapter links.
+
+    Chapters that fail are queued with their failure reason and, if retry_failed is True,
+    retried at the end by retry_failed_chapters. Chapters still missing after that are
+    appended to failed_chapters (if a list is given) as dicts with 'index' (position in
+    chapter_links), 'title', 'url' and 'reason'. on_chapter(index, chapter) is called for
+    each chapter as soon as it is fetched and cleaned (e.g. SearchIndexer.add). Returns
+    the fetched chapters as a ChapterSpool; close it when done.
+    """
     if logger is None: logger = logging.getLogger() # Use default logger if none provided
-    chapters_content_data = []
     total_chapters = len(chapter_links)
+    results = ChapterSpool(on_put=on_chapter) # Keeps chapter order when retried chapters are filled in later
+    failures = []
     logger.info(f"Attempting to fetch content for {total_chapters} chapters...")
 
     for i, chapter_info in enumerate(chapter_links):
         logger.info(f"Processing chapter {i+1}/{total_chapters}: {chapter_info['title']} ({chapter_info['url']})")
-        chapter_html_page = fetch_url(chapter_info['url'], logger=logger)
-        if chapter_html_page:
-            soup = BeautifulSoup(chapter_html_page, 'html.parser')
-            content_div = None
-            content_selectors = site_config.get('chapter_content_selectors', {}).get('container', [])
-            for selector_info in content_selectors:
-                 try:
-                     if isinstance(selector_info, tuple) and len(selector_info) == 2:
-                          content_div = soup.find(selector_info[0], selector_info[1])
-                     elif isinstance(selector_info, str):
-                          content_div = soup.select_one(selector_info)
-                     if content_div:
-                         logger.debug(f"Found content container using: {selector_info}")
-                         break
-                 except Exception as e:
-                     logger.warning(f"Error applying content selector {selector_info}: {e}")
-                     continue
-
-            if content_div:
-                cleaned_content_html = clean_html_content(content_div, site_config, logger=logger)
-                if cleaned_content_html:
-                    chapters_content_data.append({
-                        'title': chapter_info['title'],
-                        'content_html': cleaned_content_html
-                    })
-                else:
-                    logger.warning(f"Content div found but no text extracted for chapter: {chapter_info['title']}")
+        content_html, reason = fetch_chapter(chapter_info, site_config, logger=logger)
+        if content_html:
+            results.put(i, Chapter(chapter_info['title'], content_html=content_html))
+        else:
+            logger.warning(f"Queued chapter for retry ({reason}): {chapter_info['title']}")
+            failures.append({'index': i, 'title': chapter_info['title'], 'url': chapter_info['url'], 'reason': reason})
+
+    if failures and retry_failed:
+        failures = retry_failed_chapters(failures, results, site_config, logger=logger)
+    for failure in failures:
+        logger.warning(f"Skipping chapter {failure['index']+1} after retries ({failure['reason']}): {failure['title']} ({failure['url']})")
+    if failed_chapters is not None:
+        failed_chapters.extend(failures)
+    if results.spooled_bytes:
+        logger.info(f"Chapter spool: {results.memory_bytes} bytes in memory, {results.spooled_bytes} bytes on disk.")
+    return results
+
+# --- Splitting very large books into volumes ---
+def parse_volume_spec(spec):
+    """
+    Parses a volume splitting spec: 'chapters[:N]' (N chapters per volume), 'size[:MB]'
+    (at most MB of chapter text per volume) or 'headings' (the site's own volumes).
+    Returns (mode, limit) with limit in chapters or bytes (None for 'headings').
+    Raises ValueError for an invalid spec.
+    """
+    mode, _, limit = spec.strip().partition(':')
+    mode = mode.lower()
+    if mode not in VOLUME_MODES:
+        raise ValueError(f"Unknown volume mode '{mode}' (expected one of: {', '.join(VOLUME_MODES)})")
+    if mode == 'headings':
+        return mode, None
+    number = float(limit) if limit else (VOLUME_DEFAULT_CHAPTERS if mode == 'chapters' else VOLUME_DEFAULT_MB)
+    if number <= 0:
+        raise ValueError(f"Volume limit must be positive: {spec}")
+    return (mode, max(1, int(number))) if mode == 'chapters' else (mode, int(number * 1024 * 1024))
+
+def site_has_volume_headings(site_config):
+    """True if the site's chapter list marks volume headings: JSON chapter lists do, HTML ones need a 'volume_heading_selector'."""
+    return (site_config.get("chapter_list_method") == "post_json"
+            or bool(site_config.get('chapter_list_selectors', {}).get('volume_heading_selector')))
+
+def split_volumes(chapter_links, chapters_content_data, failed_chapters, mode, limit):
+    """
+    Splits a book into volumes of consecutive chapters.
+
+    chapters_content_data holds the fetched chapters in chapter_links order, minus the
+    failed_chapters. Returns a list of volume dicts with 'number', 'count', 'title'
+    (heading text, 'headings' mode only) and 'start'/'end', the range of chapter_links
+    indexes in the volume.
+    """
+    failed_indexes = {failure['index'] for failure in failed_chapters}
+    if isinstance(chapters_content_data, ChapterSpool):
+        content_sizes = iter(chapters_content_data.content_sizes())
+    else:
+        content_sizes = iter(len(chapter['content_html'].encode('utf-8')) for chapter in chapters_content_data)
+    boundaries = [0]
+    volume_size = 0
+    for i, chapter_info in enumerate(chapter_links):
+        size = 0 if i in failed_indexes else next(content_sizes)
+        if i > boundaries[-1]:
+            if mode == 'chapters':
+                split_here = i - boundaries[-1] >= limit
+            elif mode == 'size':
+                split_here = volume_size + size > limit
+            else:
+                split_here = chapter_info.get('volume') != chapter_links[i - 1].get('volume')
+            if split_here:
+                boundaries.append(i)
+                volume_size = 0
+        volume_size += size
+    boundaries.append(len(chapter_links))
+
+    volumes = []
+    for number, (start, end) in enumerate(zip(boundaries, boundaries[1:]), start=1):
+        volumes.append({'number': number, 'count': len(boundaries) - 1, 'start': start, 'end': end,
+                        'title': chapter_links[start].get('volume') if mode == 'headings' else None})
+    return volumes
+
+def get_volume_book_filename(volume_filename):
+    """The file name a split book was requested under, from one volume's file name: 'book_03.epub' -> 'book.epub'."""
+    stem, ext = os.path.splitext(volume_filename)
+    return re.sub(r'_\d+$', '', stem) + ext
+
+def create_epub_volumes(volumes, title, author, description, chapter_links, chapters_content_data, failed_chapters,
+                        source_url, metadata_url, cover_url, output_dir, output_filename=None, logger=None, compression=None, cover_image=None):
+    """
+    Writes one EPUB (plus build manifest) per volume from split_volumes, VOLUME_WORKERS at a
+    time. cover_image ((content, mimetype) from download_cover_image, or None) is shared
+    by every volume. Volumes whose chapters all failed are skipped. Returns the paths of
+    the written volumes in order.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    failed_indexes = {failure['index'] for failure in failed_chapters}
+    fetched_indexes = [i for i in range(len(chapter_links)) if i not in failed_indexes]
+    if isinstance(chapters_content_data, ChapterSpool):
+        chapters_content_data = chapters_content_data.lazy_chapters() # Volumes read their chapters back as they are written
+
+    def write_volume(volume):
+        start, end = volume['start'], volume['end']
+        volume_chapters = [chapter for i, chapter in zip(fetched_indexes, chapters_content_data) if start <= i < end]
+        if not volume_chapters:
+            logger.warning(f"Volume {volume['number']} has no fetched chapters; skipping it.")
+            return None
+        volume_filename = None
+        if output_filename:
+            stem, ext = os.path.splitext(output_filename)
+            volume_filename = f"{stem}_{volume['number']:02d}{ext or '.epub'}"
+        epub_path = create_epub(title, author, description, volume_chapters, metadata_url, cover_url if cover_image else None, output_dir,
+                                logger=logger, output_filename=volume_filename, cover_image=cover_image, volume=volume,
+                                compression=compression)
+        volume_failures = [dict(failure, index=failure['index'] - start) for failure in failed_chapters if start <= failure['index'] < end]
+        write_build_manifest(epub_path, source_url, metadata_url, title, author, description, cover_url,
+                             chapter_links[start:end], volume_failures, logger=logger, volume=volume, compression=compression)
+        return epub_path
+
+    logger.info(f"Writing {len(volumes)} volume(s) with up to {VOLUME_WORKERS} at a time...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=VOLUME_WORKERS, thread_name_prefix='epub-volume') as executor:
+        return [path for path in executor.map(write_volume, volumes) if path]
+
+# --- Helper function to run the whole pipeline for one book ---
+def normalize_book_url(book_url, site_config):
+    """Ensures a trailing slash for bqg5.com and removes it for other sites."""
+    book_url = book_url.strip()
+    if "bqg5.com" in site_config.get("base_url", ""):
+        return book_url if book_url.endswith('/') else book_url + '/'
+    return book_url.rstrip('/')
+
+def build_book(book_url, start_chapter=1, end_chapter=None, output_dir=None, output_filename=None, logger=None, chapter_fetcher=None, profile=None, append_to=None,
+               volumes=None, compression=None, formats=None):
+    """
+    Runs the full pipeline for one book and writes the EPUB and its build manifest to disk.
+
+    chapter_fetcher replaces fetch_chapters_content for the chapter stage (same signature),
+    e.g. to hand the chapters out to distributed workers. profile ('cprofile' or 'sample')
+    profiles the build and writes the result next to the EPUB (see BuildProfiler).
+    append_to is the path of a previous build of the same book: if its build manifest shows
+    that only chapters at the end are new, just those are fetched and appended to it with
+    append_chapters_to_epub; otherwise the book is rebuilt in its place. For a split book
+    append_to must be its last volume, which then receives the chapters after its own
+    last chapter. If the chapter list no longer extends it, all volumes are rebuilt when
+    volumes is given; otherwise, and for any other volume, it raises, as rebuilding would
+    put the whole book in one volume.
+    volumes is a parse_volume_spec spec ('chapters:500', 'size:20', 'headings') that splits
+    a full build into several EPUBs, each with its own build manifest (see split_volumes).
+    compression is the COMPRESSION_PROFILES profile of the written EPUB(s).
+    formats (parse_output_formats spec, default 'epub') adds plain-text exports written from
+    the same crawl with create_txt, or replaces the EPUB with them; append_to needs 'epub',
+    and its text exports get the appended chapters as well (see get_txt_filename).
+    If SEARCH_INDEX_PATH is set, the fetched chapters are added to that search index as they
+    arrive (see SearchIndexer). Returns a result dict with 'url', 'status' ('ok', 'partial' or 'failed'), 'epub_path'
+    (the last volume of a split book), 'chapters', 'missing_chapters', 'appended_chapters',
+    'compression', 'epub_seconds' and 'epub_bytes' (time spent assembling and writing the
+    EPUB(s), and their total size), 'txt_paths', 'elapsed_seconds', 'error', 'volume_paths'
+    for a split book, 'chapter_urls' (every chapter the outputs cover, fetched or missing,
+    of a build that did not fail) and, when profiling, 'profile_path'. Errors are logged and recorded in
+    the result rather than raised, so batch runs can continue.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    started = time.time()
+    result = {'url': book_url, 'status': 'failed', 'epub_path': None, 'chapters': 0, 'missing_chapters': 0, 'appended_chapters': 0,
+              'compression': compression or DEFAULT_COMPRESSION_PROFILE, 'epub_seconds': None, 'epub_bytes': None, 'txt_paths': [], 'error': None}
+    if append_to:
+        output_dir = output_dir or os.path.dirname(append_to) or '.'
+        output_filename = output_filename or os.path.basename(append_to)
+    profiler = BuildProfiler(profile) if profile else None
+    if profiler: profiler.start()
+    memory_checkpoint('start', logger=logger, report=False)
+    chapters_content_data = None
+    search_indexer = None
+    try:
+        volume_split = parse_volume_spec(volumes) if volumes else None
+        get_compression_level(compression) # Reject an unknown profile before crawling
+        formats = parse_output_formats(formats or 'epub')
+        if append_to and 'epub' not in formats:
+            raise ValueError("Appending only updates an EPUB; add the 'epub' format or build without appending.")
+        site_config = get_site_config(book_url, logger=logger)
+        if not site_config:
+            raise ValueError(f"Unsupported website URL: {book_url}")
+        if volume_split and volume_split[0] == 'headings' and not site_has_volume_headings(site_config):
+            raise ValueError(f"--volumes headings is not supported for {site_config['base_url']}: its chapter list has no volume headings "
+                             "(set 'volume_heading_selector' in its chapter_list_selectors, or split by chapters or size)")
+        book_url = normalize_book_url(book_url, site_config)
+        logger.info(f"Starting EPUB creation for: {book_url}")
+        logger.info(f"Using config for: {site_config['base_url']}")
+
+        index_html, metadata_html, metadata_url, chapter_list_fetch_url = fetch_initial_pages(book_url, site_config, logger=logger)
+        if not index_html or not metadata_html:
+            raise ConnectionError("Failed to fetch book index and/or metadata page(s).")
+        memory_checkpoint('fetch_initial_pages', logger=logger)
+
+        # Use metadata_html for details (metadata_url needed for cover resolution), index_html for chapters
+        book_title, book_author, book_description, cover_url = get_book_details(metadata_html, metadata_url, site_config, logger=logger)
+        chapter_links = get_chapter_links(index_html, chapter_list_fetch_url or book_url, site_config, logger=logger)
+        chapter_links = filter_chapters_by_range(chapter_links, start_chapter, end_chapter, logger=logger)
+        if not chapter_links:
+            raise ValueError("No chapter links found.")
+        memory_checkpoint('chapter_list', logger=logger)
+
+        previous_manifest = None
+        if append_to and os.path.exists(append_to):
+            try:
+                previous_manifest = load_build_manifest(append_to)
+            except FileNotFoundError:
+                logger.warning(f"No build manifest for {append_to}; rebuilding it.")
+        previous_volume = previous_manifest.get('volume') if previous_manifest else None
+        if previous_volume and previous_volume['number'] != previous_volume['count']:
+            # New chapters belong after the book's last chapter, which is in the last volume
+            raise ValueError(f"{append_to} is volume {previous_volume['number']} of {previous_volume['count']}; "
+                             "only the last volume of a split book can be appended to.")
+        appended_links = get_appended_chapter_links(previous_manifest['chapters'], chapter_links) if previous_manifest else None
+        if previous_volume and appended_links is None:
+            if not volume_split: # Rebuilding here would write the whole book into one volume's file
+                raise ValueError(f"Chapter list of {book_url} no longer extends the volume {append_to}; rebuild the book with --volumes instead of appending.")
+            output_filename = get_volume_book_filename(output_filename) # Rebuild every volume under the book's own name
+        if previous_manifest and appended_links is None:
+            logger.info(f"Chapter list of {book_url} no longer extends the one in {append_to}; rebuilding it.")
+        # Text exports of an appended book are extended too; a volume can't rebuild the whole book's export
+        txt_outputs = [(output_format == 'txt-chapters', get_txt_filename(output_filename, output_format == 'txt-chapters', volume=previous_volume))
+                       for output_format in formats if output_format.startswith('txt')] if appended_links is not None else []
+        if previous_volume and any(not os.path.exists(os.path.join(output_dir, txt_filename)) for _, txt_filename in txt_outputs):
+            raise ValueError(f"No text export of the whole book next to {append_to} to extend; rebuild the book with --volumes and --format.")
+
+        failed_chapters = []
+        chapter_fetcher = chapter_fetcher or fetch_chapters_content
+        # An appended EPUB keeps its cover; otherwise fetch the cover while the chapters are crawled
+        cover_future = start_cover_download(cover_url, logger=logger) if appended_links is None and 'epub' in formats else None
+        if appended_links is not None:
+            # Earlier chapters are already in the EPUB: fetch only the new ones and append them
+            previous_chapters = previous_manifest['chapters']
+            failed_chapters = [{'index': i, 'reason': chapter.get('reason')} for i, chapter in enumerate(previous_chapters) if chapter['status'] == 'missing']
+            new_failures = []
+            search_indexer = start_search_indexing(book_url, book_title, book_author, appended_links,
+                                                   positions=range(len(previous_chapters), len(previous_chapters) + len(appended_links)), logger=logger)
+            chapters_content_data = chapter_fetcher(appended_links, site_config, logger=logger, failed_chapters=new_failures,
+                                                    on_chapter=search_indexer.add if search_indexer else None) if appended_links else []
+            if appended_links and not chapters_content_data:
+                raise ValueError("No content collected for the new chapters. EPUB left unchanged.")
+            memory_checkpoint('fetch_chapters_content', logger=logger)
+            failed_chapters += [dict(failure, index=len(previous_chapters) + failure['index']) for failure in new_failures]
+            chapter_links = previous_chapters + appended_links
+            epub_path = append_to
+            compression = compression or previous_manifest.get('compression') # New chapters are deflated like the rest of the book
+            result['compression'] = compression or DEFAULT_COMPRESSION_PROFILE
+            epub_started = time.time()
+            if chapters_content_data:
+                append_chapters_to_epub(epub_path, chapters_content_data, logger=logger, compression=compression)
+            else:
+                logger.info(f"No new chapters for {book_url}; {epub_path} is up to date.")
+            result.update(epub_seconds=round(time.time() - epub_started, 2), epub_bytes=os.path.getsize(epub_path))
+            memory_checkpoint('append_epub', logger=logger)
+            book_title, book_author, book_description, cover_url = (previous_manifest['title'], previous_manifest['author'],
+                                                                    previous_manifest['description'], previous_manifest['cover_url'])
+            write_build_manifest(epub_path, book_url, metadata_url, book_title, book_author, book_description, cover_url,
+                                 chapter_links, failed_chapters, logger=logger, volume=previous_manifest.get('volume'), compression=compression)
+            for split_chapters, txt_filename in txt_outputs:
+                txt_path = os.path.join(output_dir, txt_filename)
+                if os.path.exists(txt_path):
+                    if chapters_content_data:
+                        create_txt(book_title, book_author, book_description, chapters_content_data, metadata_url, output_dir,
+                                   split_chapters=split_chapters, logger=logger, output_filename=txt_filename, append=True)
+                else: # First text export of this book: write all of it from the updated EPUB
+                    create_txt(book_title, book_author, book_description, read_epub_chapters(epub_path), metadata_url, output_dir,
+                               split_chapters=split_chapters, logger=logger, output_filename=txt_filename)
+                result['txt_paths'].append(txt_path)
+            result['appended_chapters'] = len(chapters_content_data)
+            chapter_count = len(chapter_links) - len(failed_chapters)
+        else:
+            search_indexer = start_search_indexing(book_url, book_title, book_author, chapter_links, logger=logger)
+            chapters_content_data = chapter_fetcher(chapter_links, site_config, logger=logger, failed_chapters=failed_chapters,
+                                                    on_chapter=search_indexer.add if search_indexer else None)
+            if not chapters_content_data:
+                raise ValueError("No chapter content collected. EPUB creation aborted.")
+            memory_checkpoint('fetch_chapters_content', logger=logger)
+
+            volume_plan = split_volumes(chapter_links, chapters_content_data, failed_chapters, *volume_split) if volume_split else []
+            if volume_split and volume_split[0] == 'headings' and len(volume_plan) < 2:
+                logger.warning(f"No volume headings split {book_url}; writing a single EPUB.")
+            cover_image = cover_future.result() if cover_future else None
+            epub_started = time.time()
+            if 'epub' not in formats:
+                epub_path = None # Plain-text output only
+            elif len(volume_plan) > 1:
+                logger.info(f"Collected content for {len(chapters_content_data)} chapters. Creating {len(volume_plan)} volumes...")
+                volume_paths = create_epub_volumes(volume_plan, book_title, book_author, book_description, chapter_links,
+                                                   chapters_content_data, failed_chapters, book_url, metadata_url, cover_url,
+                                                   output_dir, output_filename=output_filename, logger=logger, compression=compression,
+                                                   cover_image=cover_image)
+                epub_path = volume_paths[-1]
+                result['volume_paths'] = volume_paths
+            else:
+                logger.info(f"Collected content for {len(chapters_content_data)} chapters. Creating EPUB...")
+                epub_path = create_epub(book_title, book_author, book_description, chapters_content_data, metadata_url,
+                                        cover_url if cover_image else None, output_dir, logger=logger, output_filename=output_filename,
+                                        cover_image=cover_image, compression=compression)
+                volume_paths = [epub_path]
+                write_build_manifest(epub_path, book_url, metadata_url, book_title, book_author, book_description, cover_url,
+                                     chapter_links, failed_chapters, logger=logger, compression=compression)
+            if epub_path:
+                result.update(epub_seconds=round(time.time() - epub_started, 2), epub_bytes=sum(os.path.getsize(path) for path in volume_paths))
+                memory_checkpoint('create_epub', logger=logger)
+            for output_format in formats:
+                if output_format.startswith('txt'):
+                    split_chapters = output_format == 'txt-chapters'
+                    result['txt_paths'].append(create_txt(book_title, book_author, book_description, chapters_content_data, metadata_url,
+                                                          output_dir, split_chapters=split_chapters, logger=logger,
+                                                          output_filename=get_txt_filename(output_filename, split_chapters)))
+            chapter_count = len(chapters_content_data)
+        result.update(status='partial' if failed_chapters else 'ok', epub_path=epub_path, chapter_urls=[chapter['url'] for chapter in chapter_links],
+                      chapters=chapter_count, missing_chapters=len(failed_chapters))
+        if failed_chapters and 'volume_paths' in result:
+            logger.warning(f"{len(failed_chapters)} chapter(s) are missing from the volumes. Run with --repair on each volume to fetch only those.")
+        elif failed_chapters and epub_path:
+            logger.warning(f"{len(failed_chapters)} chapter(s) are missing from the EPUB. Run with --repair \"{epub_path}\" to fetch only those.")
+        elif failed_chapters:
+            logger.warning(f"{len(failed_chapters)} chapter(s) are missing from the text export.")
+    except Exception as e:
+        logger.error(f"Building {book_url} failed: {e}")
+        result['error'] = str(e)
+    finally:
+        if search_indexer:
+            search_indexer.close() # Indexes the last batch, also of a failed build
+        if isinstance(chapters_content_data, ChapterSpool):
+            chapters_content_data.close() # Removes the spool file
+    if profiler:
+        profiler.stop()
+        result['profile_path'] = profiler.save(get_profile_path_base(result['epub_path'], book_url, output_dir), logger=logger)
+    result['elapsed_seconds'] = round(time.time() - started, 2)
+    METRICS.observe('build_book', time.time() - started, site=get_url_host(book_url), status=result['status'])
+    return result
+
+# --- Batch mode: many books from a manifest in one process ---
+def load_batch_manifest(manifest_path):
+    """
+    Loads a batch manifest.
+
+    The manifest is JSON: either a list of book entries or an object with a "books" list
+    and optional "output_dir". Each book entry is a URL string or an object with "url"
+    and optional "start", "end", "output" (EPUB file name), "output_dir", "profile"
+    (profile mode for that book, see BuildProfiler), "volumes" (volume splitting spec,
+    see parse_volume_spec), "compression" (a COMPRESSION_PROFILES profile) and "format"
+    (output formats, see parse_output_formats).
+    Returns (books, default_output_dir) with every book normalised to a dict.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    default_output_dir = None
+    if isinstance(manifest, dict):
+        default_output_dir = manifest.get('output_dir')
+        manifest = manifest.get('books', [])
+    books = []
+    for entry in manifest:
+        book = {'url': entry} if isinstance(entry, str) else dict(entry)
+        if not book.get('url'):
+            raise ValueError(f"Batch manifest entry without 'url': {entry}")
+        books.append(book)
+    return books, default_output_dir
+
+def run_batch(manifest_path, workers=BATCH_WORKERS, max_books_per_host=BATCH_MAX_BOOKS_PER_HOST, summary_path=None, output_dir=None, logger=None, profile=None,
+              volumes=None, compression=None, formats=None):
+    """
+    Builds every book in a batch manifest in this process.
+
+    All books share the HTTP connection pool and per-host throttle. Workers pick the next
+    pending book whose site has fewer than max_books_per_host books in flight, so one
+    slow site cannot occupy every worker. A JSON summary of per-book timings and
+    failures is written to summary_path (default: batch_summary.json in the output
+    directory). profile, volumes, compression and formats are the defaults for books that
+    don't set their own.
+    Returns the summary dict.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    books, manifest_output_dir = load_batch_manifest(manifest_path)
+    output_dir = output_dir or manifest_output_dir or OUTPUT_DIR
+    logger.info(f"Batch: {len(books)} book(s) from {manifest_path}, {workers} worker(s), max {max_books_per_host} per host.")
+
+    pending = list(enumerate(books))
+    results = [None] * len(books)
+    active_per_host = {}
+    condition = threading.Condition()
+
+    def next_book():
+        with condition:
+            while pending:
+                for position, (index, book) in enumerate(pending):
+                    host = urllib.parse.urlparse(book['url'].strip()).netloc
+                    if active_per_host.get(host, 0) < max_books_per_host:
+                        del pending[position]
+                        active_per_host[host] = active_per_host.get(host, 0) + 1
+                        return index, book, host
+                condition.wait()
+            return None
+
+    def worker():
+        while True:
+            picked = next_book()
+            if picked is None:
+                return
+            index, book, host = picked
+            book_logger = logging.getLogger(f"batch.{index + 1}")
+            try:
+                result = build_book(book['url'], book.get('start', 1) or 1, book.get('end'),
+                                    book.get('output_dir') or output_dir, book.get('output'), logger=book_logger,
+                                    profile=book.get('profile', profile), volumes=book.get('volumes', volumes),
+                                    compression=book.get('compression', compression), formats=book.get('format', formats))
+            finally:
+                with condition:
+                    active_per_host[host] -= 1
+                    condition.notify_all()
+            results[index] = result
+            outputs = f"EPUB: {result['epub_bytes']} bytes, {result['epub_seconds']}s, {result['compression']}" if result['epub_path'] else "no EPUB"
+            if result['txt_paths']:
+                outputs += f"; TXT: {', '.join(result['txt_paths'])}"
+            logger.info(f"Batch: [{index + 1}/{len(books)}] {result['status']} in {result['elapsed_seconds']}s ({outputs}): {book['url']}")
+
+    started = time.time()
+    threads = [threading.Thread(target=worker, name=f"batch-worker-{n}") for n in range(max(1, min(workers, len(books))))]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    summary = {
+        'manifest': manifest_path,
+        'elapsed_seconds': round(time.time() - started, 2),
+        'books_total': len(books),
+        'books_ok': sum(1 for r in results if r['status'] == 'ok'),
+        'books_partial': sum(1 for r in results if r['status'] == 'partial'),
+        'books_failed': sum(1 for r in results if r['status'] == 'failed'),
+        'books': results,
+    }
+    if not summary_path:
+        summary_path = os.path.join(output_dir, 'batch_summary.json')
+    os.makedirs(os.path.dirname(summary_path) or '.', exist_ok=True)
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+    logger.info(f"Batch finished in {summary['elapsed_seconds']}s: {summary['books_ok']} ok, {summary['books_partial']} partial, "
+                f"{summary['books_failed']} failed. Summary written to {summary_path}")
+    return summary
+
+# --- Watch mode: poll a library for new chapters ---
+def load_watch_state(state_path):
+    """Loads the per-book watch state (keyed by book URL), or an empty dict if there is none yet."""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_watch_state(state_path, state):
+    """Writes the watch state atomically so a crash never leaves a truncated file."""
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, state_path)
+
+def poll_chapter_list(book_url, site_config, book_state, logger=None):
+    """
+    Fetches only a book's chapter list page, conditionally where the site allows it.
+
+    Returns the chapter links, or None if the page is unchanged since the last poll
+    (304 Not Modified, or an identical body when the server ignores validators).
+    Validators and the page fingerprint are stored in book_state.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    if site_config.get("chapter_list_method") == "post_json":
+        # The POST chapter list can't be fetched conditionally; get_chapter_links does the POST itself
+        return get_chapter_links(None, book_url, site_config, logger=logger)
+
+    _, chapter_list_url = get_book_page_urls(book_url, site_config)
+    index_html, validators = fetch_url_conditional(chapter_list_url, book_state.get('etag'), book_state.get('last_modified'), logger=logger)
+    book_state.update(validators)
+    if index_html is None:
+        return None
+    page_digest = hashlib.sha1(index_html.encode('utf-8')).hexdigest()
+    if page_digest == book_state.get('page_digest'):
+        logger.info(f"Chapter list unchanged: {chapter_list_url}")
+        return None
+    book_state['page_digest'] = page_digest
+    return get_chapter_links(index_html, chapter_list_url, site_config, logger=logger)
+
+def update_watch_interval(book_state, found_new_chapters, now):
+    """
+    Adapts a book's polling interval to its update cadence.
+
+    When new chapters appear the interval becomes half the median of the recent gaps
+    between updates; every poll that finds nothing grows it by WATCH_BACKOFF_FACTOR, so
+    books that stopped updating drift towards WATCH_MAX_INTERVAL.
+    """
+    interval = book_state.get('interval', WATCH_DEFAULT_INTERVAL)
+    if found_new_chapters:
+        last_change = book_state.get('last_change')
+        if last_change:
+            gaps = (book_state.get('update_gaps', []) + [now - last_change])[-WATCH_CADENCE_SAMPLES:]
+            book_state['update_gaps'] = gaps
+            interval = sorted(gaps)[len(gaps) // 2] / 2
+        book_state['last_change'] = now
+    else:
+        interval *= WATCH_BACKOFF_FACTOR
+    interval = min(max(interval, WATCH_MIN_INTERVAL), WATCH_MAX_INTERVAL)
+    book_state['interval'] = interval
+    book_state['next_poll'] = now + interval
+
+def get_watched_chapter_urls(book_state, logger=None):
+    """
+    Returns the set of chapter URLs the last build of a watched book covers.
+
+    They are kept in book_state['known_urls'], since a split book's last volume and a
+    text-only build have no build manifest of the whole book. States written before that
+    fall back to the manifest of their 'epub_path'. If any recorded output is gone, the
+    state is reset and an empty set returned, so the book is rebuilt.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    output_paths = book_state.get('output_paths') or ([book_state['epub_path']] if book_state.get('epub_path') else [])
+    missing_paths = [path for path in output_paths if not os.path.exists(path)]
+    if missing_paths:
+        logger.warning(f"Watch: {missing_paths[0]} is gone; rebuilding.")
+    elif 'known_urls' in book_state:
+        return set(book_state['known_urls'])
+    elif book_state.get('epub_path'):
+        try:
+            return {chapter['url'] for chapter in load_build_manifest(book_state['epub_path'])['chapters']}
+        except FileNotFoundError:
+            logger.warning(f"Watch: build manifest for {book_state['epub_path']} is gone; rebuilding.")
+    for key in ('known_urls', 'output_paths', 'epub_path'):
+        book_state.pop(key, None)
+    return set()
+
+def poll_watched_book(book, book_state, build_queue, state_lock=None, logger=None):
+    """
+    Polls one library book and enqueues a build if it has new chapters (or has never been built).
+
+    The poll works on a copy of book_state and merges it back under state_lock, so builder
+    threads can save the watch state while the chapter list is being fetched.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    state_lock = state_lock or threading.Lock()
+    with state_lock:
+        poll_state = dict(book_state)
+    now = time.time()
+    poll_state['last_poll'] = now
+    new_chapter_count = 0
+    site_config = get_site_config(book['url'], logger=logger)
+    if not site_config:
+        logger.error(f"Watch: unsupported website URL: {book['url']}")
+        poll_state['next_poll'] = now + WATCH_MAX_INTERVAL
+        chapter_links = None
+    else:
+        try:
+            chapter_links = poll_chapter_list(normalize_book_url(book['url'], site_config), site_config, poll_state, logger=logger)
+        except Exception as e:
+            logger.warning(f"Watch: polling {book['url']} failed: {e}")
+            poll_state['next_poll'] = now + poll_state.get('interval', WATCH_DEFAULT_INTERVAL)
+            site_config = None
+            chapter_links = None
+
+    if chapter_links is not None:
+        chapter_links = filter_chapters_by_range(chapter_links, book.get('start', 1) or 1, book.get('end'), logger=logger)
+        known_urls = get_watched_chapter_urls(poll_state, logger=logger)
+        new_chapter_count = sum(1 for chapter in chapter_links if chapter['url'] not in known_urls)
+    if site_config:
+        # The first build of a book says nothing about its update cadence
+        built = bool(poll_state.get('known_urls') or poll_state.get('epub_path'))
+        update_watch_interval(poll_state, new_chapter_count > 0 and built, now)
+        logger.info(f"Watch: next poll of {book['url']} in {poll_state['interval'] / 60:.0f} min.")
+
+    with state_lock:
+        poll_state.pop('queued', None) # Only ever set below, under the lock
+        book_state.update(poll_state)
+        if new_chapter_count and not book_state.get('queued'):
+            logger.info(f"Watch: {new_chapter_count} new chapter(s) for {book['url']}. Enqueuing build.")
+            book_state['queued'] = True
+            build_queue.put(book)
+
+def run_watch(library_path, state_path=None, workers=1, once=False, logger=None):
+    """
+    Long-running watcher over a library manifest (same format as --batch).
+
+    Each due book has only its chapter list polled; books with new chapters are
+    enqueued for a pool of builder threads, which append them to the book's previous
+    EPUB (a split book's last volume) when they only extend it and rebuild it otherwise;
+    text-only books are rebuilt. The library file is re-read every cycle, so books can be
+    added without a restart. Per-book validators, the chapter URLs and output paths of the
+    last build and polling intervals are kept in a JSON state file. With once=True a
+    single polling pass is made and the call returns after its builds finish.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    _, library_output_dir = load_batch_manifest(library_path)
+    state_path = state_path or os.path.join(library_output_dir or OUTPUT_DIR, 'watch_state.json')
+    state = load_watch_state(state_path)
+    for book_state in state.values():
+        book_state.pop('queued', None) # Builds queued by a previous process are gone
+    state_lock = threading.Lock()
+    build_queue = queue.Queue()
+
+    def builder():
+        while True:
+            book = build_queue.get()
+            if book is None:
+                build_queue.task_done()
+                return
+            try:
+                output_dir = book.get('output_dir') or library_output_dir
+                with state_lock:
+                    # The EPUB (a split book's last volume) that new chapters are appended to; text-only books are rebuilt
+                    previous_epub_path = state.get(book['url'], {}).get('epub_path')
+                # Same per-book options as run_batch, since the library is a batch manifest
+                result = build_book(book['url'], book.get('start', 1) or 1, book.get('end'), output_dir, book.get('output'),
+                                    logger=logging.getLogger("watch.build"), append_to=previous_epub_path, profile=book.get('profile'),
+                                    volumes=book.get('volumes'), compression=book.get('compression'), formats=book.get('format'))
+                last_build = {key: result[key] for key in ('status', 'chapters', 'missing_chapters', 'appended_chapters', 'elapsed_seconds', 'error')}
+            except Exception as e:
+                logger.exception(f"Watch: building {book['url']} failed:")
+                result = {'status': 'failed'}
+                last_build = {'status': 'failed', 'error': str(e)}
+            try:
+                with state_lock:
+                    book_state = state.setdefault(book['url'], {})
+                    book_state.pop('queued', None)
+                    if result['status'] != 'failed':
+                        # Every output of the build, so polls can tell new chapters from ones in earlier volumes
+                        known_urls = result['chapter_urls']
+                        output_paths = result.get('volume_paths', [result['epub_path']] if result['epub_path'] else []) + result['txt_paths']
+                        if result['epub_path'] and result['epub_path'] == previous_epub_path and 'volume_paths' not in result:
+                            # Appended (or rebuilt in place): a last volume's manifest lacks the earlier volumes, which are still there
+                            known_urls = list(dict.fromkeys(book_state.get('known_urls', []) + known_urls))
+                            output_paths = list(dict.fromkeys(book_state.get('output_paths', []) + output_paths))
+                        book_state['known_urls'] = known_urls
+                        book_state['output_paths'] = output_paths
+                        book_state['epub_path'] = result['epub_path']
+                    book_state['last_build'] = last_build
+                    save_watch_state(state_path, state)
+            except Exception:
+                logger.exception(f"Watch: saving the watch state after building {book['url']} failed:")
+            finally:
+                build_queue.task_done() # Always, or build_queue.join() would wait forever
+
+    builders = [threading.Thread(target=builder, name=f"watch-builder-{n}", daemon=True) for n in range(max(1, workers))]
+    for thread in builders: thread.start()
+    logger.info(f"Watching library {library_path} (state: {state_path}).")
+
+    try:
+        while True:
+            books, _ = load_batch_manifest(library_path)
+            for book in books:
+                with state_lock:
+                    book_state = state.setdefault(book['url'], {})
+                    if book_state.get('queued') or book_state.get('next_poll', 0) > time.time():
+                        continue
+                poll_watched_book(book, book_state, build_queue, state_lock=state_lock, logger=logger)
+                with state_lock:
+                    save_watch_state(state_path, state)
+            if once:
+                break
+            with state_lock:
+                next_due = min((state.get(book['url'], {}).get('next_poll', 0) for book in books), default=time.time() + WATCH_MIN_INTERVAL)
+            time.sleep(min(max(next_due - time.time(), 1), WATCH_MIN_INTERVAL)) # Wake regularly to pick up library edits
+    finally:
+        with state_lock:
+            save_watch_state(state_path, state)
+    build_queue.join()
+    for _ in builders: build_queue.put(None)
+    return state
+
+# --- Distributed crawling: coordinator splits chapters into shards, workers fetch them ---
+class SqliteShardBroker:
+    """
+    Shard queue stored in a SQLite file.
+
+    Workers on the same machine (or on a shared filesystem) can use the file directly;
+    remote workers talk to it through the coordinator's HTTP broker endpoint (see
+    BrokerRequestHandler and HttpShardBroker), which exposes the same lease/complete calls.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Let workers read/write while the coordinator polls
+            conn.execute("""CREATE TABLE IF NOT EXISTS shards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                shard_index INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                leased_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS shards_status ON shards (status, leased_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call keeps the broker usable from the HTTP server's threads;
+        # the block runs as one transaction and the connection is closed after it
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def create_job(self, job_id, book_url, chapter_links, shard_size=DISTRIBUTED_SHARD_SIZE):
+        """Splits chapter_links into shards for job_id. Returns the number of shards."""
+        indexed_links = [{'index': i, 'title': chapter['title'], 'url': chapter['url']} for i, chapter in enumerate(chapter_links)]
+        shards = [indexed_links[i:i + shard_size] for i in range(0, len(indexed_links), shard_size)]
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO shards (job_id, shard_index, payload) VALUES (?, ?, ?)",
+                             [(job_id, n, json.dumps({'book_url': book_url, 'chapters': shard}, ensure_ascii=False)) for n, shard in enumerate(shards)])
+        return len(shards)
+
+    def lease(self, worker_id, lease_timeout=DISTRIBUTED_LEASE_TIMEOUT, max_attempts=DISTRIBUTED_MAX_ATTEMPTS):
+        """
+        Leases the next pending (or abandoned) shard to worker_id. Returns a shard dict or
+        None. Shards already leased max_attempts times are not handed out again.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE") # Serialise leases across processes
+            row = conn.execute("SELECT id, job_id, payload FROM shards WHERE status = 'pending' "
+                               "OR (status = 'leased' AND leased_at < ? AND attempts < ?) ORDER BY id LIMIT 1",
+                               (time.time() - lease_timeout, max_attempts)).fetchone()
+            if row:
+                conn.execute("UPDATE shards SET status = 'leased', worker = ?, leased_at = ?, attempts = attempts + 1 WHERE id = ?",
+                             (worker_id, time.time(), row[0]))
+        if not row:
+            return None
+        return dict(json.loads(row[2]), shard_id=row[0], job_id=row[1])
+
+    def complete(self, shard_id, worker_id, result):
+        """
+        Stores a worker's result for a shard. Results from a worker whose lease was taken
+        over are ignored. Raises ValueError if the result reports a chapter twice or one
+        that is not in the shard (chapters it leaves out count as failed, see job_results).
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload FROM shards WHERE id = ?", (shard_id,)).fetchone()
+            if not row:
+                return False
+            shard_indexes = {chapter['index'] for chapter in json.loads(row[0])['chapters']}
+            result_indexes = [chapter['index'] for chapter in result['chapters']] + [failure['index'] for failure in result['failed']]
+            if len(set(result_indexes)) != len(result_indexes) or not shard_indexes.issuperset(result_indexes):
+                raise ValueError(f"result for shard {shard_id} reports chapters that are not in it")
+            updated = conn.execute("UPDATE shards SET status = 'done', result = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                                   (json.dumps(result, ensure_ascii=False), shard_id, worker_id)).rowcount
+        return updated == 1
+
+    def job_progress(self, job_id):
+        """Returns (done_shards, total_shards) for a job."""
+        with self._connect() as conn:
+            done, total = conn.execute("SELECT SUM(status = 'done'), COUNT(*) FROM shards WHERE job_id = ?", (job_id,)).fetchone()
+        return done or 0, total
+
+    def job_activity(self, job_id, lease_timeout=DISTRIBUTED_LEASE_TIMEOUT, max_attempts=DISTRIBUTED_MAX_ATTEMPTS):
+        """
+        Returns (done_shards, given_up_shards, total_shards, last_leased_at) for a job. Given
+        up are shards whose last of max_attempts leases expired without a result.
+        """
+        with self._connect() as conn:
+            done, given_up, total, last_leased_at = conn.execute(
+                "SELECT SUM(status = 'done'), SUM(status = 'leased' AND attempts >= ? AND leased_at < ?), COUNT(*), MAX(leased_at) "
+                "FROM shards WHERE job_id = ?", (max_attempts, time.time() - lease_timeout, job_id)).fetchone()
+        return done or 0, given_up or 0, total, last_leased_at
+
+    def close_job(self, job_id):
+        """Marks every unfinished shard of a job as failed, so late results from workers are ignored."""
+        with self._connect() as conn:
+            conn.execute("UPDATE shards SET status = 'failed' WHERE job_id = ? AND status != 'done'", (job_id,))
+
+    def job_results(self, job_id):
+        """
+        Returns the stored results of every shard of a job, in shard order. Chapters of a
+        shard that its result does not report (all of them for an unfinished shard) are
+        added to its 'failed' list with reason 'distributed_unfinished'.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT payload, result FROM shards WHERE job_id = ? ORDER BY shard_index", (job_id,)).fetchall()
+        results = []
+        for payload, result in rows:
+            result = json.loads(result) if result else {'chapters': [], 'failed': []}
+            reported = {chapter['index'] for chapter in result['chapters']} | {failure['index'] for failure in result['failed']}
+            result['failed'] += [dict(chapter, reason='distributed_unfinished') for chapter in json.loads(payload)['chapters']
+                                 if chapter['index'] not in reported]
+            results.append(result)
+        return results
+
+class HttpShardBroker:
+    """
+    Client for a coordinator's HTTP broker endpoint; offers the worker side of
+    SqliteShardBroker. token is the endpoint's shared secret (see serve_broker).
+    """
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+
+    def _post(self, path, payload):
+        headers = {DISTRIBUTED_TOKEN_HEADER: self.token} if self.token else {}
+        response = HTTP_SESSION.post(self.base_url + path, json=payload, headers=headers, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker_id, lease_timeout=DISTRIBUTED_LEASE_TIMEOUT):
+        return self._post('/lease', {'worker': worker_id}).get('shard')
+
+    def complete(self, shard_id, worker_id, result):
+        return self._post('/complete', {'shard_id': shard_id, 'worker': worker_id, 'result': result}).get('accepted', False)
+
+class BrokerRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves a SqliteShardBroker's lease/complete calls to remote workers as JSON over HTTP.
+    Every call must carry the shared token in the DISTRIBUTED_TOKEN_HEADER header, since
+    completed shards go straight into the book.
+    """
+
+    broker = None # Set on the subclass created by serve_broker
+    token = None
+
+    def do_POST(self):
+        provided_token = self.headers.get(DISTRIBUTED_TOKEN_HEADER, '')
+        if not self.token or not hmac.compare_digest(provided_token.encode('utf-8'), self.token.encode('utf-8')):
+            self.send_error(403, "Missing or wrong broker token.")
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/lease':
+                response = {'shard': self.broker.lease(payload['worker'])}
+            elif self.path == '/complete':
+                response = {'accepted': self.broker.complete(payload['shard_id'], payload['worker'], payload['result'])}
             else:
-                logger.warning(f"Could not find content div for chapter: {chapter_info['title']} at {chapter_info['url']} using selectors {content_selectors}")
+                self.send_error(404, "Unknown broker call.")
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, f"Bad broker request: {e}")
+            return
+        body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger("broker").debug(format % args)
+
+def serve_broker(broker, port, token, host=DISTRIBUTED_BROKER_HOST):
+    """
+    Starts an HTTP endpoint for broker on host:port in a daemon thread. Workers must send
+    token (see BrokerRequestHandler). Returns the server.
+    """
+    if not token:
+        raise ValueError("The broker endpoint needs a token.")
+    handler = type('BoundBrokerRequestHandler', (BrokerRequestHandler,), {'broker': broker, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="broker-http", daemon=True).start()
+    return server
+
+def open_broker(broker_spec, token=None):
+    """Opens a broker from a spec: an http(s):// coordinator URL (called with token), or a path to a SQLite file."""
+    if broker_spec.startswith(('http://', 'https://')):
+        return HttpShardBroker(broker_spec, token=token)
+    return SqliteShardBroker(broker_spec)
+
+def make_distributed_fetcher(broker, book_url, shard_size=DISTRIBUTED_SHARD_SIZE):
+    """
+    Returns a chapter_fetcher for build_book that queues the chapters as shards on the
+    broker, waits for workers to finish them and reassembles the results in order.
+
+    The wait ends when every shard is done or given up (DISTRIBUTED_MAX_ATTEMPTS), or when
+    no shard was leased or finished for DISTRIBUTED_STALL_TIMEOUTS lease timeouts (e.g. no
+    worker is running). The chapters of unfinished shards are then reported as failed
+    chapters, so the build ends up partial and --repair can fetch them later.
+    """
+    def fetch_distributed(chapter_links, site_config, logger=None, failed_chapters=None, on_chapter=None):
+        if logger is None: logger = logging.getLogger() # Use default logger if none provided
+        job_id = hashlib.sha1(f"{book_url}|{time.time()}".encode('utf-8')).hexdigest()[:16]
+        shard_count = broker.create_job(job_id, book_url, chapter_links, shard_size)
+        logger.info(f"Coordinator: job {job_id} queued {len(chapter_links)} chapters as {shard_count} shard(s). Waiting for workers...")
+        stall_timeout = DISTRIBUTED_STALL_TIMEOUTS * DISTRIBUTED_LEASE_TIMEOUT
+        last_activity = None
+        last_change = time.time()
+        while True:
+            done, given_up, total, last_leased_at = broker.job_activity(job_id)
+            if (done, last_leased_at) != last_activity:
+                if last_activity is None or done != last_activity[0]:
+                    logger.info(f"Coordinator: {done}/{total} shard(s) done.")
+                last_activity = (done, last_leased_at)
+                last_change = time.time()
+            if done + given_up == total:
+                if given_up:
+                    logger.error(f"Coordinator: {given_up} shard(s) failed {DISTRIBUTED_MAX_ATTEMPTS} times; giving their chapters up.")
+                break
+            if time.time() - last_change > stall_timeout:
+                logger.error(f"Coordinator: no shard was leased or finished for {stall_timeout:.0f}s; "
+                             f"giving up the chapters of {total - done} unfinished shard(s). Is a worker running?")
+                break
+            time.sleep(DISTRIBUTED_POLL_INTERVAL)
+        broker.close_job(job_id)
+
+        results = ChapterSpool(on_put=on_chapter)
+        for shard_result in broker.job_results(job_id):
+            for chapter in shard_result['chapters']:
+                results.put(chapter['index'], Chapter(chapter['title'], content_html=chapter['content_html']))
+            if failed_chapters is not None:
+                failed_chapters.extend(shard_result['failed'])
+        if failed_chapters:
+            failed_chapters.sort(key=lambda failure: failure['index'])
+        return results
+    return fetch_distributed
+
+def run_worker(broker_spec, once=False, logger=None, token=None):
+    """
+    Worker loop: leases shards from the broker, fetches and cleans their chapters and
+    posts the results back. With once=True the worker exits when the queue is empty.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    broker = open_broker(broker_spec, token=token)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"Worker {worker_id} using broker {broker_spec}.")
+    while True:
+        shard = broker.lease(worker_id)
+        if not shard:
+            if once:
+                logger.info("Worker: queue is empty, exiting.")
+                return
+            time.sleep(DISTRIBUTED_POLL_INTERVAL)
+            continue
+
+        site_config = get_site_config(shard['book_url'], logger=logger)
+        chapters = shard['chapters']
+        logger.info(f"Worker: shard {shard['shard_id']} of job {shard['job_id']} ({len(chapters)} chapters).")
+        results = [None] * len(chapters)
+        failed = []
+        if site_config:
+            with fetch_chapters_content(chapters, site_config, logger=logger, failed_chapters=failed) as content:
+                failed_positions = {failure['index'] for failure in failed}
+                content_iter = iter(content)
+                for position in range(len(chapters)):
+                    if position not in failed_positions:
+                        results[position] = next(content_iter)
         else:
-            logger.warning(f"Skipping chapter due to fetch error: {chapter_info['title']}")
-    return chapters_content_data
+            failed = [{'index': position, 'title': chapter['title'], 'url': chapter['url'], 'reason': 'unsupported_site'}
+                      for position, chapter in enumerate(chapters)]
+
+        # Shard-local positions are mapped back to the chapter's index in the whole book
+        shard_result = {
+            'chapters': [{'index': chapters[position]['index'], 'title': chapter['title'], 'content_html': chapter['content_html']}
+                         for position, chapter in enumerate(results) if chapter],
+            'failed': [dict(failure, index=chapters[failure['index']]['index']) for failure in failed],
+        }
+        if not broker.complete(shard['shard_id'], worker_id, shard_result):
+            logger.warning(f"Worker: shard {shard['shard_id']} was reassigned before it finished; result discarded.")
+
+# --- Build manifest and repair of EPUBs with missing chapters ---
+def get_build_manifest_path(epub_path):
+    """Returns the path of the build manifest sidecar for an EPUB file."""
+    return os.path.splitext(epub_path)[0] + BUILD_MANIFEST_SUFFIX
+
+def write_build_manifest(epub_path, source_url, metadata_url, title, author, description, cover_url, chapter_links, failed_chapters, logger=None, volume=None,
+                         compression=None):
+    """
+    Writes the build manifest next to an EPUB.
+
+    The manifest lists every chapter that was requested, in order, with status 'ok' if it
+    is in the EPUB or 'missing' (plus the failure reason) if it is not. The 'ok' entries
+    correspond one-to-one, in order, to the chap_NNNN.xhtml documents in the EPUB. For one
+    volume of a split book, volume ('number', 'count', 'title') is recorded as well. The
+    COMPRESSION_PROFILES profile of the EPUB is kept so repairs and appends reuse it.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    failed_by_index = {failure['index']: failure for failure in failed_chapters}
+    chapters = []
+    for i, chapter_info in enumerate(chapter_links):
+        entry = {'title': chapter_info['title'], 'url': chapter_info['url'], 'status': 'ok'}
+        if i in failed_by_index:
+            entry['status'] = 'missing'
+            entry['reason'] = failed_by_index[i]['reason']
+        chapters.append(entry)
+
+    manifest = {
+        'source_url': source_url,
+        'metadata_url': metadata_url,
+        'title': title,
+        'author': author,
+        'description': description,
+        'cover_url': cover_url,
+        'epub_filename': os.path.basename(epub_path),
+        'compression': compression or DEFAULT_COMPRESSION_PROFILE,
+        'chapters': chapters,
+    }
+    if volume:
+        manifest['volume'] = {key: volume[key] for key in ('number', 'count', 'title')}
+    manifest_path = get_build_manifest_path(epub_path)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    logger.info(f"Build manifest written: {manifest_path}")
+    return manifest_path
+
+def load_build_manifest(epub_path):
+    """
+    Loads the build manifest for an EPUB, with its 'chapters' as Chapter records. Raises
+    FileNotFoundError if there is none.
+    """
+    with open(get_build_manifest_path(epub_path), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['chapters'] = [Chapter(chapter['title'], chapter['url'], status=chapter['status'], reason=chapter.get('reason'))
+                            for chapter in manifest['chapters']]
+    return manifest
+
+def read_epub_chapters(epub_path):
+    """Reads chapters back from an EPUB produced by create_epub as Chapters with 'title' and 'content_html'."""
+    book = epub.read_epub(epub_path)
+    chapter_items = [item for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
+                     if re.match(r'chap_\d+\.xhtml$', os.path.basename(item.file_name))]
+    chapter_items.sort(key=lambda item: os.path.basename(item.file_name))
+
+    chapters = []
+    for item in chapter_items:
+        soup = BeautifulSoup(item.get_content(), 'html.parser')
+        body = soup.body or soup
+        heading = body.find('h1')
+        chapter_title = heading.get_text().strip() if heading else item.title
+        if heading:
+            heading.decompose()
+        chapters.append(Chapter(chapter_title, content_html=body.decode_contents().strip()))
+    return chapters
+
+def read_epub_cover(epub_path):
+    """Returns the cover image of an EPUB as (content, mimetype), as create_epub takes it, or None if it has none."""
+    with zipfile.ZipFile(epub_path) as archive:
+        container = etree.fromstring(archive.read('META-INF/container.xml'))
+        opf_name = container.find('.//{urn:oasis:names:tc:opendocument:xmlns:container}rootfile').get('full-path')
+        opf = etree.fromstring(archive.read(opf_name))
+        cover_item = opf.find(f".//{{{EPUB_OPF_NS}}}item[@properties='cover-image']")
+        if cover_item is None:
+            return None
+        cover_name = posixpath.join(posixpath.dirname(opf_name), urllib.parse.unquote(cover_item.get('href')))
+        return archive.read(cover_name), cover_item.get('media-type')
+
+def repair_epub(epub_path, logger=None):
+    """
+    Re-fetches only the chapters recorded as missing in an EPUB's build manifest and
+    splices them into the book at their original positions. The book is rewritten with
+    its recorded compression profile and the cover already inside it. Returns True if
+    the EPUB is complete afterwards.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    try:
+        manifest = load_build_manifest(epub_path)
+    except FileNotFoundError:
+        logger.error(f"No build manifest found for {epub_path} (expected {get_build_manifest_path(epub_path)}). Cannot repair.")
+        return False
+
+    manifest_chapters = manifest['chapters']
+    missing_indexes = [i for i, chapter in enumerate(manifest_chapters) if chapter['status'] == 'missing']
+    if not missing_indexes:
+        logger.info(f"No missing chapters recorded for {epub_path}. Nothing to repair.")
+        return True
+
+    site_config = get_site_config(manifest['source_url'], logger=logger)
+    if not site_config:
+        logger.error(f"Unsupported website URL in build manifest: {manifest['source_url']}")
+        return False
+
+    existing_chapters = read_epub_chapters(epub_path)
+    ok_count = len(manifest_chapters) - len(missing_indexes)
+    if len(existing_chapters) != ok_count:
+        logger.error(f"EPUB has {len(existing_chapters)} chapters but the build manifest lists {ok_count}. Refusing to splice.")
+        return False
+
+    merged_chapters = [None] * len(manifest_chapters)
+    existing_iter = iter(existing_chapters)
+    for i, chapter in enumerate(manifest_chapters):
+        if chapter['status'] == 'ok':
+            merged_chapters[i] = next(existing_iter)
+
+    logger.info(f"Repairing {epub_path}: re-fetching {len(missing_indexes)} missing chapter(s)...")
+    missing_links = [Chapter(manifest_chapters[i]['title'], manifest_chapters[i]['url']) for i in missing_indexes]
+    still_failed = []
+    search_indexer = start_search_indexing(manifest['source_url'], manifest['title'], manifest['author'], missing_links,
+                                           positions=missing_indexes, logger=logger)
+    try:
+        fetched = fetch_chapters_content(missing_links, site_config, logger=logger, failed_chapters=still_failed,
+                                         on_chapter=search_indexer.add if search_indexer else None)
+    finally:
+        if search_indexer: search_indexer.close() # Indexes the last batch, also if fetching failed
+    with fetched:
+        fetched_chapters = iter(fetched)
+        still_failed_positions = {failure['index'] for failure in still_failed}
+        for position, manifest_index in enumerate(missing_indexes):
+            if position not in still_failed_positions:
+                merged_chapters[manifest_index] = next(fetched_chapters)
+
+    if len(still_failed) == len(missing_indexes):
+        logger.error("Could not fetch any of the missing chapters. EPUB left unchanged.")
+        return False
+
+    cover_image = read_epub_cover(epub_path) # No second download of a cover the book already has
+    output_path = create_epub(manifest['title'], manifest['author'], manifest['description'],
+                              [chapter for chapter in merged_chapters if chapter],
+                              manifest['metadata_url'], manifest['cover_url'] if cover_image else None, os.path.dirname(epub_path) or '.',
+                              output_filename=os.path.basename(epub_path), logger=logger, volume=manifest.get('volume'),
+                              cover_image=cover_image, compression=manifest.get('compression'))
+    # Indexes in still_failed refer to missing_links; map them back to manifest positions
+    remaining_failures = [dict(failure, index=missing_indexes[failure['index']]) for failure in still_failed]
+    write_build_manifest(output_path, manifest['source_url'], manifest['metadata_url'], manifest['title'], manifest['author'],
+                         manifest['description'], manifest['cover_url'], manifest_chapters, remaining_failures, logger=logger,
+                         volume=manifest.get('volume'), compression=manifest.get('compression'))
+    if remaining_failures:
+        logger.warning(f"{len(remaining_failures)} chapter(s) are still missing from {output_path}.")
+        return False
+    logger.info(f"All missing chapters spliced into {output_path}.")
+    return True
+
+# --- Appending chapters to an existing EPUB ---
+EPUB_OPF_NS = 'http://www.idpf.org/2007/opf'
+EPUB_NCX_NS = 'http://www.daisy.org/z3986/2005/ncx/'
+EPUB_XHTML_NS = 'http://www.w3.org/1999/xhtml'
+EPUB_OPS_NS = 'http://www.idpf.org/2007/ops'
+
+def copy_zip_member_raw(source, target, info):
+    """
+    Copies one member from the ZipFile source to the ZipFile target (opened for writing)
+    without decompressing or recompressing it: the local header is rewritten for the new
+    offset and the compressed bytes are copied verbatim. Without RAW_ZIP_MEMBERS the member
+    is read and rewritten through the public ZipFile API (same name, date and compression).
+    """
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~0x08 # Sizes are known up front, so no data descriptor follows
+    if RAW_ZIP_MEMBERS:
+        _write_raw_zip_member(target, new_info, _read_raw_zip_member(source, info))
+    else:
+        target.writestr(new_info, source.read(info), compress_type=info.compress_type)
+
+def get_appended_chapter_links(manifest_chapters, chapter_links):
+    """
+    Returns the chapters of chapter_links that come after the last chapter of a previous
+    build (its build manifest chapter entries), or None if the book cannot simply be
+    appended to because chapters were removed, reordered or inserted in the middle.
+    """
+    positions = {chapter['url']: i for i, chapter in enumerate(chapter_links)}
+    known_positions = [positions.get(chapter['url']) for chapter in manifest_chapters]
+    if not known_positions or None in known_positions or known_positions != sorted(known_positions):
+        return None
+    first, last = known_positions[0], known_positions[-1]
+    if last - first + 1 != len(known_positions): # Something was inserted between known chapters
+        return None
+    return chapter_links[last + 1:]
+
+@METRICS.timed('append_epub')
+def append_chapters_to_epub(epub_path, chapters_data, logger=None, compression=None):
+    """
+    Appends chapters to an EPUB produced by create_epub, in place.
+
+    Existing members are copied verbatim with copy_zip_member_raw, so nothing already in
+    the book is decompressed or recompressed; only the new chap_NNNN.xhtml documents are
+    compressed, and the OPF, NCX and nav documents are regenerated to list them. The new
+    archive is written next to the old one and swapped in atomically. New members are
+    deflated with the given COMPRESSION_PROFILES profile. Returns epub_path.
+    """
+    if logger is None: logger = logging.getLogger() # Use default logger if none provided
+    compression_level = get_compression_level(compression)
+    with zipfile.ZipFile(epub_path) as source:
+        container = etree.fromstring(source.read('META-INF/container.xml'))
+        opf_name = container.find('.//{urn:oasis:names:tc:opendocument:xmlns:container}rootfile').get('full-path')
+        folder = os.path.dirname(opf_name)
+        parser = etree.XMLParser(remove_blank_text=True)
+        opf = etree.fromstring(source.read(opf_name), parser)
+        manifest = opf.find(f'{{{EPUB_OPF_NS}}}manifest')
+        spine = opf.find(f'{{{EPUB_OPF_NS}}}spine')
+        ncx_name = nav_name = None
+        for item in manifest:
+            if item.get('media-type') == 'application/x-dtbncx+xml':
+                ncx_name = posixpath.join(folder, item.get('href'))
+            elif 'nav' in (item.get('properties') or '').split():
+                nav_name = posixpath.join(folder, item.get('href'))
+        ncx = etree.parse(io.BytesIO(source.read(ncx_name)), parser)
+        nav = etree.parse(io.BytesIO(source.read(nav_name)), parser)
+
+        chapter_names = [info.filename for info in source.infolist() if re.match(r'chap_\d+\.xhtml$', posixpath.basename(info.filename))]
+        first_number = max((int(re.search(r'(\d+)', posixpath.basename(name)).group(1)) for name in chapter_names), default=0) + 1
+        book = epub.EpubBook() # Only provides the document template for rendering
+        new_members = []
+        for number, chapter_info in enumerate(chapters_data, start=first_number):
+            epub_chapter = make_epub_chapter(number, chapter_info['title'], chapter_info['content_html'])
+            book.add_item(epub_chapter)
+            new_members.append((posixpath.join(folder, epub_chapter.file_name), epub_chapter.get_content()))
+
+            item_id = f'chapter_{number}'
+            etree.SubElement(manifest, f'{{{EPUB_OPF_NS}}}item', {'href': epub_chapter.file_name, 'id': item_id, 'media-type': 'application/xhtml+xml'})
+            etree.SubElement(spine, f'{{{EPUB_OPF_NS}}}itemref', {'idref': item_id})
+
+            nav_point = etree.SubElement(ncx.find(f'{{{EPUB_NCX_NS}}}navMap'), f'{{{EPUB_NCX_NS}}}navPoint', {'id': f'chap_{number:04d}'})
+            etree.SubElement(etree.SubElement(nav_point, f'{{{EPUB_NCX_NS}}}navLabel'), f'{{{EPUB_NCX_NS}}}text').text = chapter_info['title']
+            etree.SubElement(nav_point, f'{{{EPUB_NCX_NS}}}content', {'src': epub_chapter.file_name})
+
+            toc_list = nav.find(f'.//{{{EPUB_XHTML_NS}}}nav[@{{{EPUB_OPS_NS}}}type="toc"]/{{{EPUB_XHTML_NS}}}ol')
+            link = etree.SubElement(etree.SubElement(toc_list, f'{{{EPUB_XHTML_NS}}}li'), f'{{{EPUB_XHTML_NS}}}a', {'href': epub_chapter.file_name})
+            link.text = chapter_info['title']
+
+        modified = opf.find(f'{{{EPUB_OPF_NS}}}metadata/{{{EPUB_OPF_NS}}}meta[@property="dcterms:modified"]')
+        if modified is not None:
+            modified.text = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        regenerated = {
+            opf_name: etree.tostring(opf, pretty_print=True, encoding='utf-8', xml_declaration=True),
+            ncx_name: etree.tostring(ncx, pretty_print=True, encoding='utf-8', xml_declaration=True),
+            nav_name: etree.tostring(nav, pretty_print=True, encoding='utf-8', xml_declaration=True),
+        }
+
+        # Keep create_epub's member order: new chapters go right after the existing ones
+        last_chapter_name = chapter_names[-1] if chapter_names else opf_name
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.epub', dir=os.path.dirname(os.path.abspath(epub_path)))
+        os.close(temp_fd)
+        try:
+            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compression_level) as target:
+                for info in source.infolist():
+                    if info.filename in regenerated:
+                        target.writestr(info.filename, regenerated[info.filename])
+                    else:
+                        copy_zip_member_raw(source, target, info)
+                    if info.filename == last_chapter_name:
+                        for name, content in new_members:
+                            target.writestr(name, content)
+            os.replace(temp_path, epub_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+    METRICS.observe('epub_size', os.path.getsize(epub_path), buckets=METRICS_SIZE_BUCKETS, unit='bytes', compression=compression or DEFAULT_COMPRESSION_PROFILE)
+    logger.info(f"Appended {len(new_members)} chapter(s) to {epub_path} (chapters {first_number}-{first_number + len(new_members) - 1}).")
+    return epub_path
 
 # --- Local Development Server ---
 
@@ -1147,12 +3774,79 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
         # Route EPUB generation requests
         if path == '/generate-epub':
             self.handle_epub_request(query)
+        elif path == '/metrics':
+            self.handle_metrics_request()
+        elif path == '/metrics.json':
+            self.handle_metrics_json_request()
+        elif path == '/search':
+            self.handle_search_request(query)
         # Route static file requests (including root path for index.html)
         else:
             # Let SimpleHTTPRequestHandler handle serving files like index.html, style.css, script.js
             # It defaults to serving from the current working directory.
             super().do_GET()
 
+    def log_request(self, code='-', size='-'):
+        """Counts every response by route and status for /metrics, then logs it as usual."""
+        path = urllib.parse.urlparse(self.path).path
+        route = path if path in ('/generate-epub', '/metrics', '/metrics.json', '/search') else 'static'
+        METRICS.increment('http_requests', path=route, status=getattr(code, 'value', code))
+        super().log_request(code, size)
+
+    def handle_metrics_request(self):
+        """Serves all metrics of this server process in the Prometheus text format."""
+        body = METRICS.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_metrics_json_request(self):
+        """Serves the live timing histograms of this server process as JSON."""
+        body = json.dumps(METRICS.snapshot(), ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_search_request(self, query_string):
+        """
+        Handles /search?q=...: searches the full-text index (book=URL limits it to one book,
+        limit=N caps the hits) and returns the hits of SearchIndex.search as JSON.
+        """
+        logger = logging.getLogger()
+        params = urllib.parse.parse_qs(query_string)
+        query = params.get('q', [''])[0]
+        book_url = params.get('book', [None])[0] or None
+        try:
+            limit = int(params.get('limit', [SEARCH_RESULT_LIMIT])[0])
+            if limit < 1: raise ValueError
+        except (ValueError, TypeError):
+            self.send_error(400, "Error: 'limit' parameter must be a positive integer.")
+            return
+        if not query.strip():
+            self.send_error(400, "Error: 'q' parameter is required.")
+            return
+        index_path = SEARCH_INDEX_PATH or SEARCH_INDEX_DEFAULT_PATH
+        if not os.path.exists(index_path):
+            self.send_error(404, "Error: no search index yet (build books with --index first).")
+            logger.error(f"HTTP Server Error: search index {index_path} does not exist.")
+            return
+        try:
+            hits = SearchIndex(index_path).search(query, book_url=book_url, limit=limit)
+        except sqlite3.Error as e:
+            logger.exception("HTTP Server Error during search:")
+            self.send_error(500, "Error searching the index.")
+            return
+        body = json.dumps({'query': query, 'book': book_url, 'hits': hits}, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def handle_epub_request(self, query_string):
         """Handles the /generate-epub request."""
         # Use the main script's logger
@@ -1191,9 +3885,39 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
                 logger.error(f"HTTP Server Error: Invalid 'end' parameter: {end_chapter}")
                 return
 
-        logger.info(f"HTTP Server Params: url='{url}', start={start_chapter_num}, end={end_chapter_num}")
+        # Per-job profiling toggle: profile=cprofile|sample (profile=1 means cprofile)
+        profile = params.get('profile', [None])[0]
+        if profile in ('1', 'true'): profile = 'cprofile'
+        if profile in ('', '0', 'false'): profile = None
+        if profile and profile not in PROFILE_MODES:
+            self.send_error(400, f"Error: 'profile' must be one of: {', '.join(PROFILE_MODES)}.")
+            logger.error(f"HTTP Server Error: Invalid 'profile' parameter: {profile}")
+            return
+
+        # Compression profile: the server defaults to 'fast', since the reader is waiting for the download
+        compression = params.get('compression', [SERVER_COMPRESSION_PROFILE])[0] or SERVER_COMPRESSION_PROFILE
+        if compression not in COMPRESSION_PROFILES:
+            self.send_error(400, f"Error: 'compression' must be one of: {', '.join(COMPRESSION_PROFILES)}.")
+            logger.error(f"HTTP Server Error: Invalid 'compression' parameter: {compression}")
+            return
+
+        # Output format: one of OUTPUT_FORMATS (a single download, so no comma list)
+        output_format = params.get('format', ['epub'])[0] or 'epub'
+        if output_format not in OUTPUT_FORMATS:
+            self.send_error(400, f"Error: 'format' must be one of: {', '.join(OUTPUT_FORMATS)}.")
+            logger.error(f"HTTP Server Error: Invalid 'format' parameter: {output_format}")
+            return
+
+        logger.info(f"HTTP Server Params: url='{url}', start={start_chapter_num}, end={end_chapter_num}, profile={profile}, compression={compression}, format={output_format}")
 
         # --- Call Core Logic ---
+        job_started = time.time()
+        job_status = 'failed'
+        epub_filename = None
+        METRICS.add_gauge('epub_jobs_in_flight', 1)
+        profiler = BuildProfiler(profile) if profile else None
+        if profiler: profiler.start()
+        memory_checkpoint('start', logger=logger, report=False)
         try:
             site_config = get_site_config(url)
             if not site_config:
@@ -1203,6 +3927,7 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
             index_html, metadata_html, metadata_url, chapter_list_fetch_url = fetch_initial_pages(url, site_config)
             if not index_html or not metadata_html:
                  raise ConnectionError("Failed to fetch necessary pages.")
+            memory_checkpoint('fetch_initial_pages', logger=logger)
 
             book_title, book_author, book_description, cover_url = get_book_details(metadata_html, metadata_url, site_config)
             chapter_links = get_chapter_links(index_html, chapter_list_fetch_url or url, site_config)
@@ -1211,27 +3936,46 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
             chapter_links = filter_chapters_by_range(chapter_links, start_chapter_num, end_chapter_num)
             if not chapter_links:
                 raise ValueError("No chapters found for the specified range.")
+            memory_checkpoint('chapter_list', logger=logger)
 
-            # Fetch content
-            chapters_content_data = fetch_chapters_content(chapter_links, site_config)
-            if not chapters_content_data:
-                 raise ValueError("Failed to fetch content for any chapters.")
-
-            # Create EPUB in memory
-            epub_content, epub_filename = create_epub(
-                book_title, book_author, book_description, chapters_content_data,
-                metadata_url, cover_url, output_directory=None, return_bytes=True
-            )
+            # Fetch content (the spool file is removed once the book is built), and the cover meanwhile
+            cover_future = start_cover_download(cover_url) if output_format == 'epub' else None
+            search_indexer = start_search_indexing(normalize_book_url(url, site_config), book_title, book_author, chapter_links)
+            try:
+                chapters_content_data = fetch_chapters_content(chapter_links, site_config, on_chapter=search_indexer.add if search_indexer else None)
+            finally:
+                if search_indexer: search_indexer.close() # Indexes the last batch, also if fetching failed
+            with chapters_content_data:
+                if not chapters_content_data:
+                     raise ValueError("Failed to fetch content for any chapters.")
+                memory_checkpoint('fetch_chapters_content', logger=logger)
+
+                if output_format == 'epub':
+                    # Create EPUB in memory
+                    cover_image = cover_future.result()
+                    epub_content, epub_filename = create_epub(
+                        book_title, book_author, book_description, chapters_content_data,
+                        metadata_url, cover_url if cover_image else None, output_directory=None, return_bytes=True,
+                        cover_image=cover_image, compression=compression
+                    )
+                else:
+                    # Plain text: no cover and no EPUB packaging
+                    epub_content, epub_filename = create_txt(
+                        book_title, book_author, book_description, chapters_content_data, metadata_url, output_directory=None,
+                        split_chapters=(output_format == 'txt-chapters'), return_bytes=True
+                    )
+            memory_checkpoint('create_epub' if output_format == 'epub' else 'create_txt', logger=logger)
 
             # --- Send Response ---
             self.send_response(200)
-            self.send_header('Content-Type', 'application/epub+zip')
+            self.send_header('Content-Type', OUTPUT_CONTENT_TYPES[output_format])
 
             # Generate ASCII fallback filename (replace non-ASCII with '_')
             ascii_filename = ''.join(c if c.isascii() else '_' for c in epub_filename)
-            # Ensure it's not empty and ends with .epub
-            if not ascii_filename.strip('_'): ascii_filename = "book.epub"
-            if not ascii_filename.endswith('.epub'): ascii_filename = os.path.splitext(ascii_filename)[0] + ".epub"
+            # Ensure it's not empty and keeps the extension of the format (.epub, .txt or .zip)
+            extension = os.path.splitext(epub_filename)[1] or '.epub'
+            if not ascii_filename.strip('_'): ascii_filename = "book" + extension
+            if not ascii_filename.endswith(extension): ascii_filename = os.path.splitext(ascii_filename)[0] + extension
 
             # Encode the original filename using RFC 5987
             encoded_filename = urllib.parse.quote(epub_filename)
@@ -1243,7 +3987,8 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
             self.send_header('Content-Length', str(len(epub_content)))
             self.end_headers()
             self.wfile.write(epub_content)
-            logger.info(f"HTTP Server: Successfully sent EPUB: {epub_filename}")
+            logger.info(f"HTTP Server: Successfully sent {output_format}: {epub_filename}")
+            job_status = 'ok'
 
         except Exception as e:
             logger.exception("HTTP Server Error during EPUB generation:")
@@ -1261,6 +4006,14 @@ class EpubRequestHandler(SimpleHTTPRequestHandler):
                  # Fallback if sending the detailed error fails
                  logger.error(f"Failed to send detailed error response: {send_err}")
                  self.send_error(500, "Internal server error during EPUB generation.")
+        finally:
+            if profiler:
+                # The server keeps EPUBs in memory; profiles go to the default output directory
+                profiler.stop()
+                profile_base = os.path.join(OUTPUT_DIR, os.path.splitext(epub_filename)[0]) if epub_filename else get_profile_path_base(None, url)
+                profiler.save(f"{profile_base}.{int(job_started)}", logger=logger)
+            METRICS.add_gauge('epub_jobs_in_flight', -1)
+            METRICS.observe('epub_job', time.time() - job_started, site=get_url_host(url), status=job_status)
 
 
 def run_dev_server(port):
@@ -1269,7 +4022,7 @@ def run_dev_server(port):
     # os.makedirs(os.path.dirname(__file__) or '.', exist_ok=True) # Ensure current dir exists
 
     server_address = ('', port) # Listen on all interfaces
-    httpd = HTTPServer(server_address, EpubRequestHandler)
+    httpd = ThreadingHTTPServer(server_address, EpubRequestHandler) # Threaded so /metrics.json answers while a book is building
     print(f"Starting local development server...")
     print(f"Serving files from: {os.getcwd()}")
     print(f"Open http://localhost:{port}/ or http://127.0.0.1:{port}/ in your browser.")
@@ -1299,14 +4052,98 @@ if __name__ == "__main__":
     parser.add_argument('--fcgi', action='store_true', help='Run in FCGI mode') # FCGI argument
     parser.add_argument('--serve', action='store_true', help='Run a local development web server') # Add serve argument
     parser.add_argument('--port', type=int, default=8000, help='Port for the development server (default: 8000)') # Add port argument
+    parser.add_argument('--repair', metavar='EPUB_PATH', default=None, help='Re-fetch only the chapters missing from a previously built EPUB (uses its .build.json manifest) and splice them in')
+    parser.add_argument('--append', metavar='EPUB_PATH', default=None, help='Fetch only the chapters published since a previous build of this tool and append them to that EPUB without recompressing it (url defaults to the one in its .build.json manifest)')
+    parser.add_argument('--batch', metavar='MANIFEST', default=None, help='Build every book listed in a JSON manifest in one process (see load_batch_manifest)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help=f'Books built concurrently in --batch mode (default: {BATCH_WORKERS})')
+    parser.add_argument('--batch-summary', default=None, help='Path of the JSON summary written by --batch (default: <output-dir>/batch_summary.json)')
+    parser.add_argument('--watch', metavar='LIBRARY', default=None, help='Poll the books in a library manifest (same format as --batch) for new chapters and rebuild them')
+    parser.add_argument('--watch-state', default=None, help='Path of the JSON state file used by --watch (default: <output-dir>/watch_state.json)')
+    parser.add_argument('--once', action='store_true', help='With --watch, make a single polling pass and exit; with --worker, exit when the queue is empty')
+    parser.add_argument('--coordinator', action='store_true', help='Build the book at url by handing its chapters to --worker processes through --broker')
+    parser.add_argument('--worker', metavar='BROKER', default=None, help='Fetch chapter shards from a broker (SQLite file path or the coordinator\'s http://host:port)')
+    parser.add_argument('--broker', default='broker.sqlite3', help='SQLite file used by --coordinator as the shard queue (default: broker.sqlite3)')
+    parser.add_argument('--broker-port', type=int, default=None, help='With --coordinator, also serve the broker over HTTP on this port for remote workers')
+    parser.add_argument('--broker-host', default=DISTRIBUTED_BROKER_HOST, help=f'Interface the --broker-port endpoint binds to (default: {DISTRIBUTED_BROKER_HOST}; 0.0.0.0 for workers on other machines)')
+    parser.add_argument('--broker-token', default=os.environ.get(DISTRIBUTED_TOKEN_ENV), help=f'Shared secret of the --broker-port endpoint, required by it and sent by --worker (default: ${DISTRIBUTED_TOKEN_ENV}; the coordinator generates one if unset)')
+    parser.add_argument('--metrics-file', default=None, help=f'Where to write the JSON timing histograms at the end of a CLI, --batch, --repair or --coordinator run (default: <output-dir>/{METRICS_FILENAME})')
+    parser.add_argument('--profile', choices=sorted(PROFILE_MODES), default=None, help='Profile each book build with cProfile (pstats .prof) or a stack sampler (flamegraph-compatible .folded), written next to the EPUB')
+    parser.add_argument('--volumes', metavar='SPEC', default=None, help=f'Split the book into several EPUBs: chapters[:N] (default {VOLUME_DEFAULT_CHAPTERS} per volume), size[:MB] (default {VOLUME_DEFAULT_MB} MB of chapter text) or headings (the site\'s own volumes, where its chapter list marks them)')
+    parser.add_argument('--compression', choices=list(COMPRESSION_PROFILES), default=None, help=f'EPUB compression profile: fast (quickest writes), balanced or max (smallest files) (default: {DEFAULT_COMPRESSION_PROFILE})')
+    parser.add_argument('--spool-memory-mb', type=float, default=None, help=f'MB of cleaned chapter text held in memory per book before the rest is spooled to a scratch file (default: {CHAPTER_SPOOL_MEMORY_THRESHOLD // (1024 * 1024)})')
+    parser.add_argument('--spool-dir', default=None, help='Directory for chapter spool files (default: the system temp directory)')
+    parser.add_argument('--format', default=None, help=f"Output format(s), comma-separated: {', '.join(OUTPUT_FORMATS)} (default: epub). 'txt' writes the book as one UTF-8 text file, 'txt-chapters' one file per chapter")
+    parser.add_argument('--cover-size', default=None, help=f'Downscale covers to fit WIDTHxHEIGHT and recompress them as JPEG (needs Pillow), or "original" to keep them as served (default: {COVER_MAX_SIZE[0]}x{COVER_MAX_SIZE[1]})')
+    parser.add_argument('--cover-cache', default=None, help=f'Directory downloaded covers are cached in, or "off" (default: {COVER_CACHE_DIR})')
+    parser.add_argument('--index', nargs='?', const=SEARCH_INDEX_DEFAULT_PATH, default=None, metavar='PATH', help=f'Add the chapters of every book built to a SQLite full-text index as they are fetched (default path: {SEARCH_INDEX_DEFAULT_PATH}); also the index used by --search and the server\'s /search')
+    parser.add_argument('--search', metavar='QUERY', default=None, help='Search the full-text index for chapters containing every term of QUERY and print the hits')
+    parser.add_argument('--search-book', metavar='URL', default=None, help='With --search, only search the book with this URL')
+    parser.add_argument('--search-limit', type=int, default=SEARCH_RESULT_LIMIT, help=f'Maximum number of hits printed by --search (default: {SEARCH_RESULT_LIMIT})')
+    parser.add_argument('--trace-memory', action='store_true', help='Trace allocations with tracemalloc and log the top allocation sites after each pipeline stage')
+    parser.add_argument('--shard-size', type=int, default=DISTRIBUTED_SHARD_SIZE, help=f'Chapters per shard in --coordinator mode (default: {DISTRIBUTED_SHARD_SIZE})')
     args = parser.parse_args() # Parse arguments here
 
     # --- Validate Arguments Based on Mode ---
-    if not args.serve and not args.fcgi and args.url is None:
+    if args.append and args.url is None:
+        try:
+            args.url = load_build_manifest(args.append)['source_url']
+        except FileNotFoundError:
+            parser.error(f"no build manifest found for {args.append}; pass the book url to rebuild it")
+    if not args.serve and not args.fcgi and not args.repair and not args.batch and not args.watch and not args.worker and not args.search and args.url is None:
         parser.error("the following arguments are required in CLI mode: url")
 
+    if args.volumes:
+        try:
+            parse_volume_spec(args.volumes)
+        except ValueError as e:
+            parser.error(f"--volumes: {e}")
+    if args.format:
+        try:
+            parse_output_formats(args.format)
+        except ValueError as e:
+            parser.error(f"--format: {e}")
+    if args.spool_memory_mb is not None:
+        if args.spool_memory_mb < 0:
+            parser.error("--spool-memory-mb must not be negative")
+        CHAPTER_SPOOL_MEMORY_THRESHOLD = int(args.spool_memory_mb * 1024 * 1024)
+    if args.spool_dir:
+        CHAPTER_SPOOL_DIR = args.spool_dir
+    if args.cover_size:
+        cover_size_match = re.fullmatch(r'(\d+)x(\d+)', args.cover_size)
+        if args.cover_size == 'original':
+            COVER_MAX_SIZE = None
+        elif cover_size_match and all(int(number) > 0 for number in cover_size_match.groups()):
+            COVER_MAX_SIZE = tuple(int(number) for number in cover_size_match.groups())
+        else:
+            parser.error(f"--cover-size must be WIDTHxHEIGHT or 'original', not {args.cover_size!r}")
+        if COVER_MAX_SIZE and Image is None:
+            logging.warning("Pillow is not installed; covers are used as served (pip install Pillow to normalize them).")
+    if args.cover_cache:
+        COVER_CACHE_DIR = None if args.cover_cache == 'off' else args.cover_cache
+    if args.search_limit < 1:
+        parser.error("--search-limit must be a positive integer")
+    if args.index:
+        SEARCH_INDEX_PATH = args.index
+    if args.trace_memory:
+        start_memory_trace()
+
     # --- Determine Execution Mode ---
-    if args.serve:
+    if args.search:
+        # --- Query the Full-Text Index ---
+        logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING, format='%(asctime)s - Search - %(levelname)s - %(message)s')
+        index_path = SEARCH_INDEX_PATH or SEARCH_INDEX_DEFAULT_PATH
+        if not os.path.exists(index_path):
+            parser.error(f"no search index at {index_path}; build books with --index first")
+        try:
+            hits = SearchIndex(index_path).search(args.search, book_url=args.search_book, limit=args.search_limit)
+        except (ValueError, sqlite3.Error) as e:
+            parser.error(f"--search: {e}")
+        for hit in hits:
+            print(f"{hit['book_title']} - {hit['position'] + 1}. {hit['chapter_title']} ({hit['chapter_url']})")
+            print(f"    {hit['snippet']}")
+        print(f"{len(hits)} hit(s).")
+        sys.exit(0 if hits else 1)
+    elif args.serve:
         # --- Run Development Server ---
         # Configure logging for the server
         log_level = logging.DEBUG if args.debug else logging.INFO
@@ -1319,6 +4156,55 @@ if __name__ == "__main__":
         # Logging is configured within handle_fcgi_request
         handle_fcgi_request()
         sys.exit(0)
+    elif args.repair:
+        # --- Repair Missing Chapters of an Existing Build ---
+        log_level = logging.DEBUG if args.debug else logging.INFO
+        logging.basicConfig(level=log_level, format='%(asctime)s - Repair - %(levelname)s - %(message)s')
+        repaired = repair_epub(args.repair)
+        dump_metrics(os.path.dirname(os.path.abspath(args.repair)), path=args.metrics_file)
+        sys.exit(0 if repaired else 1)
+    elif args.batch:
+        # --- Build Many Books From a Manifest ---
+        log_level = logging.DEBUG if args.debug else logging.INFO
+        logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True) # Show which book each line belongs to
+        summary = run_batch(args.batch, workers=args.workers, summary_path=args.batch_summary, output_dir=args.output_dir, profile=args.profile,
+                            volumes=args.volumes, compression=args.compression, formats=args.format)
+        dump_metrics(args.output_dir, path=args.metrics_file)
+        sys.exit(1 if summary['books_failed'] else 0)
+    elif args.watch:
+        # --- Watch a Library for New Chapters ---
+        log_level = logging.DEBUG if args.debug else logging.INFO
+        logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True)
+        try:
+            run_watch(args.watch, state_path=args.watch_state, workers=args.workers, once=args.once)
+        except KeyboardInterrupt:
+            logging.info("Watcher stopped.")
+        sys.exit(0)
+    elif args.worker:
+        # --- Distributed Crawl Worker ---
+        log_level = logging.DEBUG if args.debug else logging.INFO
+        logging.basicConfig(level=log_level, format='%(asctime)s - Worker - %(levelname)s - %(message)s', force=True)
+        try:
+            run_worker(args.worker, once=args.once, token=args.broker_token)
+        except KeyboardInterrupt:
+            logging.info("Worker stopped.")
+        sys.exit(0)
+    elif args.coordinator:
+        # --- Distributed Crawl Coordinator ---
+        log_level = logging.DEBUG if args.debug else logging.INFO
+        logging.basicConfig(level=log_level, format='%(asctime)s - Coordinator - %(levelname)s - %(message)s', force=True)
+        broker = SqliteShardBroker(args.broker)
+        if args.broker_port:
+            broker_token = args.broker_token or secrets.token_urlsafe(16)
+            serve_broker(broker, args.broker_port, broker_token, host=args.broker_host)
+            logging.info(f"Broker endpoint listening on {args.broker_host}:{args.broker_port}.")
+            if not args.broker_token: # Workers need it to connect
+                logging.info(f"Generated broker token; start workers with --broker-token {broker_token} (or set {DISTRIBUTED_TOKEN_ENV}).")
+        result = build_book(args.url, args.start_chapter, args.end_chapter, args.output_dir,
+                            chapter_fetcher=make_distributed_fetcher(broker, args.url.strip(), args.shard_size), profile=args.profile,
+                            volumes=args.volumes, compression=args.compression, formats=args.format)
+        dump_metrics(args.output_dir, path=args.metrics_file)
+        sys.exit(1 if result['status'] == 'failed' else 0)
     else:
         # --- Standard CLI Execution ---
         log_level = logging.DEBUG if args.debug else logging.INFO
@@ -1327,112 +4213,10 @@ if __name__ == "__main__":
         logging.getLogger().setLevel(logging.DEBUG)
         logging.debug("Debug logging enabled.")
 
-    # Clean up URL whitespace
-    book_index_url = args.url.strip()
-
-    # --- Site Detection and Config ---
-    # Detect site *before* potentially modifying the trailing slash
-    site_config = get_site_config(book_index_url)
-    if not site_config:
-         logging.error(f"Unsupported website URL provided: {book_index_url}")
-         sys.exit(1) # Exit if site is not supported
-
-    # Ensure trailing slash for bqg5.com, remove for others
-    if "bqg5.com" in site_config.get("base_url", ""):
-        if not book_index_url.endswith('/'):
-            book_index_url += '/'
-            logging.debug("Ensured trailing slash for bqg5.com URL.")
-    else:
-        # Original behavior for other sites: remove trailing slash
-        book_index_url = book_index_url.rstrip('/')
-        logging.debug("Removed trailing slash for non-bqg5.com URL (if present).")
-
-    logging.info(f"Starting EPUB creation for: {book_index_url}")
-    logging.info(f"Using config for: {site_config['base_url']}")
-
-    # --- Fetch Initial Pages ---
-    index_html = None # Page with chapter links
-    metadata_html = None # Page with book metadata (title, author, etc.)
-    metadata_url = book_index_url # Default: metadata on index page
-
-    if site_config.get('needs_metadata_fetch', False):
-        # Derive metadata URL (e.g., .htm page for 69shuba)
-        try:
-            # Extract book ID for template (e.g., 85122 from https://www.69shuba.com/book/85122/ or 571203 from https://ixdzs8.com/read/571203/)
-            # Make regex more general to handle different URL structures
-            book_id_match = re.search(r'/(?:book|txt|info|read|chapter)/(\d+)', book_index_url) # Added 'read', 'chapter'
-            if not book_id_match:
-                # Try extracting last digits if pattern fails (less reliable)
-                # Ensure we don't match the domain part if URL ends like .com/12345
-                path_part = requests.utils.urlparse(book_index_url).path
-                book_id_match = re.search(r'/(\d+)/?$', path_part)
-                if not book_id_match:
-                     # Try extracting digits after _
-                     book_id_match = re.search(r'_(\d+)', book_index_url)
-
-            if not book_id_match:
-                raise ValueError("Could not extract book ID from URL for metadata lookup")
-
-            book_id = book_id_match.group(1)
-            metadata_url_template = site_config.get('metadata_url_template')
-            chapter_list_url_template = site_config.get('chapter_list_url_template') # Get chapter list template
-            if not metadata_url_template or not chapter_list_url_template:
-                 raise ValueError("Missing 'metadata_url_template' or 'chapter_list_url_template' in site config")
-
-            metadata_url = metadata_url_template.format(base_url=site_config['base_url'], book_id=book_id)
-            logging.info(f"Fetching metadata page: {metadata_url}")
-            metadata_html = fetch_url(metadata_url)
-            if not metadata_html:
-                 raise ConnectionError(f"Failed to fetch metadata page: {metadata_url}")
-
-            # Construct and fetch the chapter list page URL using the template
-            chapter_list_fetch_url = chapter_list_url_template.format(base_url=site_config['base_url'], book_id=book_id)
-            logging.info(f"Fetching chapter list page: {chapter_list_fetch_url}")
-            index_html = fetch_url(chapter_list_fetch_url)
-            if not index_html:
-                 raise ConnectionError(f"Failed to fetch chapter list page: {chapter_list_fetch_url}")
-
-            # Important: Update book_index_url to the chapter list URL for subsequent use (e.g., resolving relative chapter links)
-            book_index_url = chapter_list_fetch_url
-
-        except (ValueError, ConnectionError, KeyError, AttributeError) as e:
-             logging.error(f"Error preparing URLs or fetching initial pages for {site_config['base_url']}: {e}")
-             metadata_html = None # Ensure it's None if fetch failed
-             index_html = None
-    else:
-        # For sites like bqg5, metadata and chapters are on the same page
-        logging.info(f"Fetching book index/metadata page: {book_index_url}")
-        index_html = fetch_url(book_index_url)
-        metadata_html = index_html # Use the same HTML for both
-        metadata_url = book_index_url # URL where metadata was found
-
-    # --- Process Data (CLI Mode) ---
-    if index_html and metadata_html:
-        # Use metadata_html for details, index_html for chapters (metadata_url needed for cover resolution)
-        # Pass metadata_url for resolving relative cover images if needed
-        book_title, book_author, book_description, cover_url = get_book_details(metadata_html, metadata_url, site_config)
-
-        # Use chapter_list_fetch_url if available (for sites where metadata/chapters are separate)
-        chapter_list_source_url = chapter_list_fetch_url or book_index_url
-        chapter_links = get_chapter_links(index_html, chapter_list_source_url, site_config)
-
-        # Apply chapter range using helper
-        chapter_links = filter_chapters_by_range(chapter_links, args.start_chapter, args.end_chapter)
-
-        if chapter_links:
-            # Fetch chapter content using helper
-            chapters_content_data = fetch_chapters_content(chapter_links, site_config)
-
-            if chapters_content_data:
-                logging.info(f"\nCollected content for {len(chapters_content_data)} chapters. Creating EPUB...")
-                # Pass the metadata_url as the source URL for metadata
-                # Pass args.output_dir for CLI mode
-                create_epub(book_title, book_author, book_description, chapters_content_data, metadata_url, cover_url, args.output_dir)
-            else:
-                logging.error("No chapter content collected. EPUB creation aborted.")
-        else:
-            logging.error("No chapter links found. Aborting.")
-    else:
-        logging.error("Failed to fetch book index and/or metadata page(s). Aborting.")
-
-    logging.info("Script finished.")
\ No newline at end of file
+    # --- Build the Book ---
+    result = build_book(args.url, args.start_chapter, args.end_chapter, args.output_dir, profile=args.profile, append_to=args.append,
+                        volumes=args.volumes, compression=args.compression, formats=args.format)
+    dump_metrics(args.output_dir, path=args.metrics_file)
+    logging.info("Script finished.")
+    if result['status'] == 'failed':
+        sys.exit(1)
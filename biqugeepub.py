@@ -35,10 +35,20 @@ logger.addHandler(log_FileHandler)
 logger.setLevel(logging.DEBUG)
 
 
+def get_compresslevel(compression):
+    """压缩档位（biquge_epub_creator.COMPRESSION_PROFILES：fast、balanced、max）对应的 zip compresslevel；未指定时返回 None，即 ZipFile 默认压缩，无需导入"""
+    if not compression:
+        return None
+    # Imported here, after the log handlers are set up, so its logging setup does not apply
+    from biquge_epub_creator import get_compression_level
+    return get_compression_level(compression)  # ValueError for unknown profiles
+
+
 class BiqugeEpub(object):
-    def __init__(self, book_name):
+    def __init__(self, book_name, compression=None):
         self.site = 'www.biquge.info'
         self.book_name = book_name
+        self.compression = compression
         self.author = ''
         if '@' in book_name:
             self.book_name, self.author = self.win_unencode(book_name).split('@')[:2]
@@ -102,6 +112,16 @@ class BiqugeEpub(object):
             logging.exception(e)
         return body
 
+    def get_cover(self, url):
+        """获取封面：优先使用 biquge_epub_creator 的封面缓存（按 URL 缓存并缩放压缩），其依赖未安装时直接下载"""
+        try:
+            # Imported here, after the log handlers are set up, so its logging setup does not apply
+            from biquge_epub_creator import download_cover_image
+        except ImportError:
+            return self.open_url(url, bytes_like=True)
+        cover = download_cover_image(url)
+        return cover[0] if cover else self.open_url(url, bytes_like=True)
+
     def query_book_info(self):
         """获取小说id"""
         site_pattern = self.site.replace('.', r'\.') + '/([0-9]{1,2})_([0-9]{1,9})/'
@@ -353,14 +373,17 @@ class BiqugeEpub(object):
 
             # get cover.jpg 
             with open('cover.jpg', 'wb') as jpg:
-                jpg.write(self.open_url(book_info['img_url'], bytes_like=True))
+                jpg.write(self.get_cover(book_info['img_url']))
 
             logging.info('=== Being generated.')
             # zip *.epub
-            with ZipFile(epub_path, 'w', ZIP_DEFLATED) as z:
+            zip_started = time.time()
+            with ZipFile(epub_path, 'w', ZIP_DEFLATED, compresslevel=get_compresslevel(self.compression)) as z:
                 for b, ds, fs in os.walk('.'):
                     for ff in fs:
                         z.write(os.path.join(b, ff))
+            logging.info('Compressed with %s profile in %.2fs: %d bytes.'
+                         % (self.compression or 'default', time.time() - zip_started, os.path.getsize(epub_path)))
 
         except Exception as e:
             with open('log', 'w') as log:
@@ -391,9 +414,14 @@ def test():
 
 if __name__ == '__main__':
     if len(argv) < 2:
-        info = '''Input args error, please type: "%(script)s Book_Name_You_Want".'''
+        info = '''Input args error, please type: "%(script)s Book_Name_You_Want [fast|balanced|max]".'''
         esc(info % {'script': argv[0]})
     else:
+        compression = argv[2] if len(argv) > 2 else None
+        try:
+            get_compresslevel(compression)
+        except ValueError as e:
+            esc(str(e))
         logging.info(argv[1])
-        epub = BiqugeEpub(argv[1])
+        epub = BiqugeEpub(argv[1], compression)
         epub.generate_epub()
@@ -10,6 +10,11 @@ import mimetypes
 import urllib.parse
 import argparse
 import random
+import collections
+import threading
+import concurrent.futures
+import json
+import queue
 
 # Import requests specifically for downloading the cover image
 import requests
@@ -28,6 +33,23 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 OUTPUT_DIR = "output_epubs"
 OUTPUT_FILENAME_TEMPLATE = "{title}.epub"
 REQUEST_DELAY = 0.2
+PAGE_POOL_SIZE = 1 # Pages kept open on the shared context for reuse
+PAGE_MAX_NAVIGATIONS = 50 # A pooled page is closed and replaced after this many navigations
+VIEWPORT_SIZE = {"width": 1280, "height": 800} # Consistent window size
+CHAPTER_CONCURRENCY = 4 # Chapter pages loading at once (default for --concurrency)
+MAX_CHAPTER_CONCURRENCY = 16 # Upper bound accepted for --concurrency
+CHAPTER_WAIT_TIMEOUT = 30000 # ms to wait for a pipelined chapter's content before treating it as a challenge
+# Hybrid mode (--hybrid): chapters over plain HTTP with the browser's Cloudflare clearance
+HYBRID_HTTP_TIMEOUT = 30
+# Saved browser storage state (cookies, localStorage) per site, so warm starts skip the challenge
+STORAGE_STATE_DIR = ".browser_state"
+STORAGE_STATE_MAX_AGE = 12 * 3600 # Seconds a saved state is trusted when none of its cookies carries an expiry
+STORAGE_STATE_EXPIRY_MARGIN = 300 # Seconds before the clearance expires at which a saved state is no longer used
+# Debug capture (--debug-html-dir): screenshots and HTML dumps, written off the crawl thread
+DEBUG_SAMPLE_RATE = 1.0 # Fraction of capture points actually captured
+DEBUG_BUDGET_MB = 50 # Capture stops once this much has been written in a run
+EXTRACTED_MARKER = "<!--extracted-->" # Prefix of HTML that is only the content container, extracted in the browser
+CHALLENGE_MARKERS = ('cf-chl', 'challenge-platform', 'Just a moment...', 'Checking your browser') # Signs of a challenge page
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
 # Headers for the requests call to download the cover image
 REQUESTS_HEADERS = { 'User-Agent': USER_AGENT }
@@ -63,6 +85,15 @@ SITE_CONFIGS = {
             r'www\.69shuba\.com', r'69书吧', r'https://www\.69shuba\.com',
             r'小提示：.*', r'章节错误？点此举报', r'Copyright \d+ 69书吧'
         ],
+        # Request routing: only the chapter text is read, so heavy resources and ad/analytics hosts are aborted
+        "blocked_resource_types": ["image", "media", "font"],
+        "blocked_host_patterns": [
+            r'googlesyndication\.com', r'doubleclick\.net', r'google-analytics\.com', r'googletagmanager\.com',
+            r'googletagservices\.com', r'adservice\.google\.', r'amazon-adsystem\.com', r'adnxs\.com',
+            r'hm\.baidu\.com', r'cnzz\.com', r'51\.la',
+        ],
+        # Never blocked, whatever the rules above say: Cloudflare challenge scripts, iframes and images
+        "route_allow_patterns": [r'challenges\.cloudflare\.com', r'/cdn-cgi/'],
     }
 }
 
@@ -75,20 +106,151 @@ def _generate_safe_filename_from_url(url, prefix=""):
     if not os.path.splitext(safe_segment)[1]: safe_segment += ".html"
     return f"{prefix}{safe_segment}"
 
+class DebugCapture:
+    """
+    Opt-in sink for challenge screenshots and HTML dumps.
+
+    Disabled (every call returns immediately) unless configured with a directory. When
+    enabled, each capture point is kept with probability sample_rate, and capture stops
+    once budget_bytes have been queued. Encoding and file writes happen on a background
+    thread; only page.screenshot() itself must run on the Playwright thread.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.sample_rate = DEBUG_SAMPLE_RATE
+        self.budget_bytes = DEBUG_BUDGET_MB * 1024 * 1024
+        self.bytes_queued = 0
+        self._queue = None
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def configure(self, directory, sample_rate=DEBUG_SAMPLE_RATE, budget_mb=DEBUG_BUDGET_MB):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        if directory and self._thread is None:
+            os.makedirs(directory, exist_ok=True)
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._write_loop, name="debug-capture", daemon=True)
+            self._thread.start()
+
+    def _take(self, size_estimate=0):
+        """Decides whether this capture point is captured (enabled, sampled in, budget left)."""
+        if not self.enabled or self.bytes_queued + size_estimate > self.budget_bytes:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _submit(self, filename, produce_bytes):
+        self._queue.put((filename, produce_bytes))
+
+    def screenshot(self, page, filename, directory=None):
+        """Queues a viewport screenshot of page (taken now, written later)."""
+        if not self._take():
+            return
+        try:
+            data = page.screenshot()
+        except Exception as e:
+            logging.debug(f"Debug screenshot {filename} failed: {e}")
+            return
+        if self.bytes_queued + len(data) > self.budget_bytes:
+            return
+        self.bytes_queued += len(data)
+        self._submit(os.path.join(directory or self.directory, filename), lambda: data)
+
+    def html(self, url, content, encoding, prefix="", directory=None):
+        """Queues the page HTML, re-encoded to the site's encoding on the writer thread."""
+        if not self._take(len(content)):
+            return
+        self.bytes_queued += len(content)
+        filename = os.path.join(directory or self.directory, _generate_safe_filename_from_url(url, prefix))
+        self._submit(filename, lambda: content.encode(encoding, errors='ignore'))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                filename, produce_bytes = item
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                with open(filename, 'wb') as f:
+                    f.write(produce_bytes())
+                logging.debug(f"Saved debug capture {filename}")
+            except Exception as e:
+                logging.warning(f"Could not save debug capture: {e}")
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """Waits for queued captures to be written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+DEBUG_CAPTURE = DebugCapture()
+
 def save_debug_html(directory, url, content, encoding, prefix=""):
-    """Saves the raw byte stream of the HTML content to a file."""
-    if not directory: return
+    """Saves the raw byte stream of the HTML content to a file (through DEBUG_CAPTURE, off the crawl thread)."""
+    DEBUG_CAPTURE.html(url, content, encoding, prefix, directory=directory)
+
+def get_storage_state_path(state_dir, site_config):
+    host = urllib.parse.urlparse(site_config['base_url']).netloc
+    return os.path.join(state_dir, f"{host}.json")
+
+def get_storage_state_expiry(storage_state, saved_at):
+    """
+    Returns when a storage state stops being useful: the expiry of its cf_clearance cookie,
+    else of its earliest-expiring persistent cookie, else saved_at + STORAGE_STATE_MAX_AGE.
+    """
+    cookies = [c for c in storage_state.get('cookies', []) if c.get('expires', -1) > 0]
+    clearance = [c for c in cookies if c['name'] == 'cf_clearance']
+    if clearance or cookies:
+        return min(c['expires'] for c in (clearance or cookies))
+    return saved_at + STORAGE_STATE_MAX_AGE
+
+def load_storage_state(path, logger=None):
+    """Returns the saved storage state dict for new_context(), or None if missing, expired or saved with another user agent."""
+    if logger is None: logger = logging.getLogger()
     try:
-        filename = _generate_safe_filename_from_url(url, prefix)
-        os.makedirs(directory, exist_ok=True)
-        filepath = os.path.join(directory, filename)
-        # Open in binary write mode ('wb') and write the encoded bytes
-        with open(filepath, 'wb') as f:
-            # Re-encode the string from page.content() back to its original bytes
-            f.write(content.encode(encoding, errors='ignore'))
-        logging.debug(f"Saved raw byte stream to {filepath}")
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        logger.info(f"No saved browser state at {path}; starting cold.")
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read saved browser state {path}: {e}")
+        return None
+    if saved.get('user_agent') != USER_AGENT:
+        logger.info("Saved browser state was recorded with a different user agent; starting cold.")
+        return None
+    remaining = saved.get('expires_at', 0) - time.time()
+    if remaining < STORAGE_STATE_EXPIRY_MARGIN:
+        logger.info(f"Saved browser state {path} has expired; starting cold.")
+        return None
+    logger.info(f"Reusing saved browser state {path} (valid for another {remaining / 60:.0f} min).")
+    return saved['storage_state']
+
+def save_storage_state(context, path, logger=None):
+    """Saves the context's cookies and localStorage with its expiry, for the next run."""
+    if logger is None: logger = logging.getLogger()
+    try:
+        storage_state = context.storage_state()
+        saved_at = time.time()
+        saved = {'saved_at': saved_at, 'expires_at': get_storage_state_expiry(storage_state, saved_at),
+                 'user_agent': USER_AGENT, 'storage_state': storage_state}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(saved, f)
+        os.replace(temp_path, path) # Never leave a half-written state behind
+        logger.info(f"Saved browser state to {path} (expires {time.strftime('%Y-%m-%d %H:%M', time.localtime(saved['expires_at']))}).")
     except Exception as e:
-        logging.warning(f"Could not save debug byte stream for {url}: {e}")
+        logger.warning(f"Could not save browser state to {path}: {e}")
 
 def initialize_browser():
     global PLAYWRIGHT_INSTANCE, BROWSER_INSTANCE
@@ -106,6 +268,163 @@ def close_browser():
         BROWSER_INSTANCE = None
         PLAYWRIGHT_INSTANCE = None
 
+class NavigationStats:
+    """Per-chapter page load time and bytes received, plus requests aborted by resource blocking."""
+
+    def __init__(self):
+        self.navigations = 0
+        self.load_seconds = 0.0
+        self.bytes_received = 0
+        self.blocked_requests = 0
+
+    def record(self, seconds, bytes_received):
+        self.navigations += 1
+        self.load_seconds += seconds
+        self.bytes_received += bytes_received
+
+    def summary(self):
+        if not self.navigations:
+            return f"No page loads recorded; {self.blocked_requests} request(s) blocked."
+        return (f"{self.navigations} page load(s): {self.load_seconds / self.navigations:.2f} s and "
+                f"{self.bytes_received / self.navigations / 1024:.0f} KiB per page on average; "
+                f"{self.blocked_requests} request(s) blocked.")
+
+def install_resource_blocking(context, site_config, stats=None, logger=None):
+    """
+    Routes every request of the context through the site's blocking rules: resource
+    types in "blocked_resource_types" and hosts matching "blocked_host_patterns" are
+    aborted, anything matching "route_allow_patterns" (challenge scripts) always passes.
+    Returns False if the site config has no rules, in which case no route is installed.
+    """
+    if logger is None: logger = logging.getLogger()
+    blocked_types = set(site_config.get('blocked_resource_types', []))
+    blocked_hosts = [re.compile(pattern, re.IGNORECASE) for pattern in site_config.get('blocked_host_patterns', [])]
+    allowed = [re.compile(pattern, re.IGNORECASE) for pattern in site_config.get('route_allow_patterns', [])]
+    if not blocked_types and not blocked_hosts:
+        return False
+
+    def handle_route(route):
+        request = route.request
+        if any(pattern.search(request.url) for pattern in allowed):
+            route.continue_()
+            return
+        host = urllib.parse.urlparse(request.url).netloc
+        if request.resource_type in blocked_types or any(pattern.search(host) for pattern in blocked_hosts):
+            if stats: stats.blocked_requests += 1
+            route.abort()
+            return
+        route.continue_()
+
+    context.route("**/*", handle_route)
+    logger.info(f"Blocking resource types {sorted(blocked_types)} and {len(blocked_hosts)} ad/analytics host pattern(s).")
+    return True
+
+class PagePool:
+    """
+    Warmed pages on one browser context, reused across navigations.
+
+    acquire() hands out an idle page (creating one if fewer than `size` exist), after a
+    health check: pages that crashed, were closed or no longer answer are replaced.
+    release() returns a page to the pool, or closes it if the caller marks it unhealthy
+    (e.g. it is stuck on a challenge) or it has reached `max_navigations`. Like the
+    sync Playwright API itself, the pool must only be used from the thread that created it.
+    Bytes received are counted from Content-Length headers, which costs nothing per request;
+    with `exact_bytes` each finished request's sizes are fetched from the browser instead
+    (one protocol round trip per request, so only for debugging).
+    """
+
+    def __init__(self, context, size=PAGE_POOL_SIZE, max_navigations=PAGE_MAX_NAVIGATIONS, logger=None, exact_bytes=False):
+        self.context = context
+        self.size = size
+        self.max_navigations = max_navigations
+        self.exact_bytes = exact_bytes
+        self.logger = logger or logging.getLogger()
+        self._idle = []
+        self._navigations = {} # page -> navigations done by it
+        self._crashed = set()
+        self._bytes_received = {} # page -> response bytes received so far
+        self.stats = NavigationStats()
+
+    def _new_page(self):
+        page = self.context.new_page()
+        page.set_viewport_size(VIEWPORT_SIZE)
+        page.on("crash", lambda crashed_page: self._crashed.add(crashed_page))
+        if self.exact_bytes:
+            page.on("requestfinished", lambda request: self._count_exact_bytes(page, request))
+        else:
+            page.on("response", lambda response: self._count_bytes(page, response))
+        self._navigations[page] = 0
+        return page
+
+    def _count_bytes(self, page, response):
+        # response.headers is already on this side of the connection; chunked responses without a length count as 0
+        content_length = response.headers.get('content-length', '')
+        if content_length.isdigit():
+            self._bytes_received[page] = self._bytes_received.get(page, 0) + int(content_length)
+
+    def _count_exact_bytes(self, page, request):
+        try:
+            sizes = request.sizes()
+            self._bytes_received[page] = self._bytes_received.get(page, 0) + sizes['responseHeadersSize'] + sizes['responseBodySize']
+        except Exception:
+            pass # Sizes are unavailable for some requests (e.g. served from cache or cancelled)
+
+    def navigation_started(self, page):
+        """Returns a token to pass to navigation_finished once the page's content is ready."""
+        return time.monotonic(), self._bytes_received.get(page, 0)
+
+    def navigation_finished(self, page, token):
+        started, bytes_before = token
+        self.stats.record(time.monotonic() - started, self._bytes_received.get(page, 0) - bytes_before)
+
+    def _is_healthy(self, page):
+        if page.is_closed() or page in self._crashed:
+            return False
+        try:
+            page.evaluate("() => document.readyState")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Returns a healthy page for one navigation."""
+        while self._idle:
+            page = self._idle.pop()
+            if self._is_healthy(page):
+                self._navigations[page] += 1
+                return page
+            self.logger.info("Discarding unhealthy pooled page.")
+            self._discard(page)
+        if len(self._navigations) >= self.size:
+            raise RuntimeError(f"Page pool exhausted: all {self.size} page(s) are in use.")
+        page = self._new_page()
+        self._navigations[page] = 1
+        return page
+
+    def release(self, page, healthy=True):
+        """Returns a page to the pool, or closes it if unhealthy or worn out."""
+        if healthy and self._navigations.get(page, 0) < self.max_navigations and not page.is_closed():
+            self._idle.append(page)
+        else:
+            if healthy:
+                self.logger.debug(f"Recycling pooled page after {self._navigations.get(page, 0)} navigations.")
+            self._discard(page)
+
+    def _discard(self, page):
+        self._navigations.pop(page, None)
+        self._bytes_received.pop(page, None)
+        self._crashed.discard(page)
+        if not page.is_closed():
+            try:
+                page.close()
+            except Exception as e:
+                self.logger.debug(f"Error closing pooled page: {e}")
+
+    def close(self):
+        for page in list(self._navigations):
+            self._discard(page)
+        self._idle = []
+
 CLICK_COORDS = {'x': 215, 'y': 290}
 
 def human_like_mouse_move_and_click(page, x, y, logger=None):
@@ -141,14 +460,14 @@ def human_like_mouse_move_and_click(page, x, y, logger=None):
     
     logger.info(f"Human-like click completed at ({actual_x}, {actual_y})")
 
-def try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, debug_prefix):
+def try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, debug_prefix, encoding=None):
     """Try opening the URL in a new tab to bypass Cloudflare challenge"""
     logger.info("Trying new tab bypass strategy...")
     new_page = None
     
     try:
         new_page = context.new_page()
-        new_page.set_viewport_size({"width": 1280, "height": 800})
+        new_page.set_viewport_size(VIEWPORT_SIZE)
         
         # Add a small delay to simulate human behavior
         time.sleep(random.uniform(1.0, 2.0))
@@ -160,11 +479,13 @@ def try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, d
         try:
             new_page.wait_for_selector(wait_for_selector_str, state="visible", timeout=8000)
             logger.info("SUCCESS! New tab bypass worked - content loaded directly!")
-            new_page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_NEW_TAB_SUCCESS.png"))
-            return new_page.content()
+            DEBUG_CAPTURE.screenshot(new_page, f"{debug_prefix}_NEW_TAB_SUCCESS.png", directory=debug_dir)
+            content = new_page.content()
+            save_debug_html(debug_dir, url, content, encoding, debug_prefix)
+            return content
         except PlaywrightTimeoutError:
             logger.info("New tab still shows challenge page")
-            new_page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_NEW_TAB_CHALLENGE.png"))
+            DEBUG_CAPTURE.screenshot(new_page, f"{debug_prefix}_NEW_TAB_CHALLENGE.png", directory=debug_dir)
             return None
             
     except Exception as e:
@@ -174,16 +495,28 @@ def try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, d
         if new_page and not new_page.is_closed():
             new_page.close()
 
-def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, logger=None, debug_dir=None, debug_prefix=""):
+def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, logger=None, debug_dir=None, debug_prefix="", page_pool=None, extract_selector=None):
+    """
+    Navigates to url and returns the page HTML once wait_for_selector_str is visible,
+    working through a Cloudflare challenge if one appears. With page_pool, the navigation
+    reuses a pooled page instead of opening a new one; a page that ends up stuck on a
+    challenge or erroring is not returned to the pool. With extract_selector, only that
+    element's HTML is returned (see read_page_html).
+    """
     global CLICK_COORDS # We need to access and modify the global variable
     if logger is None: logger = logging.getLogger()
     page = None
+    page_ok = False # Whether the page ended on real content and can be reused
     max_retries = 3  # Maximum number of challenge attempts
     max_new_tab_attempts = 2  # Try new tab strategy up to 2 times
 
     try:
-        page = context.new_page()
-        page.set_viewport_size({"width": 1280, "height": 800}) # Consistent window size
+        if page_pool:
+            page = page_pool.acquire()
+            navigation = page_pool.navigation_started(page)
+        else:
+            page = context.new_page()
+            page.set_viewport_size(VIEWPORT_SIZE)
         logger.info(f"Navigating to: {url}")
         page.goto(url, wait_until="domcontentloaded", timeout=60000)
 
@@ -191,15 +524,19 @@ def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, lo
         try:
             page.wait_for_selector(wait_for_selector_str, state="visible", timeout=5000) # Short timeout
             logger.info("Success! Content found directly.")
-            return page.content()
+            page_ok = True
+            if page_pool: page_pool.navigation_finished(page, navigation)
+            content = read_page_html(page, extract_selector)
+            save_debug_html(debug_dir, url, content, encoding, debug_prefix)
+            return content
         except PlaywrightTimeoutError:
             logger.warning("Content not found. Cloudflare challenge detected.")
-            page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_initial_challenge.png"))
+            DEBUG_CAPTURE.screenshot(page, f"{debug_prefix}_initial_challenge.png", directory=debug_dir)
             
             # STRATEGY 1: Try new tab bypass first (often works!)
             for tab_attempt in range(1, max_new_tab_attempts + 1):
                 logger.info(f"=== NEW TAB BYPASS ATTEMPT {tab_attempt}/{max_new_tab_attempts} ===")
-                result = try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, f"{debug_prefix}_tab_{tab_attempt}")
+                result = try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, f"{debug_prefix}_tab_{tab_attempt}", encoding)
                 if result:
                     logger.info("New tab bypass successful! Returning content.")
                     return result
@@ -213,7 +550,7 @@ def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, lo
             # STRATEGY 2: Fall back to challenge solving on original page
             for attempt in range(1, max_retries + 1):
                 logger.info(f"Challenge solving attempt {attempt}/{max_retries}")
-                page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_challenge_attempt_{attempt}.png"))
+                DEBUG_CAPTURE.screenshot(page, f"{debug_prefix}_challenge_attempt_{attempt}.png", directory=debug_dir)
 
                 coords = CLICK_COORDS
                 logger.info(f"Using base coordinates: {coords}")
@@ -230,7 +567,11 @@ def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, lo
                     # Wait for the target content to appear
                     page.wait_for_selector(wait_for_selector_str, state="visible", timeout=30000)
                     logger.info(f"Challenge solved successfully on attempt {attempt}!")
-                    return page.content()
+                    page_ok = True
+                    if page_pool: page_pool.navigation_finished(page, navigation)
+                    content = read_page_html(page, extract_selector)
+                    save_debug_html(debug_dir, url, content, encoding, debug_prefix)
+                    return content
                 except PlaywrightTimeoutError:
                     logger.warning(f"Challenge attempt {attempt} failed - page may have reappeared")
                     
@@ -246,13 +587,13 @@ def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, lo
                         else:
                             logger.error("Max challenge attempts reached. Trying one final new tab attempt...")
                             # Final desperate attempt with new tab
-                            final_result = try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, f"{debug_prefix}_final_tab")
+                            final_result = try_new_tab_bypass(context, url, wait_for_selector_str, logger, debug_dir, f"{debug_prefix}_final_tab", encoding)
                             if final_result:
                                 logger.info("Final new tab attempt succeeded!")
                                 return final_result
                             
                             logger.error("All strategies failed. Challenge failed.")
-                            page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_FINAL_CHALLENGE_FAIL.png"))
+                            DEBUG_CAPTURE.screenshot(page, f"{debug_prefix}_FINAL_CHALLENGE_FAIL.png", directory=debug_dir)
                             return None
                     else:
                         # We're not on challenge page but still don't have content
@@ -263,18 +604,216 @@ def fetch_page_with_playwright(url, context, wait_for_selector_str, encoding, lo
                             continue
                         else:
                             logger.error("Max attempts reached. Content not found.")
-                            page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_CONTENT_NOT_FOUND.png"))
+                            DEBUG_CAPTURE.screenshot(page, f"{debug_prefix}_CONTENT_NOT_FOUND.png", directory=debug_dir)
                             return None
 
         except Exception as e:
             logger.error(f"FATAL: Failed during the bypass/challenge process: {e}", exc_info=True)
-            page.screenshot(path=os.path.join(debug_dir or ".", f"{debug_prefix}_FATAL_ERROR.png"))
+            DEBUG_CAPTURE.screenshot(page, f"{debug_prefix}_FATAL_ERROR.png", directory=debug_dir)
             return None
 
     finally:
-        if page and not page.is_closed():
+        if page_pool and page:
+            page_pool.release(page, healthy=page_ok)
+        elif page and not page.is_closed():
             page.close()
 
+def fetch_chapters_in_parallel(chapters, page_pool, site_config, concurrency=CHAPTER_CONCURRENCY, logger=None, debug_dir=None, first_number=1, extract_in_browser=False):
+    """
+    Fetches chapter pages with up to `concurrency` navigations in flight on pooled pages.
+
+    The sync Playwright API is single-threaded, so navigations are pipelined: each one is
+    started with wait_until="commit" (returns as soon as the response starts) and the
+    browser keeps loading it while earlier chapters are awaited. All pages share the
+    context, and with it the cleared Cloudflare session. A chapter whose content does not
+    appear (e.g. a challenge came back) is retried through fetch_page_with_playwright.
+    Yields (index, html) in chapter order; html is None if the chapter failed. With
+    extract_in_browser, html is only the content container (see read_page_html).
+    """
+    if logger is None: logger = logging.getLogger()
+    wait_selector = site_config['chapter_content_wait_selector']
+    extract_selector = site_config.get('chapter_content_selectors', {}).get('container') if extract_in_browser else None
+    in_flight = collections.deque() # (index, page or None, navigation token or error)
+    next_index = 0
+    try:
+        while next_index < len(chapters) or in_flight:
+            # Keep the pipeline full
+            while next_index < len(chapters) and len(in_flight) < concurrency:
+                chapter_info = chapters[next_index]
+                page = page_pool.acquire()
+                try:
+                    logger.info(f"Navigating to: {chapter_info['url']}")
+                    navigation = page_pool.navigation_started(page)
+                    page.goto(chapter_info['url'], wait_until="commit", timeout=60000)
+                    in_flight.append((next_index, page, navigation))
+                except Exception as e:
+                    page_pool.release(page, healthy=False)
+                    in_flight.append((next_index, None, e))
+                next_index += 1
+                time.sleep(REQUEST_DELAY) # Spacing between navigation starts
+
+            index, page, navigation = in_flight.popleft()
+            chapter_info = chapters[index]
+            html = None
+            error = navigation if page is None else None
+            if page is not None:
+                try:
+                    page.wait_for_selector(wait_selector, state="visible", timeout=CHAPTER_WAIT_TIMEOUT)
+                    page_pool.navigation_finished(page, navigation)
+                    html = read_page_html(page, extract_selector)
+                    save_debug_html(debug_dir, chapter_info['url'], html, site_config['encoding'], f"chap_{first_number + index:04d}_")
+                    page_pool.release(page, healthy=True)
+                except Exception as e:
+                    error = e
+                    page_pool.release(page, healthy=False)
+            if html is None:
+                logger.warning(f"Pipelined fetch of '{chapter_info['title']}' failed ({error}). Retrying with challenge handling...")
+                html = fetch_page_with_playwright(
+                    chapter_info['url'], page_pool.context,
+                    wait_for_selector_str=wait_selector,
+                    encoding=site_config['encoding'],
+                    logger=logger,
+                    debug_dir=debug_dir,
+                    debug_prefix=f"chap_{first_number + index:04d}_",
+                    page_pool=page_pool,
+                    extract_selector=extract_selector
+                )
+            yield index, html
+    finally:
+        # Consumer stopped early (e.g. aborted on a failed chapter): hand back pages still loading
+        for _, page, _ in in_flight:
+            if page is not None:
+                page_pool.release(page, healthy=False)
+
+class HybridFetcher:
+    """
+    Fetches pages over a pooled requests session that carries the browser context's
+    cookies (cf_clearance etc.) and user agent.
+
+    fetch() returns None when the response looks like a Cloudflare challenge or fails,
+    so the caller can fall back to the browser and then call sync_from_browser() to pick
+    up the renewed clearance. Safe to use from several threads.
+    """
+
+    def __init__(self, context, site_config, concurrency=CHAPTER_CONCURRENCY, logger=None):
+        self.context = context
+        self.site_config = site_config
+        self.logger = logger or logging.getLogger()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT, # Must match the browser's, or the clearance cookie is rejected
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Referer': site_config['base_url'] + '/',
+        })
+        self._lock = threading.Lock()
+        self._next_request = 0.0
+        self.http_pages = 0
+        self.browser_fallbacks = 0
+
+    def sync_from_browser(self):
+        """Copies the browser context's current cookies into the HTTP session. Must run on the Playwright thread."""
+        cookies = self.context.cookies()
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie.get('path', '/'))
+        self.logger.info(f"Hybrid mode: copied {len(cookies)} browser cookie(s) to the HTTP session "
+                         f"(cf_clearance {'present' if any(c['name'] == 'cf_clearance' for c in cookies) else 'absent'}).")
+
+    def _wait_turn(self):
+        # Same REQUEST_DELAY spacing as the browser navigations, shared by all threads
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_request)
+            self._next_request = slot + REQUEST_DELAY
+        if slot > now:
+            time.sleep(slot - now)
+
+    def fetch(self, url):
+        """Returns the page HTML, or None if it failed or a challenge came back."""
+        self._wait_turn()
+        try:
+            response = self.session.get(url, timeout=HYBRID_HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"Hybrid HTTP fetch failed for {url}: {e}")
+            return None
+        if response.status_code in (403, 429, 503):
+            self.logger.info(f"Hybrid HTTP fetch got {response.status_code} for {url}; challenge suspected.")
+            return None
+        if not response.ok:
+            self.logger.warning(f"Hybrid HTTP fetch got {response.status_code} for {url}.")
+            return None
+        response.encoding = self.site_config.get('encoding') or response.apparent_encoding
+        html = response.text
+        if any(marker in html for marker in CHALLENGE_MARKERS):
+            self.logger.info(f"Challenge page returned over HTTP for {url}.")
+            return None
+        self.http_pages += 1
+        return html
+
+def fetch_chapters_hybrid(chapters, hybrid, page_pool, site_config, concurrency=CHAPTER_CONCURRENCY, logger=None, debug_dir=None, first_number=1, extract_in_browser=False):
+    """
+    Fetches chapters over plain HTTP (up to `concurrency` at once) with the browser's
+    clearance, falling back to the browser for any chapter that hits a challenge.
+    Yields (index, html) in chapter order; html is None if the chapter failed both ways.
+    With extract_in_browser, browser fallbacks return only the content container.
+    """
+    if logger is None: logger = logging.getLogger()
+    extract_selector = site_config.get('chapter_content_selectors', {}).get('container') if extract_in_browser else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="hybrid") as executor:
+        pending = collections.deque()
+        next_index = 0
+        try:
+            while next_index < len(chapters) or pending:
+                while next_index < len(chapters) and len(pending) < concurrency * 2:
+                    pending.append((next_index, executor.submit(hybrid.fetch, chapters[next_index]['url'])))
+                    next_index += 1
+                index, future = pending.popleft()
+                html = future.result()
+                if html is None:
+                    # Browser fallback runs here, on the Playwright thread
+                    hybrid.browser_fallbacks += 1
+                    chapter_info = chapters[index]
+                    logger.info(f"Falling back to the browser for '{chapter_info['title']}'.")
+                    html = fetch_page_with_playwright(
+                        chapter_info['url'], page_pool.context,
+                        wait_for_selector_str=site_config['chapter_content_wait_selector'],
+                        encoding=site_config['encoding'],
+                        logger=logger,
+                        debug_dir=debug_dir,
+                        debug_prefix=f"chap_{first_number + index:04d}_",
+                        page_pool=page_pool,
+                        extract_selector=extract_selector
+                    )
+                    if html:
+                        hybrid.sync_from_browser() # The browser may have renewed the clearance
+                yield index, html
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def read_page_html(page, extract_selector=None):
+    """
+    Returns the page's HTML. With extract_selector, only the outerHTML of the first matching
+    element is serialized and transferred (prefixed with EXTRACTED_MARKER); the full page is
+    returned if nothing matches.
+    """
+    if extract_selector:
+        fragment = page.evaluate("(selector) => { const el = document.querySelector(selector); return el ? el.outerHTML : null; }",
+                                 extract_selector)
+        if fragment is not None:
+            return EXTRACTED_MARKER + fragment
+    return page.content()
+
+def find_chapter_container(chapter_html, site_config):
+    """Returns the chapter's content container tag from a full page or an in-browser extracted fragment."""
+    if chapter_html.startswith(EXTRACTED_MARKER):
+        return BeautifulSoup(chapter_html[len(EXTRACTED_MARKER):], 'html.parser').find()
+    content_selector_str = site_config.get('chapter_content_selectors', {}).get('container')
+    soup = BeautifulSoup(chapter_html, 'html.parser', from_encoding=site_config.get('encoding'))
+    return soup.select_one(content_selector_str) if content_selector_str else None
+
 def get_site_config(url, logger=None):
     if logger is None: logger = logging.getLogger()
     for domain, config in SITE_CONFIGS.items():
@@ -431,23 +970,40 @@ def main():
     parser.add_argument('-s', '--start-chapter', type=int, default=1, help='Starting chapter number')
     parser.add_argument('-e', '--end-chapter', type=int, default=None, help='Ending chapter number')
     parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR, help='Directory to save the EPUB file')
-    parser.add_argument('--debug-html-dir', help='(Optional) Directory to save fetched HTML files for debugging.')
+    parser.add_argument('--debug-html-dir', help='(Optional) Directory to save fetched HTML files and challenge screenshots for debugging. Nothing is captured without it.')
+    parser.add_argument('--debug-sample-rate', type=float, default=DEBUG_SAMPLE_RATE, help=f'Fraction of pages/screenshots captured with --debug-html-dir (default: {DEBUG_SAMPLE_RATE})')
+    parser.add_argument('--debug-budget-mb', type=float, default=DEBUG_BUDGET_MB, help=f'Stop capturing after this many MB (default: {DEBUG_BUDGET_MB})')
+    parser.add_argument('--no-block-resources', action='store_true', help='Load images, fonts and ad/analytics hosts instead of blocking them (for comparison)')
+    parser.add_argument('--state-dir', default=STORAGE_STATE_DIR, help=f'Directory for saved per-site browser state (default: {STORAGE_STATE_DIR})')
+    parser.add_argument('--no-saved-state', action='store_true', help='Start with a fresh browser context and do not save its state')
+    parser.add_argument('--hybrid', action='store_true', help='After the browser clears the Cloudflare check, fetch chapters over plain HTTP with its cookies, using the browser only when a challenge reappears')
+    parser.add_argument('--full-page-html', action='store_true', help='Serialize whole chapter pages and parse them in Python instead of extracting the content container in the browser')
+    parser.add_argument('-c', '--concurrency', type=int, default=CHAPTER_CONCURRENCY, help=f'Chapter pages loading at once (1-{MAX_CHAPTER_CONCURRENCY}, default: {CHAPTER_CONCURRENCY})')
     args = parser.parse_args()
+    if not 1 <= args.concurrency <= MAX_CHAPTER_CONCURRENCY:
+        parser.error(f"--concurrency must be between 1 and {MAX_CHAPTER_CONCURRENCY}")
 
     if args.debug_html_dir:
-        logging.info(f"Debug mode enabled. HTML files will be saved to: '{args.debug_html_dir}'")
-        os.makedirs(args.debug_html_dir, exist_ok=True)
+        logging.info(f"Debug mode enabled. HTML files and challenge screenshots will be saved to: '{args.debug_html_dir}' "
+                     f"(sample rate {args.debug_sample_rate}, budget {args.debug_budget_mb} MB)")
+        DEBUG_CAPTURE.configure(args.debug_html_dir, sample_rate=args.debug_sample_rate, budget_mb=args.debug_budget_mb)
 
     book_url = args.url.strip().rstrip('/')
     site_config = get_site_config(book_url)
     if not site_config: return
 
     context = None
+    page_pool = None
     try:
         initialize_browser()
         logging.info("Creating a persistent browser context for this run...")
-        context = BROWSER_INSTANCE.new_context(user_agent=USER_AGENT)
+        state_path = None if args.no_saved_state else get_storage_state_path(args.state_dir, site_config)
+        storage_state = load_storage_state(state_path) if state_path else None
+        context = BROWSER_INSTANCE.new_context(user_agent=USER_AGENT, storage_state=storage_state)
         context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        page_pool = PagePool(context, size=args.concurrency, exact_bytes=bool(args.debug_html_dir)) # Exact sizes cost a round trip per request
+        if not args.no_block_resources:
+            install_resource_blocking(context, site_config, stats=page_pool.stats)
 
         match = re.search(r'/book/(\d+)', book_url)
         if not match:
@@ -464,7 +1020,8 @@ def main():
             wait_for_selector_str=site_config['metadata_wait_selector'],
             encoding=site_config['encoding'],
             debug_dir=args.debug_html_dir,
-            debug_prefix="00_metadata_page_"
+            debug_prefix="00_metadata_page_",
+            page_pool=page_pool
         )
         if not metadata_html: return
 
@@ -473,9 +1030,11 @@ def main():
             wait_for_selector_str=site_config['chapter_list_wait_selector'],
             encoding=site_config['encoding'],
             debug_dir=args.debug_html_dir,
-            debug_prefix="01_chapter_list_page_"
+            debug_prefix="01_chapter_list_page_",
+            page_pool=page_pool
         )
         if not chapter_list_html: return
+        if state_path: save_storage_state(context, state_path) # The challenge is cleared at this point
         
         book_title, book_author, book_description, cover_url = get_book_details(metadata_html, metadata_url, site_config)
         all_chapters = get_chapter_links(chapter_list_html, site_config)
@@ -489,43 +1048,51 @@ def main():
             return
 
         chapters_content_data = []
-        content_selector_str = site_config.get('chapter_content_selectors', {}).get('container')
 
-        for i, chapter_info in enumerate(chapters_to_fetch):
+        # Results arrive in chapter order, so chapters_content_data stays ordered
+        hybrid = None
+        if args.hybrid:
+            hybrid = HybridFetcher(context, site_config, concurrency=args.concurrency)
+            hybrid.sync_from_browser() # The metadata and chapter list pages have cleared the challenge by now
+            chapter_pages = fetch_chapters_hybrid(chapters_to_fetch, hybrid, page_pool, site_config, concurrency=args.concurrency,
+                                                  debug_dir=args.debug_html_dir, first_number=start_index + 1,
+                                                  extract_in_browser=not args.full_page_html)
+        else:
+            chapter_pages = fetch_chapters_in_parallel(chapters_to_fetch, page_pool, site_config, concurrency=args.concurrency,
+                                                       debug_dir=args.debug_html_dir, first_number=start_index + 1,
+                                                       extract_in_browser=not args.full_page_html)
+        for i, chapter_html in chapter_pages:
+            chapter_info = chapters_to_fetch[i]
             logging.info(f"--- Processing chapter {start_index + i + 1}/{len(all_chapters)}: {chapter_info['title']} ---")
-            debug_prefix = f"chap_{start_index + i + 1:04d}_"
-            
-            chapter_html = fetch_page_with_playwright(
-                chapter_info['url'], context,
-                wait_for_selector_str=site_config['chapter_content_wait_selector'],
-                encoding=site_config['encoding'],
-                debug_dir=args.debug_html_dir,
-                debug_prefix=debug_prefix
-            )
-            
+
             if chapter_html:
-                soup = BeautifulSoup(chapter_html, 'html.parser', from_encoding=site_config.get('encoding'))
-                content_div = soup.select_one(content_selector_str) if content_selector_str else None
+                content_div = find_chapter_container(chapter_html, site_config)
                 if content_div:
                     cleaned_content = clean_html_content(content_div, site_config)
                     chapters_content_data.append({'title': chapter_info['title'], 'content_html': cleaned_content})
                 else:
                     logging.error(f"FATAL: Fetched HTML but could not find content for '{chapter_info['title']}'. Aborting.")
+                    chapter_pages.close()
                     return
             else:
                 logging.error(f"FATAL: Failed to fetch page for '{chapter_info['title']}'. Aborting.")
-                return 
-
-            time.sleep(REQUEST_DELAY)
+                chapter_pages.close()
+                return
 
+        if state_path: save_storage_state(context, state_path) # Keep any clearance renewed during the chapters
+        logging.info(f"Browser load stats: {page_pool.stats.summary()}")
+        if hybrid:
+            logging.info(f"Hybrid mode: {hybrid.http_pages} chapter(s) over HTTP, {hybrid.browser_fallbacks} browser fallback(s).")
         if chapters_content_data:
             create_epub(book_title, book_author, book_description, chapters_content_data, book_url, cover_url, args.output_dir)
         else:
             logging.error("Failed to fetch content for any chapters. EPUB not created.")
 
     finally:
+        if page_pool: page_pool.close()
         if context: context.close()
         close_browser()
+        DEBUG_CAPTURE.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""Shared fixtures: the pipeline runs against benchmark.py's local mock novel site."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark # noqa: E402
+import biquge_epub_creator as creator # noqa: E402
+
+BOOK_URL = 'http://www.dxmwx.org/book/4242.html' # Served by MockNovelSite.render_dxmwx
+CHAPTER_CHARS = 300
+
+@pytest.fixture(scope='session')
+def mock_server():
+    server = benchmark.start_mock_site(10, CHAPTER_CHARS)
+    benchmark.route_crawler_to_mock_site(server)
+    creator.REQUEST_DELAY = 0
+    creator.COVER_CACHE_DIR = None # Keep test runs out of ~/.cache
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def mock_site(mock_server):
+    """The mock server, reset to a 10-chapter book. Call set_chapters(n) to publish more chapters."""
+    def set_chapters(count):
+        mock_server.mock_site = benchmark.MockNovelSite(count, CHAPTER_CHARS)
+    set_chapters(10)
+    mock_server.set_chapters = set_chapters
+    return mock_server
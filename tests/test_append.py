@@ -0,0 +1,70 @@
+import os
+import zipfile
+
+import pytest
+from ebooklib import epub
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+
+def epub_chapter_titles(epub_path):
+    """Titles of the chapter documents in the spine of the EPUB, read back with ebooklib, in reading order."""
+    book = epub.read_epub(epub_path)
+    toc_titles = {link.href: link.title for link in book.toc}
+    spine_names = [book.get_item_with_id(idref).file_name for idref, _ in book.spine]
+    return [toc_titles[name] for name in spine_names if name.startswith('chap_')]
+
+@pytest.mark.parametrize('raw_members', [True, False], ids=['raw-copy', 'zipfile-fallback'])
+def test_append_adds_only_new_chapters(mock_site, tmp_path, monkeypatch, raw_members):
+    if raw_members and not creator.RAW_ZIP_MEMBERS:
+        pytest.skip("raw ZIP member copies are not supported on this Python")
+    monkeypatch.setattr(creator, 'RAW_ZIP_MEMBERS', raw_members)
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub')
+    assert first['status'] == 'ok' and first['chapters'] == 10
+
+    mock_site.set_chapters(20)
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'])
+    assert result['status'] == 'ok'
+    assert result['appended_chapters'] == 10
+    with zipfile.ZipFile(first['epub_path']) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == 'mimetype'
+        assert archive.getinfo('mimetype').compress_type == zipfile.ZIP_STORED
+    titles = epub_chapter_titles(first['epub_path'])
+    assert len(titles) == 20
+    assert titles[0].startswith('第1章') and titles[-1].startswith('第20章')
+    assert [chapter['status'] for chapter in creator.load_build_manifest(first['epub_path'])['chapters']] == ['ok'] * 20
+
+def test_append_without_new_chapters_leaves_epub_unchanged(mock_site, tmp_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub')
+    with open(first['epub_path'], 'rb') as f:
+        before = f.read()
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'])
+    assert result['status'] == 'ok' and result['appended_chapters'] == 0
+    with open(first['epub_path'], 'rb') as f:
+        assert f.read() == before
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def test_append_extends_text_exports(mock_site, tmp_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', formats='epub,txt,txt-chapters')
+    mock_site.set_chapters(12)
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'], formats='epub,txt,txt-chapters')
+    assert result['appended_chapters'] == 2
+    assert result['txt_paths'] == [str(tmp_path / 'book.txt'), str(tmp_path / 'book_chapters')]
+
+    # The same text as a full build of the 12-chapter book
+    rebuilt = creator.build_book(BOOK_URL, output_dir=str(tmp_path / 'rebuilt'), output_filename='book.epub', formats='txt,txt-chapters')
+    assert read_text(tmp_path / 'book.txt') == read_text(rebuilt['txt_paths'][0])
+    assert sorted(os.listdir(tmp_path / 'book_chapters')) == sorted(os.listdir(rebuilt['txt_paths'][1]))
+    assert len(os.listdir(tmp_path / 'book_chapters')) == 12
+
+def test_append_writes_missing_text_export_from_epub(mock_site, tmp_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub')
+    mock_site.set_chapters(12)
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'], formats='epub,txt')
+    assert result['txt_paths'] == [str(tmp_path / 'book.txt')]
+    rebuilt = creator.build_book(BOOK_URL, output_dir=str(tmp_path / 'rebuilt'), output_filename='book.epub', formats='txt')
+    assert read_text(tmp_path / 'book.txt') == read_text(rebuilt['txt_paths'][0])
@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+import benchmark
+import biquge_epub_creator as creator
+
+def test_chapter_behaves_like_the_dict_it_replaces():
+    chapter = creator.Chapter('第1章', 'http://www.dxmwx.org/read/4242_50001.html', volume='第一卷')
+    assert chapter['url'] == 'http://www.dxmwx.org/read/4242_50001.html'
+    assert dict(chapter) == {'title': '第1章', 'url': 'http://www.dxmwx.org/read/4242_50001.html', 'volume': '第一卷'}
+    assert chapter.get('status', 'ok') == 'ok' and 'reason' not in chapter
+    with pytest.raises(KeyError):
+        chapter['content_html']
+
+@pytest.mark.parametrize('count', [1, 30, 2000])
+def test_chapter_records_are_smaller_than_dicts(count):
+    links = [{'title': f'第{n}章 试炼之地', 'url': f'http://www.dxmwx.org/read/4242_{50000 + n}.html'} for n in range(count)]
+    memory = benchmark.measure_chapter_memory(json.loads(json.dumps(links, ensure_ascii=False)))
+    assert memory['record_bytes_per_chapter'] < memory['dict_bytes_per_chapter']
@@ -0,0 +1,99 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+
+def test_shard_broker_lease_and_complete(tmp_path):
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+    links = [{'title': f'Chapter {n}', 'url': f'http://example.com/{n}.html'} for n in range(5)]
+    assert broker.create_job('job', 'http://example.com/', links, shard_size=2) == 3
+
+    shard = broker.lease('worker-a')
+    assert [chapter['index'] for chapter in shard['chapters']] == [0, 1]
+    assert broker.lease('worker-b')['shard_id'] != shard['shard_id']
+    assert broker.complete(shard['shard_id'], 'worker-a', {'chapters': [], 'failed': []})
+    assert not broker.complete(shard['shard_id'], 'worker-b', {'chapters': [], 'failed': []}) # Not worker-b's lease
+    assert broker.job_progress('job') == (1, 3)
+
+def test_shard_broker_hands_out_abandoned_leases(tmp_path):
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+    broker.create_job('job', 'http://example.com/', [{'title': 'Chapter', 'url': 'http://example.com/1.html'}])
+    shard = broker.lease('silent-worker')
+    assert broker.lease('worker-b') is None
+    assert broker.lease('worker-b', lease_timeout=-1)['shard_id'] == shard['shard_id']
+    assert not broker.complete(shard['shard_id'], 'silent-worker', {'chapters': [], 'failed': []})
+
+def test_shard_broker_gives_up_shards_that_keep_failing(tmp_path):
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+    broker.create_job('job', 'http://example.com/', [{'title': 'Chapter', 'url': 'http://example.com/1.html'}])
+    for attempt in range(creator.DISTRIBUTED_MAX_ATTEMPTS):
+        assert broker.lease(f'crashing-worker-{attempt}', lease_timeout=-1) is not None
+    assert broker.lease('worker-b', lease_timeout=-1) is None
+    assert broker.job_activity('job', lease_timeout=-1)[:3] == (0, 1, 1)
+    broker.close_job('job')
+    assert broker.job_results('job') == [{'chapters': [], 'failed': [{'index': 0, 'title': 'Chapter', 'url': 'http://example.com/1.html',
+                                                                      'reason': 'distributed_unfinished'}]}]
+
+def fast_coordinator(monkeypatch):
+    monkeypatch.setattr(creator, 'DISTRIBUTED_LEASE_TIMEOUT', 0.2)
+    monkeypatch.setattr(creator, 'DISTRIBUTED_POLL_INTERVAL', 0.05)
+
+def test_coordinator_without_workers_returns(mock_site, tmp_path, monkeypatch):
+    fast_coordinator(monkeypatch)
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), chapter_fetcher=creator.make_distributed_fetcher(broker, BOOK_URL, 4))
+    assert result['status'] == 'failed'
+    assert 'No chapter content' in result['error']
+
+def test_coordinator_gives_up_unfinished_shards_for_repair(mock_site, tmp_path, monkeypatch):
+    fast_coordinator(monkeypatch)
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+
+    def one_shard_worker(): # Finishes the first shard, then disappears
+        while (shard := broker.lease('worker-a')) is None:
+            time.sleep(0.01)
+        chapters = [{'index': chapter['index'], 'title': chapter['title'], 'content_html': '<p>正文</p>'} for chapter in shard['chapters']]
+        broker.complete(shard['shard_id'], 'worker-a', {'chapters': chapters, 'failed': []})
+    worker = threading.Thread(target=one_shard_worker)
+    worker.start()
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub',
+                                chapter_fetcher=creator.make_distributed_fetcher(broker, BOOK_URL, 4))
+    worker.join()
+    assert result['status'] == 'partial'
+    assert (result['chapters'], result['missing_chapters']) == (4, 6)
+    reasons = {chapter['reason'] for chapter in creator.load_build_manifest(result['epub_path'])['chapters'] if chapter['status'] == 'missing'}
+    assert reasons == {'distributed_unfinished'}
+    assert creator.repair_epub(result['epub_path']) is True
+
+def test_broker_endpoint_requires_token_and_matching_results(tmp_path):
+    broker = creator.SqliteShardBroker(str(tmp_path / 'broker.sqlite3'))
+    broker.create_job('job', 'http://example.com/', [{'title': f'Chapter {n}', 'url': f'http://example.com/{n}.html'} for n in range(4)], shard_size=2)
+    server = creator.serve_broker(broker, 0, 'secret')
+    try:
+        assert server.server_address[0] == '127.0.0.1'
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        session = requests.Session()
+        session.trust_env = False # Ignore the mock site's proxy settings
+        with mock.patch.object(creator, 'HTTP_SESSION', session):
+            with pytest.raises(requests.HTTPError, match='403'):
+                creator.HttpShardBroker(base_url).lease('worker-a')
+            with pytest.raises(requests.HTTPError, match='403'):
+                creator.HttpShardBroker(base_url, token='guess').lease('worker-a')
+
+            worker = creator.HttpShardBroker(base_url, token='secret')
+            shard = worker.lease('worker-a')
+            assert [chapter['index'] for chapter in shard['chapters']] == [0, 1]
+            forged = {'chapters': [{'index': 3, 'title': 'Chapter 3', 'content_html': '<p>forged</p>'}], 'failed': []}
+            with pytest.raises(requests.HTTPError, match='400'): # Chapter 3 belongs to the other shard
+                worker.complete(shard['shard_id'], 'worker-a', forged)
+            result = {'chapters': [{'index': 0, 'title': 'Chapter 0', 'content_html': '<p>x</p>'}],
+                      'failed': [{'index': 1, 'title': 'Chapter 1', 'url': 'http://example.com/1.html', 'reason': 'fetch_error'}]}
+            assert worker.complete(shard['shard_id'], 'worker-a', result)
+    finally:
+        server.shutdown()
+    assert broker.job_progress('job') == (1, 2)
@@ -0,0 +1,28 @@
+import zipfile
+
+import pytest
+from ebooklib import epub
+
+import biquge_epub_creator as creator
+
+def make_chapters(count):
+    return [creator.Chapter(f'Chapter {n}', content_html=f'<p>Paragraph of chapter {n} &amp; more.</p>' * 50) for n in range(1, count + 1)]
+
+@pytest.mark.parametrize('raw_members', [True, False], ids=['parallel', 'zipfile-fallback'])
+@pytest.mark.parametrize('compression', list(creator.COMPRESSION_PROFILES))
+def test_written_epub_is_valid(tmp_path, monkeypatch, raw_members, compression):
+    if raw_members and not creator.RAW_ZIP_MEMBERS:
+        pytest.skip("raw ZIP member writes are not supported on this Python")
+    monkeypatch.setattr(creator, 'RAW_ZIP_MEMBERS', raw_members)
+    epub_path = creator.create_epub('Book', 'Author', 'Description', make_chapters(40), 'http://example.com/book', None,
+                                    str(tmp_path), output_filename='book.epub', compression=compression)
+    with zipfile.ZipFile(epub_path) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist()[0] == 'mimetype'
+        assert archive.getinfo('mimetype').compress_type == zipfile.ZIP_STORED
+        assert all(info.compress_type == zipfile.ZIP_DEFLATED for info in archive.infolist()[1:])
+    book = epub.read_epub(epub_path)
+    assert [link.title for link in book.toc][-40:] == [f'Chapter {n}' for n in range(1, 41)]
+
+def test_raw_member_round_trip():
+    assert creator.raw_zip_members_supported() == creator.RAW_ZIP_MEMBERS
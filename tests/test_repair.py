@@ -0,0 +1,78 @@
+import zipfile
+
+import pytest
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+from test_append import epub_chapter_titles
+
+def fail_chapters(monkeypatch, failing_urls):
+    """Makes fetch_chapter (first attempt and retry pass) fail for the chapter URLs in failing_urls."""
+    real_fetch_chapter = creator.fetch_chapter
+    def flaky_fetch_chapter(chapter_info, site_config, logger=None, **fetch_kwargs):
+        if any(chapter_info['url'].startswith(url) for url in failing_urls):
+            return None, 'fetch_error'
+        return real_fetch_chapter(chapter_info, site_config, logger=logger, **fetch_kwargs)
+    monkeypatch.setattr(creator, 'fetch_chapter', flaky_fetch_chapter)
+
+@pytest.fixture
+def partial_book(mock_site, tmp_path, monkeypatch):
+    """A 10-chapter EPUB built while chapters 3 and 8 could not be fetched."""
+    site_config = creator.get_site_config(BOOK_URL)
+    index_html, _, _, chapter_list_url = creator.fetch_initial_pages(BOOK_URL, site_config)
+    chapter_links = creator.get_chapter_links(index_html, chapter_list_url or BOOK_URL, site_config)
+    failing_urls = [chapter_links[2]['url'], chapter_links[7]['url']]
+    with monkeypatch.context() as patch:
+        fail_chapters(patch, failing_urls)
+        result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub')
+    assert result['status'] == 'partial' and result['missing_chapters'] == 2
+    return result['epub_path'], failing_urls
+
+def test_repair_splices_missing_chapters_in_place(partial_book):
+    epub_path, _ = partial_book
+    assert [chapter['status'] for chapter in creator.load_build_manifest(epub_path)['chapters']].count('missing') == 2
+    assert len(epub_chapter_titles(epub_path)) == 8
+
+    assert creator.repair_epub(epub_path) is True
+    with zipfile.ZipFile(epub_path) as archive:
+        assert archive.testzip() is None
+    titles = epub_chapter_titles(epub_path)
+    assert [title.split('章')[0] for title in titles] == [f'第{number}' for number in range(1, 11)]
+    assert [chapter['status'] for chapter in creator.load_build_manifest(epub_path)['chapters']] == ['ok'] * 10
+    assert creator.repair_epub(epub_path) is True # Nothing left to repair
+
+def test_repair_records_chapters_that_still_fail(partial_book, monkeypatch):
+    epub_path, failing_urls = partial_book
+    fail_chapters(monkeypatch, failing_urls[1:])
+    assert creator.repair_epub(epub_path) is False
+    statuses = [chapter['status'] for chapter in creator.load_build_manifest(epub_path)['chapters']]
+    assert statuses == ['ok'] * 7 + ['missing'] + ['ok'] * 2
+    assert len(epub_chapter_titles(epub_path)) == 9
+
+def test_repair_without_manifest(tmp_path):
+    assert creator.repair_epub(str(tmp_path / 'unknown.epub')) is False
+
+def chapter_member_sizes(epub_path):
+    with zipfile.ZipFile(epub_path) as archive:
+        return {info.filename: info.compress_size for info in archive.infolist() if 'chap_' in info.filename}
+
+@pytest.mark.parametrize('compression', ['fast', 'max'])
+def test_repair_keeps_compression_profile_and_cover(mock_site, tmp_path, monkeypatch, compression):
+    cover = (b'\xff\xd8\xff\xe0 not really a jpeg', 'image/jpeg')
+    monkeypatch.setattr(creator, 'download_cover_image', lambda *args, **kwargs: cover)
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', compression=compression)
+    failing_url = creator.load_build_manifest(first['epub_path'])['chapters'][4]['url']
+    complete_sizes = chapter_member_sizes(first['epub_path'])
+    with monkeypatch.context() as patch:
+        fail_chapters(patch, [failing_url])
+        partial = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', compression=compression)
+    assert partial['missing_chapters'] == 1
+    assert creator.load_build_manifest(partial['epub_path'])['compression'] == compression
+
+    def no_download(*args, **kwargs):
+        raise AssertionError("repair downloaded the cover again")
+    monkeypatch.setattr(creator, 'download_cover_image', no_download)
+    assert creator.repair_epub(partial['epub_path']) is True
+    assert chapter_member_sizes(partial['epub_path']) == complete_sizes # Same deflate level as the original build
+    assert creator.read_epub_cover(partial['epub_path']) == cover
+    assert creator.load_build_manifest(partial['epub_path'])['compression'] == compression
@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+import benchmark
+import biquge_epub_creator as creator
+from conftest import BOOK_URL, CHAPTER_CHARS
+
+def chapter_text(number):
+    return '\n'.join(benchmark.chapter_paragraphs(number, CHAPTER_CHARS))
+
+def unique_term(number, length):
+    """A substring of chapter number's text that no other of the first 20 mock chapters contains."""
+    text = chapter_text(number)
+    others = [chapter_text(other) for other in range(1, 21) if other != number]
+    for start in range(len(text) - length):
+        term = text[start:start + length]
+        if '\n' not in term and '。' not in term and not any(term in other for other in others):
+            return term
+    raise AssertionError(f"no unique {length}-character term in chapter {number}")
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'search.sqlite3')
+    monkeypatch.setattr(creator, 'SEARCH_INDEX_PATH', path)
+    return path
+
+def indexed_chapters(index_path):
+    connection = sqlite3.connect(index_path)
+    try:
+        return connection.execute("SELECT position, url FROM chapters ORDER BY position").fetchall()
+    finally:
+        connection.close()
+
+def test_build_indexes_every_chapter(mock_site, tmp_path, index_path):
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path))
+    assert result['status'] == 'ok'
+    assert [position for position, _ in indexed_chapters(index_path)] == list(range(10))
+
+    hits = creator.SearchIndex(index_path).search(unique_term(7, 4))
+    assert [(hit['position'], hit['chapter_title'], hit['book_title']) for hit in hits] == [(6, benchmark.chapter_title(7), '模拟书4242')]
+    assert '[' in hits[0]['snippet'] and ']' in hits[0]['snippet']
+
+def test_short_terms_use_like_fallback(mock_site, tmp_path, index_path):
+    creator.build_book(BOOK_URL, output_dir=str(tmp_path))
+    search_index = creator.SearchIndex(index_path)
+    term = unique_term(3, 2)
+    hits = search_index.search(term)
+    assert [hit['position'] for hit in hits] == [2]
+    assert f'[{term}]' in hits[0]['snippet']
+    two_characters = chapter_text(5)[10:12]
+    expected = [number - 1 for number in range(1, 11) if two_characters in chapter_text(number)]
+    assert [hit['position'] for hit in search_index.search(two_characters, limit=20)] == expected
+    # A short and a long term together: the trigram match narrows, LIKE filters
+    assert [hit['position'] for hit in search_index.search(f"{unique_term(5, 4)} {two_characters}")] == [4]
+    assert search_index.search(unique_term(5, 4), book_url='http://example.com/other-book') == []
+    with pytest.raises(ValueError):
+        search_index.search('   ')
+
+def test_append_and_rebuild_index_incrementally(mock_site, tmp_path, index_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub')
+    mock_site.set_chapters(13)
+    creator.build_book(BOOK_URL, append_to=first['epub_path'])
+    chapters = indexed_chapters(index_path)
+    assert [position for position, _ in chapters] == list(range(13))
+    creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='again.epub')
+    assert indexed_chapters(index_path) == chapters # Re-indexed in place, no duplicates
+    assert [hit['position'] for hit in creator.SearchIndex(index_path).search(unique_term(12, 4))] == [11]
+
+def test_failed_fetch_still_indexes_fetched_chapters(mock_site, tmp_path, index_path):
+    def fetch_then_fail(chapter_links, site_config, logger=None, failed_chapters=None, on_chapter=None):
+        for index, link in enumerate(chapter_links[:3]):
+            on_chapter(index, creator.Chapter(link['title'], content_html=f'<p>{chapter_text(index + 1)}</p>'))
+        raise ConnectionError("site went away")
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), chapter_fetcher=fetch_then_fail)
+    assert result['status'] == 'failed'
+    assert [position for position, _ in indexed_chapters(index_path)] == [0, 1, 2]
+
+def test_search_index_unavailable_does_not_fail_build(mock_site, tmp_path, monkeypatch):
+    monkeypatch.setattr(creator, 'SEARCH_INDEX_PATH', str(tmp_path / 'missing-dir' / 'search.sqlite3'))
+    assert creator.build_book(BOOK_URL, output_dir=str(tmp_path))['status'] == 'ok'
@@ -0,0 +1,44 @@
+import pytest
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+
+def make_chapter(n):
+    return creator.Chapter(f'Chapter {n}', content_html=f'<p>第{n}段 text</p>' * 20)
+
+def test_spool_spills_to_disk_and_keeps_order(tmp_path):
+    chapters = [make_chapter(n) for n in range(10)]
+    chapter_size = len(chapters[0]['content_html'].encode('utf-8'))
+    with creator.ChapterSpool(memory_threshold=chapter_size * 3, directory=str(tmp_path)) as spool:
+        for n in reversed(range(10)): # Out of order, like the retry pass
+            spool.put(n, chapters[n])
+        assert spool.memory_bytes <= chapter_size * 3
+        assert spool.spooled_bytes > 0
+        assert len(spool) == 10
+        assert [chapter['title'] for chapter in spool] == [f'Chapter {n}' for n in range(10)]
+        assert spool[7]['content_html'] == chapters[7]['content_html']
+        lazy = spool.lazy_chapters(2, 5)
+        assert [chapter['content_html']() for chapter in lazy] == [chapters[n]['content_html'] for n in range(2, 5)]
+        assert spool.content_sizes() == [chapter_size] * 10
+
+def test_spool_reads_after_close_raise(tmp_path):
+    spool = creator.ChapterSpool(memory_threshold=0, directory=str(tmp_path))
+    spool.put(0, make_chapter(0))
+    loader = spool.lazy_chapters()[0]['content_html']
+    spool.close()
+    with pytest.raises(ValueError, match="spool closed"):
+        loader()
+    with pytest.raises(ValueError, match="spool closed"):
+        spool.put(1, make_chapter(1))
+
+def test_build_output_does_not_depend_on_spooling(mock_site, tmp_path, monkeypatch):
+    texts = []
+    for memory_threshold in (10 ** 9, 1500, 0): # All in memory, mixed, all spooled
+        monkeypatch.setattr(creator, 'CHAPTER_SPOOL_MEMORY_THRESHOLD', memory_threshold)
+        output_dir = tmp_path / str(memory_threshold)
+        result = creator.build_book(BOOK_URL, output_dir=str(output_dir), formats='epub,txt')
+        assert result['status'] == 'ok' and result['chapters'] == 10
+        with open(result['txt_paths'][0], encoding='utf-8') as f:
+            texts.append(f.read())
+    assert texts[0] == texts[1] == texts[2]
+    assert texts[0].count('\n\n第') == 10 # One heading per chapter
@@ -0,0 +1,72 @@
+import os
+import zipfile
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+
+def test_split_by_chapter_count(mock_site, tmp_path):
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', volumes='chapters:4')
+    assert result['status'] == 'ok'
+    assert [os.path.basename(path) for path in result['volume_paths']] == ['book_01.epub', 'book_02.epub', 'book_03.epub']
+    assert result['epub_path'] == result['volume_paths'][-1]
+    chapter_counts = []
+    for path in result['volume_paths']:
+        with zipfile.ZipFile(path) as archive:
+            assert archive.testzip() is None
+        manifest = creator.load_build_manifest(path)
+        assert manifest['volume']['count'] == 3
+        chapter_counts.append(len(manifest['chapters']))
+    assert chapter_counts == [4, 4, 2]
+
+def test_split_by_size_keeps_every_chapter(mock_site, tmp_path):
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), volumes='size:0.003') # About three chapters of mock text
+    assert result['status'] == 'ok'
+    assert len(result['volume_paths']) > 1
+    assert sum(len(creator.load_build_manifest(path)['chapters']) for path in result['volume_paths']) == 10
+
+def test_headings_rejected_for_site_without_heading_selector(mock_site, tmp_path):
+    site_config = creator.get_site_config(BOOK_URL)
+    assert not creator.site_has_volume_headings(site_config)
+    result = creator.build_book(BOOK_URL, output_dir=str(tmp_path), volumes='headings')
+    assert result['status'] == 'failed'
+    assert 'volume headings' in result['error']
+    assert os.listdir(tmp_path) == [] # Rejected before crawling
+
+def test_split_volumes_by_headings():
+    links = [creator.Chapter(f'Chapter {n}', f'http://example.com/{n}.html', volume='第一卷' if n <= 3 else '第二卷') for n in range(1, 6)]
+    volumes = creator.split_volumes(links, [{'content_html': '<p>x</p>'}] * 5, [], 'headings', None)
+    assert [(volume['start'], volume['end'], volume['title']) for volume in volumes] == [(0, 3, '第一卷'), (3, 5, '第二卷')]
+
+def test_append_to_last_volume_adds_only_chapters_after_it(mock_site, tmp_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', volumes='chapters:4')
+    mock_site.set_chapters(12)
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'])
+    assert result['status'] == 'ok' and result['appended_chapters'] == 2
+    assert not any(name.startswith('book_03_') for name in os.listdir(tmp_path)) # Not rebuilt as book_03_NN.epub volumes
+    manifest = creator.load_build_manifest(first['epub_path'])
+    assert manifest['volume']['number'] == 3
+    assert [chapter['title'].split('章')[0] for chapter in manifest['chapters']] == ['第9', '第10', '第11', '第12']
+    assert [chapter['title'].split('章')[0] for chapter in creator.read_epub_chapters(first['epub_path'])] == ['第9', '第10', '第11', '第12']
+    with zipfile.ZipFile(first['epub_path']) as archive:
+        assert archive.testzip() is None
+
+def test_append_to_earlier_volume_is_refused(mock_site, tmp_path):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', volumes='chapters:4')
+    first_volume = first['volume_paths'][0]
+    with open(first_volume, 'rb') as f:
+        before = f.read()
+    mock_site.set_chapters(12)
+    result = creator.build_book(BOOK_URL, append_to=first_volume)
+    assert result['status'] == 'failed'
+    assert 'last volume' in result['error']
+    with open(first_volume, 'rb') as f:
+        assert f.read() == before
+
+def test_volume_that_no_longer_fits_is_rebuilt_as_split_book(mock_site, tmp_path, monkeypatch):
+    first = creator.build_book(BOOK_URL, output_dir=str(tmp_path), output_filename='book.epub', volumes='chapters:4')
+    monkeypatch.setattr(creator, 'get_appended_chapter_links', lambda manifest_chapters, chapter_links: None) # Chapters changed mid-book
+    assert creator.build_book(BOOK_URL, append_to=first['epub_path'])['status'] == 'failed' # Would need the volume split
+    result = creator.build_book(BOOK_URL, append_to=first['epub_path'], volumes='chapters:4')
+    assert result['status'] == 'ok'
+    assert result['volume_paths'] == first['volume_paths']
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.epub')) == ['book_01.epub', 'book_02.epub', 'book_03.epub']
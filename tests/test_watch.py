@@ -0,0 +1,93 @@
+import json
+import os
+
+import biquge_epub_creator as creator
+from conftest import BOOK_URL
+
+def write_library(tmp_path, **book_options):
+    library_path = tmp_path / 'library.json'
+    library_path.write_text(json.dumps({'books': [dict(book_options, url=BOOK_URL)], 'output_dir': str(tmp_path)}))
+    return str(library_path)
+
+def poll_again(tmp_path, state, forget_page=False):
+    state[BOOK_URL]['next_poll'] = 0
+    if forget_page: # As if the chapter list page changed without new chapters
+        for key in ('etag', 'last_modified', 'page_digest'):
+            state[BOOK_URL].pop(key, None)
+    creator.save_watch_state(str(tmp_path / 'watch_state.json'), state)
+
+def test_watch_builds_then_appends_new_chapters(mock_site, tmp_path):
+    library_path = write_library(tmp_path, format='epub,txt', compression='fast')
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['status'] == 'ok'
+    assert state[BOOK_URL]['last_build']['chapters'] == 10
+    assert any(name.endswith('.txt') for name in os.listdir(tmp_path)) # The book's 'format' key is honoured
+
+    mock_site.set_chapters(12)
+    poll_again(tmp_path, state)
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['appended_chapters'] == 2
+    assert not state[BOOK_URL].get('queued')
+    txt_names = [name for name in os.listdir(tmp_path) if name.endswith('.txt')]
+    assert len(txt_names) == 1
+    with open(tmp_path / txt_names[0], encoding='utf-8') as f:
+        assert '第12章' in f.read() # The text export got the appended chapters too
+
+def test_watch_records_failed_build_and_returns(mock_site, tmp_path, monkeypatch):
+    library_path = write_library(tmp_path)
+    def failing_build_book(*args, **kwargs):
+        raise RuntimeError("build exploded")
+    monkeypatch.setattr(creator, 'build_book', failing_build_book)
+    state = creator.run_watch(library_path, once=True) # Must not hang in build_queue.join()
+    assert state[BOOK_URL]['last_build'] == {'status': 'failed', 'error': 'build exploded'}
+    assert not state[BOOK_URL].get('queued')
+
+def test_watch_appends_to_last_volume_of_split_book(mock_site, tmp_path):
+    library_path = write_library(tmp_path, output='book.epub', volumes='chapters:4')
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['chapters'] == 10
+    assert len(state[BOOK_URL]['known_urls']) == 10
+    assert [os.path.basename(path) for path in state[BOOK_URL]['output_paths']] == ['book_01.epub', 'book_02.epub', 'book_03.epub']
+
+    poll_again(tmp_path, state, forget_page=True)
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['chapters'] == 10 # Chapters of earlier volumes are not "new": no build
+    assert state[BOOK_URL]['interval'] > creator.WATCH_DEFAULT_INTERVAL
+
+    mock_site.set_chapters(12)
+    poll_again(tmp_path, state)
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['appended_chapters'] == 2
+    assert len(state[BOOK_URL]['known_urls']) == 12
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.epub')) == ['book_01.epub', 'book_02.epub', 'book_03.epub']
+    assert len(creator.load_build_manifest(str(tmp_path / 'book_03.epub'))['chapters']) == 4
+
+def test_watch_tracks_text_only_books(mock_site, tmp_path):
+    library_path = write_library(tmp_path, output='book.epub', format='txt')
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['status'] == 'ok'
+    assert state[BOOK_URL]['epub_path'] is None
+    assert state[BOOK_URL]['output_paths'] == [str(tmp_path / 'book.txt')]
+
+    poll_again(tmp_path, state, forget_page=True)
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['elapsed_seconds'] is not None
+    first_interval = state[BOOK_URL]['interval']
+    assert first_interval > creator.WATCH_DEFAULT_INTERVAL # Backs off instead of rebuilding every poll
+    with open(tmp_path / 'book.txt', encoding='utf-8') as f:
+        assert '第11章' not in f.read()
+
+    mock_site.set_chapters(12)
+    poll_again(tmp_path, state)
+    state = creator.run_watch(library_path, once=True)
+    assert state[BOOK_URL]['last_build']['chapters'] == 12 # Rebuilt, since text can't be appended to an EPUB
+    with open(tmp_path / 'book.txt', encoding='utf-8') as f:
+        assert '第12章' in f.read()
+
+def test_watch_rebuilds_when_an_output_is_deleted(mock_site, tmp_path):
+    library_path = write_library(tmp_path, output='book.epub', format='epub,txt')
+    state = creator.run_watch(library_path, once=True)
+    os.remove(tmp_path / 'book.txt')
+    poll_again(tmp_path, state, forget_page=True)
+    state = creator.run_watch(library_path, once=True)
+    assert os.path.exists(tmp_path / 'book.txt')